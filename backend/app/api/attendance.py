@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, status, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, Body, status, Query, Path, Request
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime, date, timedelta
 from typing import List, Optional
 import base64
@@ -15,8 +16,15 @@ from app.schemas import ClockInRequest, ClockOutRequest, ClockRecordResponse, St
 from app.auth import get_current_employee, get_current_admin
 from app.api import auth
 from app.config import settings
-from models.mask_detection import detect_mask
-from models.face_recognition import recognize_face, detect_faces
+from app.face_store import ensure_face_gallery, registered_face_count
+from app.vision import run_vision, admit_recognition, recognition_slot, kiosk_id, VisionTimeout
+from app.punch_replay import punch_replay_cache, payload_key
+from app.punch_debounce import punch_debouncer
+from app.face_batching import recognize_frame
+from app.mask_verification import mask_verifier
+from app.uploads import ImageUpload, read_image_upload
+from models.frame_analysis import FrameAnalysis
+from models.image_decode import ImageTooLarge, decode_bgr
 
 # 避免循環導入
 notify_attendance_func = None
@@ -26,35 +34,108 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+async def decode_image_or_413(image_data, deadline):
+    """解碼打卡圖像 (供需登入的打卡接口使用)，圖像過大回應 413，無法解碼回應 400"""
+    try:
+        image_np, _ = await run_vision_or_503(decode_bgr, image_data, deadline=deadline)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"圖像解碼失敗: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="圖像數據格式錯誤，無法解碼")
+    return image_np
+
+async def run_vision_or_503(func, *args, deadline=None):
+    """在視覺執行緒池中執行，逾時時以 503 回應 (供需登入的打卡接口使用)"""
+    try:
+        return await run_vision(func, *args, deadline=deadline)
+    except VisionTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="系統忙碌，人臉辨識逾時，請稍後再試"
+        )
+
+async def recognize_frame_or_503(frame, deadline):
+    """識別人臉 (可能與其他請求合併比對)，逾時時以 503 回應"""
+    try:
+        return await recognize_frame(frame, deadline)
+    except VisionTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="系統忙碌，人臉辨識逾時，請稍後再試"
+        )
+
 # 直接打卡 (無需登入驗證)
 @router.post("/direct-clock", status_code=status.HTTP_201_CREATED)
 async def direct_clock(
     request: DirectClockRequest,
+    http_request: Request,
     db: Session = Depends(get_db),
 ):
     """
     基於人臉辨識的直接打卡功能，無需登入
     任何人都可以通過攝像頭人臉識別進行打卡
     """
+    return await replay_or_direct_clock(http_request, request.image, request.with_mask, request.face_box, db)
+
+# 直接打卡 (二進制圖像上傳，省去 base64 編碼)
+@router.post("/direct-clock/image", status_code=status.HTTP_201_CREATED)
+async def direct_clock_image(
+    http_request: Request,
+    upload: ImageUpload = Depends(read_image_upload),
+    db: Session = Depends(get_db),
+):
+    """
+    與 /direct-clock 相同，圖像以 image/jpeg 原始內容或 multipart 的 image 欄位上傳，
+    with_mask 與 face_box ("x,y,width,height") 放在查詢參數或表單欄位中
+    """
+    return await replay_or_direct_clock(
+        http_request, upload.data, upload.get_bool("with_mask"), upload.get_face_box(), db
+    )
+
+async def replay_or_direct_clock(http_request, image_data, with_mask, face_box, db):
+    """重複提交的相同影像直接回放上次的結果，否則取得視覺處理名額後打卡
+
+    在取得名額之前檢查，重複的請求不佔用視覺處理隊列。
+    """
+    kiosk = kiosk_id(http_request) if settings.PUNCH_REPLAY_PER_KIOSK else ""
+    key = payload_key(image_data, kiosk, with_mask)
+
+    async def process():
+        async with recognition_slot(http_request) as deadline:
+            return await process_direct_clock(image_data, with_mask, face_box, db, deadline)
+
+    return await punch_replay_cache.run(key, process)
+
+async def process_direct_clock(image_data, with_mask, face_box, db, deadline):
+    """直接打卡的處理流程，image_data 為 base64 字符串或圖像二進制數據"""
     try:
+        # 圖像解碼、人臉檢測、識別與口罩檢測都在視覺執行緒池中執行，共用准入時取得的處理時限
         # 記錄請求詳情以協助調試
-        logger.info(f"收到直接打卡請求 - 圖像長度: {len(request.image) if request.image else 0}字節, 口罩狀態: {request.with_mask}")
+        logger.info(f"收到直接打卡請求 - 圖像長度: {len(image_data) if image_data else 0}字節, 口罩狀態: {with_mask}")
         
         # 檢查圖像數據格式
-        if not request.image:
+        if not image_data:
             logger.error("無圖像數據")
             return {
                 "success": False,
                 "detail": "請提供有效的圖像數據"
             }
         
-        # 解碼 base64 圖像
+        # 解碼圖像 (base64 或二進制)
         try:
-            image_bytes = base64.b64decode(request.image)
-            logger.info(f"圖像解碼成功，大小: {len(image_bytes)}字節")
-            image = Image.open(io.BytesIO(image_bytes))
-            image_np = np.array(image)
+            image_np, scale = await run_vision(decode_bgr, image_data, deadline=deadline)
             logger.info(f"圖像轉換為numpy數組成功，形狀: {image_np.shape}")
+        except VisionTimeout:
+            raise
+        except ImageTooLarge as size_error:
+            logger.error(f"圖像過大: {str(size_error)}")
+            return {
+                "success": False,
+                "detail": "圖像過大，請降低攝像頭解析度後再試"
+            }
         except Exception as img_error:
             logger.error(f"圖像解碼或轉換失敗: {str(img_error)}")
             return {
@@ -62,9 +143,17 @@ async def direct_clock(
                 "detail": "圖像數據格式錯誤，無法解碼"
             }
         
+        # 解碼後的影像只做一次灰度轉換與人臉檢測，結果供識別與口罩檢測共用
+        # 若前端提供了人臉框，只在其附近確認人臉，失敗時才檢測整張圖像
+        # 人臉框為原始影格座標，縮小解碼時按相同倍數換算
+        face_roi = None
+        if face_box:
+            face_roi = (face_box.x / scale, face_box.y / scale, face_box.width / scale, face_box.height / scale)
+        frame = FrameAnalysis(image_np, face_roi)
+        
         # 先檢測圖像中是否包含人臉
         logger.info("開始檢測人臉...")
-        face_detected = detect_faces(image_np)
+        face_detected = await run_vision(frame.detect, deadline=deadline)
         if face_detected:
             logger.info(f"檢測到人臉: {face_detected}")
         else:
@@ -74,27 +163,14 @@ async def direct_clock(
                 "detail": "未在圖像中檢測到人臉，請確保面部清晰可見"
             }
         
-        # 從數據庫加載所有人臉編碼數據
+        # 確保人臉特徵庫已載入（僅進程內第一次打卡時讀取數據庫）
+        # 載入、增量同步與寫入快照都有資料庫讀取與文件 I/O，在執行緒池中執行以免阻塞事件循環；
+        # 不使用視覺執行緒池的時限，逾時返回後背景仍在使用同一個資料庫會話
         try:
-            logger.info("從數據庫加載所有人臉編碼數據...")
-            # 查詢所有有人臉編碼的員工
-            employees_with_face = db.query(Employee).filter(Employee.face_encoding.isnot(None)).all()
-            
-            # 轉換為人臉編碼字典
-            face_encodings = {}
-            for emp in employees_with_face:
-                try:
-                    encoding = json.loads(emp.face_encoding)
-                    face_encodings[str(emp.id)] = encoding
-                    logger.info(f"加載員工ID {emp.id} 的人臉編碼數據成功")
-                except Exception as encoding_error:
-                    logger.error(f"解析員工 {emp.id} 的人臉編碼失敗: {str(encoding_error)}")
-                    continue
-            
-            logger.info(f"成功從數據庫加載 {len(face_encodings)} 筆人臉編碼數據")
+            gallery = await run_in_threadpool(ensure_face_gallery, db)
             
             # 如果沒有人臉編碼數據，直接返回錯誤
-            if not face_encodings:
+            if not len(gallery):
                 logger.warning("數據庫中沒有人臉編碼數據")
                 return {
                     "success": False,
@@ -107,16 +183,16 @@ async def direct_clock(
                 "detail": "讀取人臉數據時出錯，請聯繫管理員"
             }
         
-        # 嘗試識別人臉（將人臉編碼數據傳遞給識別函數）
+        # 嘗試識別人臉（與常駐的人臉特徵庫比對）
         logger.info("開始識別人臉...")
-        employee_id = recognize_face(image_np, face_encodings)
+        employee_id = await recognize_frame(frame, deadline)
         
         # 如果無法識別人臉，返回明確的錯誤信息
         if not employee_id:
             logger.warning("無法識別人臉或該人臉未註冊")
             
-            # 檢查是否有任何註冊的人臉數據
-            face_count = db.query(Employee).filter(Employee.face_encoding.isnot(None)).count()
+            # 檢查是否有任何註冊的人臉數據 (以資料庫為準，其他工作進程可能剛刪除所有人臉)
+            face_count = registered_face_count(db)
             logger.info(f"系統中已註冊的人臉數量: {face_count}")
             
             if face_count == 0:
@@ -129,6 +205,12 @@ async def direct_clock(
                 "detail": detail
             }
         
+        # 同一員工在防抖時間內再次被識別時，直接返回上次的打卡結果，不查詢資料庫也不寫入下班卡
+        debounced = punch_debouncer.recent(employee_id)
+        if debounced is not None:
+            logger.info(f"員工ID {employee_id} 在防抖時間內重複打卡，返回上次的結果")
+            return debounced
+        
         # 查詢員工信息
         employee = db.query(Employee).filter(Employee.id == employee_id).first()
         if not employee:
@@ -142,22 +224,11 @@ async def direct_clock(
         today = date.today()
         logger.info(f"嘗試為員工 {employee.name} (ID: {employee_id}) 打卡，日期: {today}")
         
-        # 保存口罩狀態 - 使用前端傳來的數據或系統檢測結果
-        has_mask = request.with_mask
+        # 保存口罩狀態 - 使用前端傳來的數據
+        # 後端口罩檢測不在回應路徑上執行：打卡寫入後排入背景驗證，結果與不一致標記寫回打卡記錄
+        has_mask = with_mask
         logger.info(f"前端傳來的口罩狀態: {'已佩戴' if has_mask else '未佩戴'}")
         
-        # 可選：添加後端口罩檢測驗證（如果前端傳來已佩戴口罩的狀態）
-        if has_mask:
-            logger.info("驗證前端傳來的口罩狀態...")
-            backend_mask_result = detect_mask(image_np)
-            logger.info(f"後端口罩檢測結果: {'已佩戴' if backend_mask_result else '未佩戴'}")
-            
-            # 如果前端說有口罩但後端檢測沒有，記錄這個不一致
-            if not backend_mask_result:
-                logger.warning("前端與後端口罩檢測結果不一致！前端: 已佩戴, 後端: 未佩戴")
-                # 可以選擇使用後端結果覆蓋前端結果
-                # has_mask = backend_mask_result
-        
         # 檢查今天是否已經有打卡記錄 - 使用安全的SQL查詢
         existing_record = db.query(ClockRecord).filter(
             ClockRecord.employee_id == employee_id,
@@ -167,6 +238,12 @@ async def direct_clock(
         now = datetime.now()
         logger.info(f"當前時間: {now}")
         
+        # 防抖的資料庫後備：其他工作進程剛寫入的打卡同樣不重複處理
+        debounced = punch_debouncer.from_record(existing_record, employee.name, now)
+        if debounced is not None:
+            logger.info(f"員工 {employee.name} 在防抖時間內重複打卡 (依資料庫記錄)，返回上次的結果")
+            return debounced
+        
         if not existing_record:
             # 創建新的上班打卡記錄
             try:
@@ -181,18 +258,21 @@ async def direct_clock(
                 db.commit()
                 db.refresh(new_record)
                 logger.info(f"上班打卡成功 - 記錄ID: {new_record.id}, 員工: {employee.name}, 時間: {now}")
+                mask_verifier.submit(new_record.id, "clock_in", now, has_mask, frame.face_crop())
                 
                 # 異步通知
                 if notify_attendance_func:
                     await notify_attendance_func(employee_id, f"{employee.name} 完成上班打卡")
                 
-                return {
+                result = {
                     "success": True,
                     "message": "上班打卡成功",
                     "employee_name": employee.name,
                     "timestamp": now.isoformat(),
                     "type": "clock_in"
                 }
+                punch_debouncer.remember(employee_id, result)
+                return result
             except Exception as db_error:
                 logger.error(f"數據庫提交上班打卡記錄時失敗: {str(db_error)}")
                 db.rollback()
@@ -213,22 +293,29 @@ async def direct_clock(
                     
                     # 更新with_mask字段
                     existing_record.with_mask = has_mask
+                    # 上班打卡的驗證結果不適用於下班時的口罩狀態，等待重新驗證
+                    existing_record.mask_verified = None
+                    existing_record.mask_mismatch = None
+                    existing_record.mask_verified_at = None
                     
                     db.commit()
                     db.refresh(existing_record)
                     logger.info(f"下班打卡成功 - 記錄ID: {existing_record.id}, 員工: {employee.name}, 時間: {now}")
+                    mask_verifier.submit(existing_record.id, "clock_out", now, has_mask, frame.face_crop())
                     
                     # 異步通知
                     if notify_attendance_func:
                         await notify_attendance_func(employee_id, f"{employee.name} 完成下班打卡")
                     
-                    return {
+                    result = {
                         "success": True,
                         "message": "下班打卡成功",
                         "employee_name": employee.name,
                         "timestamp": now.isoformat(),
                         "type": "clock_out"
                     }
+                    punch_debouncer.remember(employee_id, result)
+                    return result
                 except Exception as db_error:
                     logger.error(f"數據庫提交下班打卡記錄時失敗: {str(db_error)}")
                     db.rollback()
@@ -247,6 +334,11 @@ async def direct_clock(
                     "type": "completed"
                 }
                 
+    except VisionTimeout:
+        return {
+            "success": False,
+            "detail": "系統忙碌，人臉辨識逾時，請稍後再試"
+        }
     except Exception as e:
         error_details = traceback.format_exc()
         logger.error(f"打卡錯誤詳情: {error_details}")
@@ -263,44 +355,45 @@ async def clock_in(
     request: ClockInRequest,
     db: Session = Depends(get_db),
     current_employee: Employee = Depends(get_current_employee),
+    deadline: float = Depends(admit_recognition),
+):
+    return await process_clock_in(request.employee_id, request.image, request.has_mask, db, current_employee, deadline)
+
+# 上班打卡 (二進制圖像上傳，employee_id 與 has_mask 放在查詢參數或表單欄位中)
+@router.post("/clock-in/image", status_code=status.HTTP_201_CREATED)
+async def clock_in_image(
+    upload: ImageUpload = Depends(read_image_upload),
+    db: Session = Depends(get_db),
+    current_employee: Employee = Depends(get_current_employee),
+    deadline: float = Depends(admit_recognition),
 ):
+    return await process_clock_in(
+        upload.get_int("employee_id"), upload.data, upload.get_bool("has_mask"), db, current_employee, deadline
+    )
+
+async def process_clock_in(employee_id, image_data, with_mask, db, current_employee, deadline):
+    """上班打卡的處理流程，image_data 為 base64 字符串或圖像二進制數據"""
     # 檢查是否為本人打卡或管理員操作
-    if current_employee.id != request.employee_id and not current_employee.is_admin:
+    if current_employee.id != employee_id and not current_employee.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="無權為其他員工打卡"
         )
     
     # 獲取目標員工
-    employee = db.query(Employee).filter(Employee.id == request.employee_id).first()
+    employee = db.query(Employee).filter(Employee.id == employee_id).first()
     if not employee:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="找不到該員工"
         )
     
-    # 解碼 base64 圖像
-    image_bytes = base64.b64decode(request.image)
-    image = Image.open(io.BytesIO(image_bytes))
-    image_np = np.array(image)
+    # 解碼圖像
+    image_np = await decode_image_or_413(image_data, deadline)
     
-    # 從數據庫加載人臉編碼數據
+    # 確保人臉特徵庫已載入
     try:
-        logger.info("從數據庫加載人臉編碼數據...")
-        # 查詢所有有人臉編碼的員工
-        employees_with_face = db.query(Employee).filter(Employee.face_encoding.isnot(None)).all()
-        
-        # 轉換為人臉編碼字典
-        face_encodings = {}
-        for emp in employees_with_face:
-            try:
-                encoding = json.loads(emp.face_encoding)
-                face_encodings[str(emp.id)] = encoding
-            except Exception as e:
-                logger.error(f"解析員工 {emp.id} 的人臉編碼失敗: {str(e)}")
-                continue
-        
-        logger.info(f"從數據庫加載了 {len(face_encodings)} 筆人臉編碼資料")
+        await run_in_threadpool(ensure_face_gallery, db)
     except Exception as e:
         logger.error(f"加載人臉編碼數據失敗: {str(e)}")
         raise HTTPException(
@@ -308,25 +401,26 @@ async def clock_in(
             detail="人臉資料載入失敗，請重試"
         )
     
-    # 進行人臉辨識驗證 (傳入編碼資料)
-    recognized_id = recognize_face(image_np, face_encodings)
+    # 進行人臉辨識驗證
+    frame = FrameAnalysis(image_np)
+    recognized_id = await recognize_frame_or_503(frame, deadline)
     
-    # 驗證人臉辨識結果，確保是本人打卡
-    if recognized_id != request.employee_id:
+    # 驗證人臉辨識結果，確保是本人打卡 (特徵庫中的員工ID為字符串)
+    if recognized_id != str(employee_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="人臉辨識失敗，無法驗證身份"
         )
     
     # 檢測是否有戴口罩
-    has_mask = detect_mask(image_np) if request.has_mask else False
+    has_mask = await run_vision_or_503(frame.detect_mask, deadline=deadline) if with_mask else False
     
     # 獲取今天的日期
     today = date.today()
     
     # 檢查今天是否已經有打卡記錄
     existing_record = db.query(ClockRecord).filter(
-        ClockRecord.employee_id == request.employee_id,
+        ClockRecord.employee_id == employee_id,
         ClockRecord.date == today
     ).first()
     
@@ -341,7 +435,7 @@ async def clock_in(
     now = datetime.now()
     if not existing_record:
         new_record = ClockRecord(
-            employee_id=request.employee_id,
+            employee_id=employee_id,
             date=today,
             clock_in=now,
             with_mask=has_mask
@@ -356,7 +450,7 @@ async def clock_in(
     # 異步通知
     if notify_attendance_func:
         await notify_attendance_func("clock_in", {
-            "employee_id": request.employee_id,
+            "employee_id": employee_id,
             "employee_name": employee.name,
             "timestamp": now.isoformat(),
             "with_mask": has_mask
@@ -374,44 +468,43 @@ async def clock_out(
     request: ClockOutRequest,
     db: Session = Depends(get_db),
     current_employee: Employee = Depends(get_current_employee),
+    deadline: float = Depends(admit_recognition),
+):
+    return await process_clock_out(request.employee_id, request.image, db, current_employee, deadline)
+
+# 下班打卡 (二進制圖像上傳，employee_id 放在查詢參數或表單欄位中)
+@router.post("/clock-out/image", status_code=status.HTTP_200_OK)
+async def clock_out_image(
+    upload: ImageUpload = Depends(read_image_upload),
+    db: Session = Depends(get_db),
+    current_employee: Employee = Depends(get_current_employee),
+    deadline: float = Depends(admit_recognition),
 ):
+    return await process_clock_out(upload.get_int("employee_id"), upload.data, db, current_employee, deadline)
+
+async def process_clock_out(employee_id, image_data, db, current_employee, deadline):
+    """下班打卡的處理流程，image_data 為 base64 字符串或圖像二進制數據"""
     # 檢查是否為本人打卡或管理員操作
-    if current_employee.id != request.employee_id and not current_employee.is_admin:
+    if current_employee.id != employee_id and not current_employee.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="無權為其他員工打卡"
         )
     
     # 獲取目標員工
-    employee = db.query(Employee).filter(Employee.id == request.employee_id).first()
+    employee = db.query(Employee).filter(Employee.id == employee_id).first()
     if not employee:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="找不到該員工"
         )
     
-    # 解碼 base64 圖像
-    image_bytes = base64.b64decode(request.image)
-    image = Image.open(io.BytesIO(image_bytes))
-    image_np = np.array(image)
+    # 解碼圖像
+    image_np = await decode_image_or_413(image_data, deadline)
     
-    # 從數據庫加載人臉編碼數據
+    # 確保人臉特徵庫已載入
     try:
-        logger.info("從數據庫加載人臉編碼數據...")
-        # 查詢所有有人臉編碼的員工
-        employees_with_face = db.query(Employee).filter(Employee.face_encoding.isnot(None)).all()
-        
-        # 轉換為人臉編碼字典
-        face_encodings = {}
-        for emp in employees_with_face:
-            try:
-                encoding = json.loads(emp.face_encoding)
-                face_encodings[str(emp.id)] = encoding
-            except Exception as e:
-                logger.error(f"解析員工 {emp.id} 的人臉編碼失敗: {str(e)}")
-                continue
-        
-        logger.info(f"從數據庫加載了 {len(face_encodings)} 筆人臉編碼資料")
+        await run_in_threadpool(ensure_face_gallery, db)
     except Exception as e:
         logger.error(f"加載人臉編碼數據失敗: {str(e)}")
         raise HTTPException(
@@ -419,11 +512,12 @@ async def clock_out(
             detail="人臉資料載入失敗，請重試"
         )
     
-    # 進行人臉辨識驗證 (傳入編碼資料)
-    recognized_id = recognize_face(image_np, face_encodings)
+    # 進行人臉辨識驗證
+    frame = FrameAnalysis(image_np)
+    recognized_id = await recognize_frame_or_503(frame, deadline)
     
-    # 驗證人臉辨識結果，確保是本人打卡
-    if recognized_id != request.employee_id:
+    # 驗證人臉辨識結果，確保是本人打卡 (特徵庫中的員工ID為字符串)
+    if recognized_id != str(employee_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="人臉辨識失敗，無法驗證身份"
@@ -434,7 +528,7 @@ async def clock_out(
     
     # 檢查今天是否有打卡記錄
     record = db.query(ClockRecord).filter(
-        ClockRecord.employee_id == request.employee_id,
+        ClockRecord.employee_id == employee_id,
         ClockRecord.date == today
     ).first()
     
@@ -458,7 +552,7 @@ async def clock_out(
     # 異步通知
     if notify_attendance_func:
         await notify_attendance_func("clock_out", {
-            "employee_id": request.employee_id,
+            "employee_id": employee_id,
             "employee_name": employee.name,
             "timestamp": now.isoformat()
         })
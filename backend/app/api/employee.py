@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body, UploadFile, File
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 import base64
 import io
@@ -17,7 +18,14 @@ from app.database import get_db, Employee
 from app.schemas import EmployeeCreate, EmployeeUpdate, EmployeeResponse, StandardResponse, FaceRegistrationRequest
 from app.auth import get_current_admin, get_password_hash
 from app.api import auth
-from models.face_recognition import register_face as face_model_register
+from app.face_store import (
+    ensure_face_gallery, store_face_encoding, sync_employee_face, remove_employee_face, record_face_change,
+    face_gallery_status
+)
+from app.vision import run_vision, admit_recognition, VisionTimeout
+from app.face_batching import recognize_frame
+from app.uploads import ImageUpload, read_image_upload
+from models.face_recognition import register_face as face_model_register, face_gallery
 
 router = APIRouter()
 
@@ -41,6 +49,23 @@ async def get_all_employees(
     employees = db.query(Employee).offset(skip).limit(limit).all()
     return employees
 
+@router.get("/face-gallery", status_code=status.HTTP_200_OK)
+async def get_face_gallery_status(
+    db: Session = Depends(get_db),
+    current_user: Employee = Depends(auth.get_current_active_user)
+):
+    """
+    查看本工作進程人臉特徵庫的人數、記憶體用量與同步狀態 (僅管理員可用)
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="無權訪問此資源，需要管理員權限"
+        )
+
+    await run_in_threadpool(ensure_face_gallery, db)
+    return await run_in_threadpool(face_gallery_status, db)
+
 @router.get("/{employee_id}", response_model=EmployeeResponse)
 async def get_employee(
     employee_id: int,
@@ -185,37 +210,67 @@ async def delete_employee(
         )
     
     db.delete(employee)
+    record_face_change(db, employee_id, "delete")
     db.commit()
     
+    # 從人臉特徵庫移除已刪除員工，避免繼續被匹配
+    remove_employee_face(employee_id)
+    
     return None
 
 @router.post("/register-face", status_code=status.HTTP_200_OK)
 async def register_face_handler(
     request: FaceRegistrationRequest,
     db: Session = Depends(get_db),
-    current_user: Employee = Depends(auth.get_current_active_user)
+    current_user: Employee = Depends(auth.get_current_active_user),
+    deadline: float = Depends(admit_recognition)
 ):
     """
     註冊或更新員工的人臉數據
     """
+    return await process_register_face(request.employee_id, request.image, db, current_user, deadline)
+
+@router.post("/register-face/image", status_code=status.HTTP_200_OK)
+async def register_face_image_handler(
+    upload: ImageUpload = Depends(read_image_upload),
+    db: Session = Depends(get_db),
+    current_user: Employee = Depends(auth.get_current_active_user),
+    deadline: float = Depends(admit_recognition)
+):
+    """
+    註冊或更新員工的人臉數據 (二進制圖像上傳，employee_id 放在查詢參數或表單欄位中)
+    """
+    return await process_register_face(upload.get_int("employee_id"), upload.data, db, current_user, deadline)
+
+async def process_register_face(employee_id, image_data, db, current_user, deadline):
+    """人臉註冊的處理流程，image_data 為 base64 字符串或圖像二進制數據"""
     # 檢查權限 - 只能為自己註冊人臉或管理員可以為所有人註冊
-    if current_user.id != request.employee_id and not current_user.is_admin:
+    if current_user.id != employee_id and not current_user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="無權為其他員工註冊人臉"
         )
     
     # 獲取員工
-    employee = db.query(Employee).filter(Employee.id == request.employee_id).first()
+    employee = db.query(Employee).filter(Employee.id == employee_id).first()
     if not employee:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="找不到該員工"
         )
     
+    # 特徵庫已達人數上限時拒絕新員工註冊 (已註冊者更新人臉不受限)
+    await run_in_threadpool(ensure_face_gallery, db)
+    if not face_gallery.has_room(employee.id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"人臉特徵庫已達上限 ({face_gallery.max_entries} 人)，無法註冊新的人臉"
+        )
+    
     try:
-        # 直接傳遞base64圖像數據
-        result = face_model_register(request.employee_id, request.image)
+        # 直接傳遞圖像數據 (base64 或二進制)
+        # 人臉檢測與編碼在視覺執行緒池中執行，避免阻塞事件循環
+        result = await run_vision(face_model_register, employee_id, image_data, deadline=deadline)
         
         if not result.get("success", False):
             raise HTTPException(
@@ -223,22 +278,29 @@ async def register_face_handler(
                 detail=result.get("error", "無法從圖像中識別出人臉")
             )
         
-        # 從models.face_recognition中獲取人臉編碼
-        from models.face_recognition import known_faces
-        import json
-        
         # 獲取剛才註冊的人臉編碼
-        face_encoding = known_faces.get(str(request.employee_id))
+        face_encoding = result.get("encoding")
         if face_encoding:
-            # 將人臉編碼保存到數據庫中
-            employee.face_encoding = json.dumps(face_encoding)
+            # 將人臉編碼以二進制格式保存到數據庫中
+            store_face_encoding(employee, face_encoding)
+            record_face_change(db, employee.id, "upsert")
             db.commit()
             db.refresh(employee)
+            
+            # 提交成功後增量更新人臉特徵庫
+            sync_employee_face(employee)
         
         return {
             "success": True,
             "message": "人臉註冊成功"
         }
+    except HTTPException:
+        raise
+    except VisionTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="系統忙碌，人臉註冊逾時，請稍後再試"
+        )
     except Exception as e:
         import traceback
         logger_error = traceback.format_exc()
@@ -251,48 +313,31 @@ async def register_face_handler(
 @router.post("/test-face-recognition", status_code=status.HTTP_200_OK)
 async def test_face_recognition(
     request: dict = Body(...),  # 預期包含 image 字段的 base64 圖像
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    deadline: float = Depends(admit_recognition)
 ):
     """
     測試人臉識別功能，不需要身份驗證，僅用於調試
     """
-    from models.face_recognition import recognize_face, detect_faces, load_faces_from_db
-    import json
+    from models.frame_analysis import FrameAnalysis
     import logging
     
     logger = logging.getLogger("test_face_recognition")
     
     try:
-        # 從數據庫加載所有人臉編碼
-        employees_with_face = db.query(Employee).filter(Employee.face_encoding.isnot(None)).all()
-        
-        # 轉換為人臉編碼字典
-        face_encodings = {}
-        for emp in employees_with_face:
-            try:
-                encoding = json.loads(emp.face_encoding)
-                face_encodings[str(emp.id)] = encoding
-            except:
-                pass
-        
-        # 加載到人臉識別模塊
-        if face_encodings:
-            load_faces_from_db(face_encodings)
-            logger.info(f"從數據庫加載了 {len(face_encodings)} 筆人臉數據")
+        # 確保人臉特徵庫已載入
+        gallery = await run_in_threadpool(ensure_face_gallery, db)
+        if len(gallery):
+            logger.info(f"人臉特徵庫中有 {len(gallery)} 筆人臉數據")
         else:
             logger.warning("數據庫中沒有人臉數據")
         
         # 直接傳遞base64圖像
         image_data = request["image"]
         
-        # 檢測是否有人臉
-        # 先解碼base64為圖像
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        image_np = np.array(image)
-        
-        faces = detect_faces(image_np)
-        has_face = len(faces) > 0
+        # 解碼一次，檢測與識別共用同一個人臉框
+        frame = await run_vision(FrameAnalysis.from_data, image_data, deadline=deadline)
+        has_face = frame is not None and len(await run_vision(frame.detect, deadline=deadline)) > 0
         
         if not has_face:
             return {
@@ -302,7 +347,7 @@ async def test_face_recognition(
             }
         
         # 嘗試識別人臉
-        employee_id = recognize_face(image_data, face_encodings)
+        employee_id = await recognize_frame(frame, deadline)
         
         if not employee_id:
             return {
@@ -48,8 +48,81 @@ class Settings(BaseSettings):
     DEFAULT_ADMIN_PASSWORD: str = os.getenv("DEFAULT_ADMIN_PASSWORD", "admin")
     DEFAULT_ADMIN_NAME: str = os.getenv("DEFAULT_ADMIN_NAME", "系統管理員")
     
+    # 人臉編碼存儲精度 (float16 或 float32)
+    FACE_TEMPLATE_DTYPE: str = os.getenv("FACE_TEMPLATE_DTYPE", "float16")
+    
+    # 人臉編碼降維投影文件 (由 scripts/fit_face_projection.py 產生，文件不存在時不降維)
+    FACE_PROJECTION_PATH: str = os.getenv(
+        "FACE_PROJECTION_PATH",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "face_projection.npz")
+    )
+    
+    # 人臉檢測縮圖長邊 (像素，0 表示以原始解析度檢測) 及是否在原圖人臉附近重新檢測校正人臉框
+    FACE_DETECT_MAX_EDGE: int = int(os.getenv("FACE_DETECT_MAX_EDGE", "0"))
+    FACE_DETECT_REFINE: bool = os.getenv("FACE_DETECT_REFINE", "False").lower() == "true"
+    
+    # 視覺處理執行緒池大小 (0 表示取 CPU 核心數，最多4個) 及每個請求的處理時限 (秒)
+    VISION_WORKERS: int = int(os.getenv("VISION_WORKERS", "0"))
+    VISION_TIMEOUT: float = float(os.getenv("VISION_TIMEOUT", "10"))
+    # 每個工作進程排隊等待視覺處理的請求上限，超過時立即回應 503
+    VISION_QUEUE_MAX: int = int(os.getenv("VISION_QUEUE_MAX", "32"))
+    # 可信任 X-Kiosk-ID 標頭的客戶端網段 (以逗號分隔的 IP 或 CIDR，例如打卡機網段或反向代理)；
+    # 其他來源的標頭會被忽略，改以客戶端 IP 區分打卡機，避免輪換標頭繞過各打卡機的公平排隊
+    KIOSK_TRUSTED_NETWORKS: list = [n.strip() for n in os.getenv("KIOSK_TRUSTED_NETWORKS", "").split(",") if n.strip()]
+    # 應用啟動時在背景預熱人臉管線與口罩模型 (預熱完成前 /health 回應 503)
+    WARMUP_ON_STARTUP: bool = os.getenv("WARMUP_ON_STARTUP", "True").lower() == "true"
+    # 人臉比對微批次：合併此時間窗 (毫秒，0 表示停用) 內到達的探針一次比對，每批最多幾個
+    FACE_MATCH_BATCH_WINDOW_MS: float = float(os.getenv("FACE_MATCH_BATCH_WINDOW_MS", "0"))
+    FACE_MATCH_BATCH_MAX: int = int(os.getenv("FACE_MATCH_BATCH_MAX", "32"))
+    
+    # 重複打卡請求快取：相同影像在此秒數內重送時回放上次的結果 (0 表示停用)，
+    # 最多保存的筆數，以及是否區分打卡機 (同一影像來自不同打卡機時視為不同請求)
+    PUNCH_REPLAY_TTL: float = float(os.getenv("PUNCH_REPLAY_TTL", "10"))
+    PUNCH_REPLAY_MAX_ENTRIES: int = int(os.getenv("PUNCH_REPLAY_MAX_ENTRIES", "256"))
+    PUNCH_REPLAY_PER_KIOSK: bool = os.getenv("PUNCH_REPLAY_PER_KIOSK", "True").lower() == "true"
+    
+    # 打卡防抖：同一員工在此分鐘數內再次被識別時返回上次的打卡結果，不會誤記為下班打卡 (0 表示停用)
+    PUNCH_DEBOUNCE_MINUTES: float = float(os.getenv("PUNCH_DEBOUNCE_MINUTES", "5"))
+    
+    # 直接打卡的伺服器端口罩驗證在回應後於背景執行，結果寫入打卡記錄；
+    # 佇列上限 (超過時不驗證) 及每次合併推論的最大筆數
+    MASK_VERIFY_ENABLED: bool = os.getenv("MASK_VERIFY_ENABLED", "True").lower() == "true"
+    MASK_VERIFY_QUEUE_MAX: int = int(os.getenv("MASK_VERIFY_QUEUE_MAX", "256"))
+    MASK_VERIFY_BATCH_MAX: int = int(os.getenv("MASK_VERIFY_BATCH_MAX", "8"))
+    
+    # 共用的視覺推論服務 (python -m app.vision_server)：設置 Unix socket 路徑後，各工作進程的
+    # 口罩分類改由服務執行，不在進程內載入模型；連線驗證金鑰 (預設沿用 SECRET_KEY) 及每批最大裁剪數
+    VISION_SERVER_SOCKET: str = os.getenv("VISION_SERVER_SOCKET", "")
+    VISION_SERVER_AUTHKEY: str = os.getenv("VISION_SERVER_AUTHKEY", "")
+    VISION_SERVER_BATCH_MAX: int = int(os.getenv("VISION_SERVER_BATCH_MAX", "16"))
+    
+    # 人臉特徵庫索引後端: exact (精確掃描) 或 ivf (近似索引，適合數萬人以上的特徵庫)
+    FACE_INDEX_BACKEND: str = os.getenv("FACE_INDEX_BACKEND", "exact")
+    FACE_INDEX_NLIST: int = int(os.getenv("FACE_INDEX_NLIST", "0"))  # 0 表示自動 (約 4*sqrt(N))
+    FACE_INDEX_NPROBE: int = int(os.getenv("FACE_INDEX_NPROBE", "8"))
+    FACE_INDEX_TRAIN_MIN: int = int(os.getenv("FACE_INDEX_TRAIN_MIN", "1024"))
+
+    # 人臉特徵庫人數上限 (0 表示不限)，超過時拒絕新的人臉註冊
+    FACE_GALLERY_MAX_ENTRIES: int = int(os.getenv("FACE_GALLERY_MAX_ENTRIES", "0"))
+
+    # 人臉特徵庫共享快照：同一台機器上的多個工作進程以 mmap 共用同一份特徵矩陣
+    FACE_GALLERY_SNAPSHOT: bool = os.getenv("FACE_GALLERY_SNAPSHOT", "True").lower() == "true"
+    FACE_GALLERY_SNAPSHOT_DIR: str = os.getenv(
+        "FACE_GALLERY_SNAPSHOT_DIR",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "face_gallery")
+    )
+
+    # 跨進程特徵庫同步：比對資料庫版本號的最短間隔 (秒，0 表示每次打卡都比對)，
+    # 以及增量同步的最大變更人數，超過則完整重新載入
+    FACE_GALLERY_SYNC_INTERVAL: float = float(os.getenv("FACE_GALLERY_SYNC_INTERVAL", "2"))
+    FACE_GALLERY_SYNC_MAX_CHANGES: int = int(os.getenv("FACE_GALLERY_SYNC_MAX_CHANGES", "500"))
+
     # 圖片存儲
     MAX_IMAGE_SIZE: int = int(os.getenv("MAX_IMAGE_SIZE", str(10 * 1024 * 1024)))  # 10 MB
+    # 上傳圖像的最大像素數 (解碼前由文件頭檢查，0 表示不限)
+    MAX_IMAGE_PIXELS: int = int(os.getenv("MAX_IMAGE_PIXELS", str(4096 * 4096)))
+    # JPEG 縮小解碼的最小長邊 (像素，0 表示以原始解析度解碼)；建議不低於 FACE_DETECT_MAX_EDGE
+    IMAGE_DECODE_MAX_EDGE: int = int(os.getenv("IMAGE_DECODE_MAX_EDGE", "0"))
     
     # 生產環境設置
     SECURE_COOKIES: bool = os.getenv("SECURE_COOKIES", "False").lower() == "true"
@@ -1,10 +1,14 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Date, ForeignKey, func, Text
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Date, ForeignKey, func, Text, LargeBinary, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 import os
+import logging
 from datetime import datetime, date
 from app.config import settings
 
+# 設置日誌
+logger = logging.getLogger(__name__)
+
 # 取得資料庫連接 URL
 DATABASE_URL = settings.complete_database_url
 print(f"使用資料庫連接: {DATABASE_URL}")
@@ -35,7 +39,12 @@ class Employee(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_admin = Column(Boolean, default=False)
-    face_encoding = Column(Text, nullable=True)  # 存儲人臉編碼（JSON格式）
+    face_encoding = Column(Text, nullable=True)  # 舊版人臉編碼（JSON格式），遷移後清空
+    face_template = Column(LargeBinary, nullable=True)  # 人臉編碼（float16/float32 二進制）
+    face_encoder_version = Column(String, nullable=True)  # 產生人臉編碼的編碼器版本
+    face_encoding_dim = Column(Integer, nullable=True)  # 人臉編碼維度
+    face_embedding = Column(LargeBinary, nullable=True)  # 降維投影後的人臉編碼（float32 二進制）
+    face_embedding_version = Column(String, nullable=True)  # 產生 face_embedding 的投影ID
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -45,6 +54,8 @@ class Employee(Base):
     @property
     def has_face_encoding(self):
         """判斷是否已註冊人臉"""
+        if self.face_template is not None:
+            return True
         return self.face_encoding is not None and self.face_encoding.strip() != ""
 
 # 打卡記錄資料表
@@ -57,8 +68,58 @@ class ClockRecord(Base):
     clock_in = Column(DateTime, nullable=True)  # 上班打卡時間
     clock_out = Column(DateTime, nullable=True)  # 下班打卡時間
     with_mask = Column(Boolean, default=False)  # 是否戴口罩
+    mask_verified = Column(Boolean, nullable=True)  # 伺服器端背景驗證的口罩狀態，為空表示尚未驗證
+    mask_mismatch = Column(Boolean, nullable=True)  # 前端回報與伺服器端驗證的口罩狀態是否不一致
+    mask_verified_at = Column(DateTime, nullable=True)  # 口罩驗證完成時間
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # 關聯到員工
-    employee = relationship("Employee", back_populates="clock_records") 
\ No newline at end of file
+    employee = relationship("Employee", back_populates="clock_records") 
+
+# 人臉特徵庫變更記錄資料表，自增ID即為特徵庫版本號
+class FaceGalleryEvent(Base):
+    __tablename__ = "face_gallery_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(Integer, nullable=True, index=True)  # 為空表示整個特徵庫需重新載入
+    action = Column(String)  # upsert / delete / reload
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# 模型新增、已存在的資料表需要補上的欄位 (皆可為空，不需回填)
+_UPGRADE_COLUMNS = {
+    "employees": ("face_template", "face_encoder_version", "face_encoding_dim",
+                  "face_embedding", "face_embedding_version"),
+    "clock_records": ("mask_verified", "mask_mismatch", "mask_verified_at"),
+}
+
+
+def upgrade_schema(bind=engine):
+    """為已存在的資料表補上新增的欄位，可重複執行
+
+    create_all 只會建立缺少的表，不會修改已存在的表；舊的 SQLite 或 PostgreSQL 資料庫
+    缺少這些欄位時，所有查詢該模型的請求都會失敗，因此在應用啟動時檢查並以 ALTER TABLE 補上。
+    """
+    added = []
+    for table_name, column_names in _UPGRADE_COLUMNS.items():
+        inspector = inspect(bind)
+        if not inspector.has_table(table_name):
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table_name)}
+        for column_name in column_names:
+            if column_name in existing:
+                continue
+            column = Base.metadata.tables[table_name].c[column_name]
+            column_type = column.type.compile(dialect=bind.dialect)
+            try:
+                with bind.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+            except Exception:
+                # 多個工作進程同時啟動時，欄位可能已由其他進程補上
+                if column_name not in {col["name"] for col in inspect(bind).get_columns(table_name)}:
+                    raise
+                continue
+            logger.info(f"已添加 {column_name} 欄位到 {table_name} 表")
+            added.append(f"{table_name}.{column_name}")
+    return added
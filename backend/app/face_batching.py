@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import deque
+
+from app.config import settings
+from app.vision import run_vision, VisionTimeout
+from models.face_recognition import recognize_encodings
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+
+class FaceMatchBatcher:
+    """人臉比對的微批次合併器 (每個工作進程一個，在事件循環中使用)
+
+    第一個探針到達後等待 window_ms 毫秒 (或湊滿 max_batch 個)，將期間到達的
+    所有人臉編碼合併為一個探針矩陣，以一次矩陣乘法與特徵庫比對，再分別回傳
+    各請求的結果。上下班尖峰時多台打卡機同時打卡，特徵庫矩陣只需讀取一遍。
+    window_ms 為 0 時停用，每個請求各自比對。
+    """
+
+    def __init__(self, window_ms, max_batch):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._pending = []   # 格式: [(encoding, deadline, Future), ...]
+        self._timer = None
+        self._tasks = set()
+        self._sizes = deque(maxlen=512)
+        self.batches = 0
+        self.probes = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    async def match(self, encoding, deadline):
+        """加入下一個批次並等待比對結果，返回員工ID或None；超過截止時間拋出 VisionTimeout"""
+        loop = asyncio.get_running_loop()
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            raise VisionTimeout()
+        waiter = loop.create_future()
+        self._pending.append((encoding, deadline, waiter))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            waiter.cancel()
+            raise VisionTimeout()
+        except asyncio.CancelledError:
+            waiter.cancel()
+            raise
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        batch = [item for item in batch if not item[2].done()]
+        if not batch:
+            return
+        self.batches += 1
+        self.probes += len(batch)
+        self._sizes.append(len(batch))
+        task = asyncio.ensure_future(self._run(batch))
+        # 保留任務引用，避免執行中被垃圾回收
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        # 批次的處理時限取成員中最晚的截止時間，個別請求仍在自己的截止時間放棄等待
+        deadline = max(item[1] for item in batch)
+        try:
+            results = await run_vision(recognize_encodings, [item[0] for item in batch], deadline=deadline)
+        except Exception as e:
+            for _, _, waiter in batch:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        for (_, _, waiter), employee_id in zip(batch, results):
+            if not waiter.done():
+                waiter.set_result(employee_id)
+
+    def stats(self):
+        """批次數量與平均批次大小"""
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "probes": self.probes,
+            "recent_mean_batch": round(sum(self._sizes) / len(self._sizes), 2) if self._sizes else None,
+            "recent_max_batch": max(self._sizes) if self._sizes else None,
+        }
+
+
+# 進程內共用的人臉比對批次合併器
+face_match_batcher = FaceMatchBatcher(settings.FACE_MATCH_BATCH_WINDOW_MS, settings.FACE_MATCH_BATCH_MAX)
+
+
+async def recognize_frame(frame, deadline):
+    """識別一張已完成人臉檢測的影像，返回員工ID或None
+
+    啟用微批次時人臉編碼仍在本請求中計算，只有特徵庫比對會與其他請求合併。
+    """
+    if not face_match_batcher.enabled:
+        return await run_vision(frame.recognize, deadline=deadline)
+    encoding = await run_vision(frame.encode, deadline=deadline)
+    if encoding is None:
+        logger.error("未檢測到人臉或人臉編碼失敗，無法識別")
+        return None
+    return await face_match_batcher.match(encoding, deadline)
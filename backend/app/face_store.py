@@ -0,0 +1,311 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import numpy as np
+from sqlalchemy import or_, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import Employee, FaceGalleryEvent
+from models.face_recognition import (
+    face_gallery, pack_face_encoding, unpack_face_encoding, FACE_ENCODER_VERSION
+)
+from models.face_snapshot import write_gallery_snapshot, open_gallery_snapshot, prune_gallery_snapshots
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+# 跨進程同步狀態：上次檢查資料庫版本的時間，以及避免多個請求同時同步的鎖
+_last_version_check = 0.0
+_sync_lock = threading.Lock()
+
+
+def decode_face_encoding(employee: Employee):
+    """解析員工記錄中儲存的人臉編碼，無編碼時返回None
+
+    優先讀取二進制的 face_template，尚未遷移的舊記錄則解析 JSON 格式的 face_encoding。
+    """
+    if employee.face_template is not None:
+        if employee.face_encoder_version and employee.face_encoder_version != FACE_ENCODER_VERSION:
+            logger.warning(f"員工 {employee.id} 的人臉編碼版本 {employee.face_encoder_version} "
+                           f"與目前編碼器 {FACE_ENCODER_VERSION} 不一致，需重新註冊人臉")
+            return None
+        return unpack_face_encoding(employee.face_template, employee.face_encoding_dim)
+    if employee.face_encoding is not None and employee.face_encoding.strip() != "":
+        return json.loads(employee.face_encoding)
+    return None
+
+
+def gallery_vector(employee: Employee, projection=None):
+    """取得員工在特徵庫空間中的人臉向量，無編碼時返回None
+
+    已有與目前投影一致的 face_embedding 時直接使用，否則即時投影原始編碼。
+    """
+    projection = projection or face_gallery.projection
+    if projection is not None and employee.face_embedding is not None \
+            and employee.face_embedding_version == projection.projection_id:
+        return unpack_face_encoding(employee.face_embedding, projection.dim)
+
+    encoding = decode_face_encoding(employee)
+    if encoding is None:
+        return None
+    if projection is not None:
+        return projection.transform(encoding)
+    return encoding
+
+
+def store_face_embedding(employee: Employee, encoding, projection=None):
+    """寫入原始人臉編碼經降維投影後的向量（不提交），未設置投影時清空"""
+    projection = projection or face_gallery.projection
+    if encoding is None or projection is None:
+        employee.face_embedding = None
+        employee.face_embedding_version = None
+    else:
+        employee.face_embedding, _ = pack_face_encoding(projection.transform(encoding), "float32")
+        employee.face_embedding_version = projection.projection_id
+
+
+def store_face_encoding(employee: Employee, encoding):
+    """將人臉編碼以二進制格式寫入員工記錄（不提交），並清除舊版 JSON 編碼"""
+    if encoding is None:
+        employee.face_template = None
+        employee.face_encoder_version = None
+        employee.face_encoding_dim = None
+    else:
+        employee.face_template, employee.face_encoding_dim = pack_face_encoding(
+            encoding, settings.FACE_TEMPLATE_DTYPE
+        )
+        employee.face_encoder_version = FACE_ENCODER_VERSION
+    employee.face_encoding = None
+    store_face_embedding(employee, encoding)
+
+
+def record_face_change(db: Session, employee_id, action: str):
+    """記錄一筆人臉特徵庫變更（不提交），需與員工記錄的修改在同一交易中提交
+
+    每筆記錄的自增ID即為新的特徵庫版本，employee_id 為None表示需要完整重新載入。
+    """
+    db.add(FaceGalleryEvent(employee_id=employee_id, action=action))
+
+
+def current_gallery_version(db: Session) -> int:
+    """讀取資料庫中的特徵庫版本號 (主鍵索引上的 MAX，成本很低)"""
+    return db.query(func.max(FaceGalleryEvent.id)).scalar() or 0
+
+
+def reproject_face_templates(db: Session, projection) -> int:
+    """以新的投影重新計算所有員工的 face_embedding 並提交，返回處理筆數"""
+    employees_with_face = db.query(Employee).filter(Employee.face_template.isnot(None)).all()
+
+    reprojected = 0
+    for emp in employees_with_face:
+        try:
+            store_face_embedding(emp, decode_face_encoding(emp), projection)
+            reprojected += 1
+        except Exception as e:
+            logger.error(f"重新投影員工 {emp.id} 的人臉編碼失敗: {str(e)}")
+            continue
+
+    record_face_change(db, None, "reload")
+    db.commit()
+    return reprojected
+
+
+def migrate_legacy_face_encodings(db: Session) -> int:
+    """將仍以 JSON 存儲的人臉編碼轉換為二進制格式，返回轉換筆數"""
+    legacy_employees = db.query(Employee).filter(
+        Employee.face_template.is_(None),
+        Employee.face_encoding.isnot(None)
+    ).all()
+
+    converted = 0
+    for emp in legacy_employees:
+        try:
+            encoding = json.loads(emp.face_encoding) if emp.face_encoding.strip() else None
+            store_face_encoding(emp, encoding)
+            converted += 1
+        except Exception as e:
+            logger.error(f"轉換員工 {emp.id} 的人臉編碼失敗: {str(e)}")
+            continue
+
+    if converted:
+        record_face_change(db, None, "reload")
+    db.commit()
+    return converted
+
+
+def _face_filter():
+    return or_(Employee.face_template.isnot(None), Employee.face_encoding.isnot(None))
+
+
+def registered_face_count(db: Session) -> int:
+    """資料庫中已註冊人臉的員工數"""
+    return db.query(Employee).filter(_face_filter()).count()
+
+
+def read_face_vectors(db: Session):
+    """讀取所有員工在特徵庫空間中的人臉向量，返回 {employee_id: vector}"""
+    employees_with_face = db.query(Employee).filter(_face_filter()).all()
+
+    face_encodings = {}
+    for emp in employees_with_face:
+        try:
+            vector = gallery_vector(emp)
+            if vector is not None:
+                face_encodings[str(emp.id)] = vector
+        except Exception as e:
+            logger.error(f"解析員工 {emp.id} 的人臉編碼失敗: {str(e)}")
+            continue
+    return face_encodings
+
+
+def gallery_snapshot_key(db: Session, version: int) -> str:
+    """以特徵庫版本與人臉記錄的筆數、ID總和，加上編碼器與投影版本，計算快照版本"""
+    count, id_sum = db.query(func.count(Employee.id), func.sum(Employee.id)).filter(_face_filter()).one()
+    projection = face_gallery.projection
+    digest = hashlib.sha1(
+        f"{version}|{count}|{id_sum}|{FACE_ENCODER_VERSION}|"
+        f"{projection.projection_id if projection else 'raw'}".encode()
+    )
+    return digest.hexdigest()[:16]
+
+
+def load_face_gallery_snapshot(db: Session, version: int) -> int:
+    """透過共享快照載入特徵庫：快照已存在時直接映射，否則由本進程從資料庫建立"""
+    directory = settings.FACE_GALLERY_SNAPSHOT_DIR
+    key = gallery_snapshot_key(db, version)
+
+    snapshot = open_gallery_snapshot(directory, key)
+    if snapshot is None:
+        face_encodings = read_face_vectors(db)
+        if not face_encodings:
+            face_gallery.load({}, version)
+            return 0
+        ids = list(face_encodings.keys())
+        matrix = np.vstack([np.asarray(face_encodings[emp_id], dtype=np.float32).ravel() for emp_id in ids])
+        write_gallery_snapshot(directory, key, ids, matrix)
+        prune_gallery_snapshots(directory, key)
+        snapshot = open_gallery_snapshot(directory, key)
+        if snapshot is None:
+            raise RuntimeError(f"無法打開剛寫入的人臉特徵庫快照 {key}")
+
+    ids, matrix, sq_norms = snapshot
+    face_gallery.load_mapped(ids, matrix, sq_norms, version)
+    return len(ids)
+
+
+def load_face_gallery(db: Session) -> int:
+    """從資料庫完整載入人臉特徵庫，返回載入筆數
+
+    啟用共享快照時，同一版本的特徵矩陣只會由第一個工作進程從資料庫建立，
+    其餘進程以 mmap 直接共用；快照失敗時退回進程內載入。
+    版本號在讀取人臉記錄之前取得，期間發生的變更會在下次同步時再套用一次。
+    """
+    global _last_version_check
+    version = current_gallery_version(db)
+    _last_version_check = time.monotonic()
+
+    if settings.FACE_GALLERY_SNAPSHOT:
+        try:
+            return load_face_gallery_snapshot(db, version)
+        except Exception as e:
+            logger.error(f"使用共享人臉特徵庫快照失敗，改為進程內載入: {str(e)}")
+
+    face_encodings = read_face_vectors(db)
+    face_gallery.load(face_encodings, version)
+    return len(face_encodings)
+
+
+def refresh_face_gallery(db: Session) -> int:
+    """比對資料庫版本，只重新讀取其他進程變更過的員工，返回套用的變更筆數"""
+    version = current_gallery_version(db)
+    if version <= face_gallery.version:
+        face_gallery.mark_synced(version)
+        return 0
+
+    events = db.query(FaceGalleryEvent).filter(
+        FaceGalleryEvent.id > face_gallery.version,
+        FaceGalleryEvent.id <= version
+    ).all()
+    changed_ids = {event.employee_id for event in events}
+    if None in changed_ids or len(changed_ids) > settings.FACE_GALLERY_SYNC_MAX_CHANGES:
+        logger.info(f"人臉特徵庫版本 {face_gallery.version} -> {version}，需完整重新載入")
+        load_face_gallery(db)
+        return len(events)
+
+    employees = {
+        emp.id: emp for emp in db.query(Employee).filter(Employee.id.in_(changed_ids)).all()
+    }
+    for employee_id in changed_ids:
+        employee = employees.get(employee_id)
+        if employee is None:
+            remove_employee_face(employee_id)
+        else:
+            sync_employee_face(employee)
+    face_gallery.mark_synced(version)
+    logger.info(f"人臉特徵庫已同步到版本 {version}，更新 {len(changed_ids)} 名員工")
+    return len(changed_ids)
+
+
+def ensure_face_gallery(db: Session):
+    """確保人臉特徵庫已載入且與資料庫版本一致
+
+    進程內第一次調用時完整載入；之後最多每 FACE_GALLERY_SYNC_INTERVAL 秒比對一次
+    資料庫版本號，只套用其他工作進程的增量變更。
+    """
+    global _last_version_check
+    if not face_gallery.loaded:
+        with _sync_lock:
+            if not face_gallery.loaded:
+                logger.info("人臉特徵庫尚未載入，從數據庫加載所有人臉編碼數據...")
+                load_face_gallery(db)
+        return face_gallery
+
+    if time.monotonic() - _last_version_check >= settings.FACE_GALLERY_SYNC_INTERVAL:
+        # 其他請求正在同步時不等待，沿用目前的特徵庫
+        if _sync_lock.acquire(blocking=False):
+            try:
+                _last_version_check = time.monotonic()
+                refresh_face_gallery(db)
+            except Exception as e:
+                logger.error(f"同步人臉特徵庫失敗: {str(e)}")
+            finally:
+                _sync_lock.release()
+    return face_gallery
+
+
+def face_gallery_status(db: Session) -> dict:
+    """彙整本進程特徵庫的人數、記憶體用量，以及相對資料庫的落後程度"""
+    stats = face_gallery.stats()
+    db_version = current_gallery_version(db)
+    now = time.time()
+    stats.update({
+        "db_version": db_version,
+        "versions_behind": max(db_version - stats["version"], 0) if stats["loaded"] else None,
+        "db_entries": db.query(func.count(Employee.id)).filter(_face_filter()).scalar() or 0,
+        "seconds_since_load": round(now - stats["loaded_at"], 1) if stats["loaded_at"] else None,
+        "seconds_since_sync": round(now - stats["synced_at"], 1) if stats["synced_at"] else None,
+    })
+    return stats
+
+
+def sync_employee_face(employee: Employee):
+    """在員工記錄變更並提交後，增量同步該員工在特徵庫中的人臉編碼"""
+    try:
+        vector = gallery_vector(employee)
+    except Exception as e:
+        logger.error(f"解析員工 {employee.id} 的人臉編碼失敗: {str(e)}")
+        vector = None
+
+    if vector is None:
+        face_gallery.remove(employee.id)
+    else:
+        face_gallery.add(employee.id, vector)
+
+
+def remove_employee_face(employee_id: int):
+    """員工被刪除後，從特徵庫移除其人臉編碼"""
+    face_gallery.remove(employee_id)
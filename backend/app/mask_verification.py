@@ -0,0 +1,157 @@
+import queue
+import logging
+import threading
+from datetime import datetime
+
+from app.config import settings
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+
+class MaskVerificationJob:
+    """一次待驗證的打卡：打卡記錄、打卡類型與時間、前端回報的口罩狀態及人臉裁剪 (BGR)"""
+
+    __slots__ = ("record_id", "punch_type", "punched_at", "claimed", "crop")
+
+    def __init__(self, record_id, punch_type, punched_at, claimed, crop):
+        self.record_id = record_id
+        self.punch_type = punch_type
+        self.punched_at = punched_at
+        self.claimed = claimed
+        self.crop = crop
+
+
+class MaskVerifier:
+    """在打卡回應之後於背景驗證口罩狀態 (每個工作進程一個背景執行緒)
+
+    直接打卡以前端回報的口罩狀態立即寫入記錄並回應，伺服器端的口罩分類不再佔用打卡延遲。
+    背景執行緒一次取出佇列中最多 batch_max 筆，以 detect_masks() 一次推論後，把結果寫入
+    ClockRecord.mask_verified，與前端不一致時標記 mask_mismatch。佇列已滿或口罩分類失敗
+    (模型無法載入、視覺推論服務無法連線) 時不驗證，記錄的 mask_verified 保持為空。
+    """
+
+    def __init__(self, queue_max, batch_max):
+        self.batch_max = max(1, batch_max)
+        self._queue = queue.Queue(maxsize=max(1, queue_max))
+        self._thread = None
+        self._lock = threading.Lock()
+        self.verified = 0
+        self.mismatches = 0
+        self.dropped = 0
+        self.stale = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return settings.MASK_VERIFY_ENABLED
+
+    def submit(self, record_id, punch_type, punched_at, claimed, crop):
+        """排入一筆驗證，返回是否已排入；人臉裁剪會被複製，不保留整張影格"""
+        if not self.enabled or crop is None or crop.size == 0:
+            return False
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(MaskVerificationJob(record_id, punch_type, punched_at, claimed, crop.copy()))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"口罩驗證佇列已滿，打卡記錄 {record_id} 不進行驗證")
+            return False
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mask-verification", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """停止背景執行緒，最多等待 timeout 秒讓已排入的驗證完成"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            stop = False
+            while len(jobs) < self.batch_max:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                jobs.append(job)
+            try:
+                self.verify(jobs)
+            except Exception as e:
+                self.failed += len(jobs)
+                logger.error(f"背景口罩驗證失敗: {str(e)}")
+            if stop:
+                return
+
+    def verify(self, jobs):
+        """以一次推論驗證多筆打卡並寫入資料庫；口罩分類失敗時拋出異常，記錄保持未驗證"""
+        from models.mask_detection import detect_masks
+
+        results = detect_masks([job.crop for job in jobs], strict=True)
+        self._store(jobs, results)
+
+    def _store(self, jobs, results):
+        from app.database import SessionLocal, ClockRecord
+
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            for job, has_mask in zip(jobs, results):
+                record = db.query(ClockRecord).filter(ClockRecord.id == job.record_id).first()
+                if record is None:
+                    continue
+                # 驗證期間已有下一次打卡覆蓋了口罩狀態時，舊的結果不再寫入
+                current = record.clock_out if job.punch_type == "clock_out" else record.clock_in
+                if current != job.punched_at or (job.punch_type == "clock_in" and record.clock_out):
+                    self.stale += 1
+                    continue
+                record.mask_verified = has_mask
+                record.mask_mismatch = has_mask != job.claimed
+                record.mask_verified_at = now
+                self.verified += 1
+                if record.mask_mismatch:
+                    self.mismatches += 1
+                    logger.warning(
+                        f"口罩狀態不一致 - 記錄ID: {record.id}, 前端: {'已佩戴' if job.claimed else '未佩戴'}, "
+                        f"後端: {'已佩戴' if has_mask else '未佩戴'}"
+                    )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self._queue.qsize(),
+            "queue_max": self._queue.maxsize,
+            "verified": self.verified,
+            "mismatches": self.mismatches,
+            "dropped": self.dropped,
+            "stale": self.stale,
+            "failed": self.failed,
+        }
+
+
+# 進程內共用的背景口罩驗證
+mask_verifier = MaskVerifier(settings.MASK_VERIFY_QUEUE_MAX, settings.MASK_VERIFY_BATCH_MAX)
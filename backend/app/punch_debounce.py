@@ -0,0 +1,93 @@
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from app.config import settings
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+
+class PunchDebouncer:
+    """同一員工短時間內重複打卡的防抖 (每個工作進程一個)
+
+    員工打卡後常停留在打卡機前再次被識別，若不處理，幾秒後就會被記為下班打卡。
+    打卡成功後記住該員工的結果，window 秒內再次識別到同一員工時直接返回上次的結果，
+    不查詢也不寫入資料庫。其他工作進程寫入的打卡由 from_record() 依資料庫記錄判斷。
+    """
+
+    def __init__(self, window, max_entries=4096):
+        self.window = window
+        self.max_entries = max_entries
+        self._recent = OrderedDict()  # 格式: {employee_id(str): (到期時間, 結果)}
+        self.hits = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def recent(self, employee_id):
+        """返回防抖時間內該員工上次打卡的結果 (附加 debounced 標記)，沒有時返回None"""
+        if not self.enabled:
+            return None
+        entry = self._recent.get(str(employee_id))
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._recent[str(employee_id)]
+            return None
+        self.hits += 1
+        return {**result, "debounced": True}
+
+    def remember(self, employee_id, result, punched_at=None):
+        """記住員工的打卡結果，punched_at 為打卡時間 (預設為現在)"""
+        if not self.enabled:
+            return
+        age = (datetime.now() - punched_at).total_seconds() if punched_at else 0.0
+        key = str(employee_id)
+        self._recent[key] = (time.monotonic() + self.window - max(age, 0.0), result)
+        self._recent.move_to_end(key)
+        # 清理已過期或超出上限的記錄 (按寫入順序，最舊的在前)
+        now = time.monotonic()
+        while self._recent:
+            oldest_key, (expires_at, _) = next(iter(self._recent.items()))
+            if expires_at >= now and len(self._recent) <= self.max_entries:
+                break
+            del self._recent[oldest_key]
+
+    def from_record(self, record, employee_name, now):
+        """資料庫後備：今天的打卡記錄在防抖時間內時返回對應的結果，否則返回None"""
+        if not self.enabled or record is None:
+            return None
+        if record.clock_out:
+            punched_at, punch_type, message = record.clock_out, "clock_out", "下班打卡成功"
+        elif record.clock_in:
+            punched_at, punch_type, message = record.clock_in, "clock_in", "上班打卡成功"
+        else:
+            return None
+        if now - punched_at > timedelta(seconds=self.window):
+            return None
+        result = {
+            "success": True,
+            "message": message,
+            "employee_name": employee_name,
+            "timestamp": punched_at.isoformat(),
+            "type": punch_type
+        }
+        self.remember(record.employee_id, result, punched_at)
+        self.hits += 1
+        return {**result, "debounced": True}
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "window_seconds": self.window,
+            "employees": len(self._recent),
+            "hits": self.hits,
+        }
+
+
+# 進程內共用的打卡防抖
+punch_debouncer = PunchDebouncer(settings.PUNCH_DEBOUNCE_MINUTES * 60)
@@ -0,0 +1,112 @@
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+
+from app.config import settings
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+
+def payload_key(image_data, *parts) -> bytes:
+    """以 BLAKE2b 對圖像內容及其他欄位 (打卡機、口罩狀態等) 計算16位元組的鍵"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(image_data.encode("ascii", "ignore") if isinstance(image_data, str) else image_data)
+    for part in parts:
+        digest.update(b"\0" + str(part).encode("utf-8"))
+    return digest.digest()
+
+
+class PunchReplayCache:
+    """重複提交的打卡請求快取 (每個工作進程一個，在事件循環中使用)
+
+    打卡機在網路不穩時會重送同一張影像，使用者也常連按兩次。以影像內容的雜湊為鍵，
+    ttl 秒內再次收到相同的內容時直接回放上次的結果，不再解碼、識別與寫入資料庫；
+    仍在處理中的相同請求則等待第一個請求的結果。最多保存 max_entries 筆，按最近使用淘汰。
+    只快取成功的結果，逾時或出錯的請求可以立即重試。
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()  # 格式: {key: (到期時間, 結果)}
+        self._inflight = {}            # 格式: {key: Future}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _store(self, key, result):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def run(self, key, process):
+        """返回 key 對應的結果：命中快取時回放 (附加 duplicate 標記)，否則執行 process() 並快取成功的結果"""
+        if not self.enabled:
+            return await process()
+
+        result = self._lookup(key)
+        if result is None and key in self._inflight:
+            try:
+                result = await asyncio.shield(self._inflight[key])
+            except Exception:
+                # 第一個請求失敗時，重複的請求自行處理
+                result = None
+            if result is not None and not result.get("success"):
+                result = None
+        if result is not None:
+            self.hits += 1
+            logger.info("收到重複的打卡請求，回放上次的結果")
+            return {**result, "duplicate": True}
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await process()
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # 避免無人等待時出現 "exception was never retrieved" 警告
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        if result.get("success"):
+            self._store(key, result)
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# 進程內共用的重複打卡快取
+punch_replay_cache = PunchReplayCache(settings.PUNCH_REPLAY_TTL, settings.PUNCH_REPLAY_MAX_ENTRIES)
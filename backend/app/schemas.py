@@ -54,10 +54,18 @@ class ClockOutRequest(BaseModel):
     employee_id: int
     image: str  # Base64 編碼的圖像
 
+# 人臉框模型 (圖像像素座標)
+class FaceBox(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+
 # 直接打卡請求模型 (無需登入)
 class DirectClockRequest(BaseModel):
     image: str  # Base64 編碼的圖像
     with_mask: bool = False
+    face_box: Optional[FaceBox] = None  # 前端檢測到的人臉框 (圖像像素座標)，伺服器會在其附近確認人臉
 
 # 打卡記錄響應模型
 class ClockRecordResponse(BaseModel):
@@ -67,6 +75,8 @@ class ClockRecordResponse(BaseModel):
     clock_in: Optional[datetime] = None
     clock_out: Optional[datetime] = None
     with_mask: bool = False
+    mask_verified: Optional[bool] = None
+    mask_mismatch: Optional[bool] = None
     created_at: datetime
     
     class Config:
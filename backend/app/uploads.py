@@ -0,0 +1,130 @@
+import logging
+from typing import Optional
+
+from fastapi import HTTPException, Request, status
+
+from app.config import settings
+from app.schemas import FaceBox
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+
+class ImageUpload:
+    """二進制圖像上傳：圖像原始位元組及隨附的欄位 (查詢參數與 multipart 表單欄位)"""
+
+    def __init__(self, data, fields):
+        self.data = data
+        self.fields = fields
+
+    def get_bool(self, name, default=False) -> bool:
+        value = self.fields.get(name)
+        if value is None or value == "":
+            return default
+        value = value.strip().lower()
+        if value in ("1", "true", "yes", "on"):
+            return True
+        if value in ("0", "false", "no", "off"):
+            return False
+        raise _invalid_field(name, value)
+
+    def get_int(self, name) -> int:
+        value = self.fields.get(name)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise _invalid_field(name, value)
+
+    def get_face_box(self, name="face_box") -> Optional[FaceBox]:
+        """人臉框欄位格式為 "x,y,width,height" (圖像像素座標)，未提供時返回None"""
+        value = self.fields.get(name)
+        if not value:
+            return None
+        try:
+            x, y, width, height = [float(v) for v in value.split(",")]
+        except ValueError:
+            raise _invalid_field(name, value)
+        return FaceBox(x=x, y=y, width=width, height=height)
+
+
+def _invalid_field(name, value):
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"欄位 {name} 的值無效: {value}"
+    )
+
+
+def _too_large():
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"圖像大小超過上限 {settings.MAX_IMAGE_SIZE} 位元組"
+    )
+
+
+def _check_length(size, allowance=0):
+    if settings.MAX_IMAGE_SIZE and size > settings.MAX_IMAGE_SIZE + allowance:
+        raise _too_large()
+
+
+# multipart 請求內容中邊界、各部分標頭與文字欄位的容許開銷 (位元組)
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+async def read_image_upload(request: Request) -> ImageUpload:
+    """FastAPI 依賴項：讀取二進制圖像上傳
+
+    支持兩種格式：
+    - 原始圖像 (Content-Type: image/jpeg 等)，其他欄位放在查詢參數中；
+      先檢查 Content-Length，讀取時再累計大小，超過上限立即以 413 中止
+    - multipart/form-data，圖像放在 image 欄位，其他欄位可放在表單或查詢參數中；
+      表單解析會先接收並暫存整個請求內容，無法在讀取中途中止，因此設置了大小上限時
+      必須提供 Content-Length (否則回應 411)，超過上限 (含表單開銷) 時在讀取前即以 413 拒絕
+    圖像不經 base64 編碼。
+    """
+    content_type = request.headers.get("content-type", "")
+    content_length = request.headers.get("content-length")
+    length = int(content_length) if content_length and content_length.isdigit() else None
+    fields = dict(request.query_params)
+
+    if content_type.startswith("multipart/form-data"):
+        if settings.MAX_IMAGE_SIZE:
+            if length is None:
+                raise HTTPException(
+                    status_code=status.HTTP_411_LENGTH_REQUIRED,
+                    detail="multipart 上傳需要提供 Content-Length"
+                )
+            _check_length(length, MULTIPART_OVERHEAD)
+        form = await request.form()
+        upload = form.get("image")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="請在 image 欄位上傳圖像文件"
+            )
+        fields.update({key: value for key, value in form.items() if isinstance(value, str)})
+        data = bytearray()
+        while True:
+            chunk = await upload.read(64 * 1024)
+            if not chunk:
+                break
+            data += chunk
+            _check_length(len(data))
+    elif content_type.startswith("image/") or content_type.startswith("application/octet-stream"):
+        if length is not None:
+            _check_length(length)
+        data = bytearray()
+        async for chunk in request.stream():
+            data += chunk
+            _check_length(len(data))
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="請以 image/jpeg 等圖像格式或 multipart/form-data 上傳圖像"
+        )
+
+    if not data:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="請提供有效的圖像數據"
+        )
+    return ImageUpload(data, fields)
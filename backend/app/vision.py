@@ -0,0 +1,298 @@
+import os
+import math
+import ipaddress
+import asyncio
+import logging
+import threading
+import functools
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, Request, status
+
+from app.config import settings
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+
+class VisionTimeout(Exception):
+    """視覺處理超過時限"""
+
+
+class VisionCancelled(Exception):
+    """視覺處理已被取消 (請求超時或客戶端中斷)"""
+
+
+class VisionOverloaded(Exception):
+    """排隊中的視覺請求已達上限，retry_after 為建議的重試秒數"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def vision_workers() -> int:
+    """視覺工作執行緒數量，未設置時取 CPU 核心數 (最多4個)"""
+    return settings.VISION_WORKERS or min(4, os.cpu_count() or 1)
+
+
+def get_vision_executor() -> ThreadPoolExecutor:
+    """取得進程內共用的視覺處理執行緒池
+
+    OpenCV 與 NumPy 在計算時會釋放 GIL，且人臉特徵庫常駐於本進程，
+    因此使用執行緒池而非進程池，避免每個任務都要傳送圖像與特徵庫。
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=vision_workers(), thread_name_prefix="vision")
+                logger.info(f"視覺處理執行緒池已啟動，{vision_workers()} 個執行緒")
+    return _executor
+
+
+def shutdown_vision_executor():
+    """關閉執行緒池，尚未開始的任務會被取消"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _run_unless_cancelled(cancelled, func, args, kwargs):
+    # 排隊期間已超時或被取消的任務直接放棄，不再佔用執行緒
+    if cancelled.is_set():
+        raise VisionCancelled()
+    return func(*args, **kwargs)
+
+
+def vision_deadline() -> float:
+    """返回一個請求的視覺處理截止時間 (事件循環時鐘)，供多個階段共用同一時限"""
+    return asyncio.get_running_loop().time() + settings.VISION_TIMEOUT
+
+
+async def run_vision(func, *args, deadline=None, **kwargs):
+    """在視覺執行緒池中執行 CPU 密集的函數，不阻塞事件循環
+
+    超過截止時間 (預設為現在起 settings.VISION_TIMEOUT 秒) 拋出 VisionTimeout。
+    超時或請求被取消時，尚未開始的任務會被略過；已在執行的階段無法中斷，
+    因此流水線應拆成多次調用 (解碼、檢測、識別、口罩)，共用同一個 deadline，
+    讓逾時的請求在下一個階段之前停止。
+    """
+    loop = asyncio.get_running_loop()
+    if deadline is None:
+        deadline = vision_deadline()
+    timeout = deadline - loop.time()
+    if timeout <= 0:
+        raise VisionTimeout()
+    cancelled = threading.Event()
+    future = loop.run_in_executor(
+        get_vision_executor(), functools.partial(_run_unless_cancelled, cancelled, func, args, kwargs)
+    )
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError:
+        cancelled.set()
+        logger.warning(f"視覺處理超過時限，已取消: {getattr(func, '__name__', func)}")
+        raise VisionTimeout()
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 1)
+
+
+class RecognitionScheduler:
+    """視覺請求的准入控制與公平排程 (每個工作進程一個，在事件循環中使用)
+
+    同時處理的請求數不超過 slots (與視覺執行緒池大小一致)，其餘請求按打卡機分組排隊：
+    每釋放一個名額，就輪流從下一台打卡機的隊列取出最早的請求，避免單一打卡機佔滿隊列。
+    排隊總數達到 max_queue 時新請求立即被拒絕，等待超過請求截止時間則放棄排隊。
+    """
+
+    def __init__(self, slots, max_queue):
+        self.slots = slots
+        self.max_queue = max_queue
+        self._busy = 0
+        self._waiting = 0
+        self._queues = OrderedDict()  # 格式: {kiosk_id: deque[Future]}
+        self._wait_ms = deque(maxlen=512)
+        self._service_ms = deque(maxlen=512)
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self):
+        return self._waiting
+
+    def retry_after(self):
+        """依近期的處理時間與隊列長度估算重試秒數"""
+        service_s = (_percentile(self._service_ms, 0.5) or 1000.0) / 1000.0
+        estimate = service_s * (self._waiting + 1) / max(self.slots, 1)
+        return max(1, min(60, math.ceil(estimate)))
+
+    async def acquire(self, kiosk_id, deadline):
+        """取得處理名額，返回開始處理的時間；隊列已滿拋出 VisionOverloaded，等待逾時拋出 VisionTimeout"""
+        loop = asyncio.get_running_loop()
+        enqueued_at = loop.time()
+        if self._busy < self.slots and not self._waiting:
+            self._busy += 1
+        else:
+            if self._waiting >= self.max_queue:
+                self.rejected += 1
+                raise VisionOverloaded(self.retry_after())
+            waiter = loop.create_future()
+            self._queues.setdefault(kiosk_id, deque()).append(waiter)
+            self._waiting += 1
+            self.max_depth = max(self.max_depth, self._waiting)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), max(deadline - loop.time(), 0))
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done():
+                    # 名額恰好在逾時的同時移交給本請求，轉交給下一個
+                    self._handoff()
+                else:
+                    waiter.cancel()
+                    self._forget(kiosk_id, waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.expired += 1
+                    raise VisionTimeout()
+                raise
+        self.admitted += 1
+        started_at = loop.time()
+        self._wait_ms.append((started_at - enqueued_at) * 1000)
+        return started_at
+
+    def release(self, started_at):
+        """釋放名額並移交給下一個排隊中的請求"""
+        self._service_ms.append((asyncio.get_running_loop().time() - started_at) * 1000)
+        self._handoff()
+
+    def _forget(self, kiosk_id, waiter):
+        queue = self._queues.get(kiosk_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[kiosk_id]
+
+    def _handoff(self):
+        # 輪流服務各打卡機：取出隊首打卡機的第一個請求後，將該打卡機移到隊尾
+        while self._queues:
+            kiosk_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(kiosk_id)
+            else:
+                del self._queues[kiosk_id]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._busy -= 1
+
+    def stats(self):
+        """隊列深度、等待時間與處理時間等指標"""
+        return {
+            "slots": self.slots,
+            "in_flight": self._busy,
+            "queue_depth": self._waiting,
+            "max_queue": self.max_queue,
+            "max_depth_seen": self.max_depth,
+            "kiosks_waiting": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "wait_ms_p50": _percentile(self._wait_ms, 0.5),
+            "wait_ms_p95": _percentile(self._wait_ms, 0.95),
+            "service_ms_p50": _percentile(self._service_ms, 0.5),
+            "service_ms_p95": _percentile(self._service_ms, 0.95),
+        }
+
+
+# 進程內共用的視覺請求排程器
+recognition_scheduler = RecognitionScheduler(vision_workers(), settings.VISION_QUEUE_MAX)
+
+
+def _trusted_networks():
+    networks = []
+    for network in settings.KIOSK_TRUSTED_NETWORKS:
+        try:
+            networks.append(ipaddress.ip_network(network, strict=False))
+        except ValueError:
+            logger.error(f"KIOSK_TRUSTED_NETWORKS 中的網段無效，已略過: {network}")
+    return tuple(networks)
+
+
+# 可信任 X-Kiosk-ID 標頭的客戶端網段
+kiosk_trusted_networks = _trusted_networks()
+
+
+def _is_trusted_kiosk(host):
+    if not kiosk_trusted_networks or not host:
+        return False
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in kiosk_trusted_networks)
+
+
+def kiosk_id(request: Request) -> str:
+    """識別請求來源的打卡機：來自可信任網段的請求使用 X-Kiosk-ID 標頭，否則使用客戶端 IP
+
+    標頭由客戶端自行設置，若一律採用，同一客戶端輪換標頭即可每次取得新的排隊隊列。
+    """
+    host = request.client.host if request.client else None
+    header = request.headers.get("X-Kiosk-ID")
+    if header and _is_trusted_kiosk(host):
+        return f"kiosk:{header}"
+    return host or "unknown"
+
+
+@asynccontextmanager
+async def recognition_slot(request: Request):
+    """取得視覺處理名額的上下文管理器，返回該請求的處理截止時間
+
+    隊列已滿或排隊逾時回應 503 並附上 Retry-After；離開時釋放名額。
+    """
+    deadline = vision_deadline()
+    try:
+        started_at = await recognition_scheduler.acquire(kiosk_id(request), deadline)
+    except VisionOverloaded as e:
+        logger.warning(f"視覺請求隊列已滿 ({recognition_scheduler.depth})，拒絕來自 {kiosk_id(request)} 的請求")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="系統忙碌，請稍後再試",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except VisionTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="系統忙碌，排隊逾時，請稍後再試",
+            headers={"Retry-After": str(recognition_scheduler.retry_after())}
+        )
+    try:
+        yield deadline
+    finally:
+        recognition_scheduler.release(started_at)
+
+
+async def admit_recognition(request: Request):
+    """FastAPI 依賴項：請求在取得視覺處理名額後才進入端點，返回該請求的處理截止時間"""
+    async with recognition_slot(request) as deadline:
+        yield deadline
@@ -0,0 +1,291 @@
+import os
+import time
+import queue
+import signal
+import logging
+import argparse
+import threading
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+from app.config import settings
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+
+class VisionServerError(RuntimeError):
+    """視覺推論服務無法連線、逾時或回報錯誤"""
+
+
+def _authkey():
+    # 與工作進程共用的連線驗證金鑰，未設置時沿用 SECRET_KEY
+    return (settings.VISION_SERVER_AUTHKEY or settings.SECRET_KEY).encode("utf-8")
+
+
+class _MaskRequest:
+    """一個連線送來的口罩分類請求，由推論執行緒填入結果"""
+
+    __slots__ = ("crops", "bgr", "done", "result", "error")
+
+    def __init__(self, crops, bgr):
+        self.crops = crops
+        self.bgr = bgr
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class VisionServer:
+    """共用的視覺推論服務 (獨立進程)
+
+    多個 Web 工作進程各自載入口罩模型時，每個進程都要保存一份權重並獨立推論。
+    改由本服務載入一次模型，工作進程經 Unix socket 送來人臉裁剪；每個連線一個執行緒接收請求，
+    一個推論執行緒把所有工作進程等待中的請求合併為一個批次 (最多 batch_max 張裁剪) 推論。
+    推論進行中到達的請求自然累積在佇列中，不需要額外的等待時間窗。
+    """
+
+    def __init__(self, address, batch_max):
+        self.address = address
+        self.batch_max = max(1, batch_max)
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self.queue_depth = 0      # 等待推論的裁剪數
+        self.max_depth_seen = 0
+        self.clients = 0
+        self.requests = 0
+        self.batches = 0
+        self.crops = 0
+        self.errors = 0
+        self.model_loaded = False
+        self.started_at = time.time()
+
+    def submit(self, crops, bgr):
+        request = _MaskRequest(crops, bgr)
+        with self._lock:
+            self.requests += 1
+            self.queue_depth += len(crops)
+            self.max_depth_seen = max(self.max_depth_seen, self.queue_depth)
+        self._pending.put(request)
+        return request
+
+    def _run_inference(self):
+        from models.mask_detection import classify_masks
+
+        while True:
+            batch = [self._pending.get()]
+            count = len(batch[0].crops)
+            while count < self.batch_max:
+                try:
+                    request = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(request)
+                count += len(request.crops)
+            with self._lock:
+                self.queue_depth -= count
+                self.batches += 1
+                self.crops += count
+
+            # RGB 與 BGR 的裁剪分開推論 (工作進程的裁剪通常都是 BGR)
+            for bgr in (True, False):
+                group = [request for request in batch if request.bgr == bgr]
+                if not group:
+                    continue
+                try:
+                    results = classify_masks([crop for request in group for crop in request.crops],
+                                             bgr=bgr, strict=True)
+                    self.model_loaded = True
+                except Exception as e:
+                    self.errors += 1
+                    for request in group:
+                        request.error = str(e)
+                        request.done.set()
+                    continue
+                start = 0
+                for request in group:
+                    request.result = results[start:start + len(request.crops)]
+                    start += len(request.crops)
+                    request.done.set()
+
+    def _serve_connection(self, conn):
+        with self._lock:
+            self.clients += 1
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = message[0]
+                if op == "masks":
+                    request = self.submit(message[1], message[2])
+                    request.done.wait()
+                    reply = ("error", request.error) if request.error else ("ok", request.result)
+                elif op == "stats":
+                    reply = ("ok", self.stats())
+                else:
+                    reply = ("error", f"未知的請求: {op}")
+                try:
+                    conn.send(reply)
+                except (OSError, ValueError):
+                    # 工作進程逾時後已關閉連線
+                    return
+        finally:
+            conn.close()
+            with self._lock:
+                self.clients -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_depth_seen": self.max_depth_seen,
+                "clients": self.clients,
+                "requests": self.requests,
+                "batches": self.batches,
+                "crops": self.crops,
+                "mean_batch": round(self.crops / self.batches, 2) if self.batches else None,
+                "errors": self.errors,
+                "model_loaded": self.model_loaded,
+                "uptime_seconds": round(time.time() - self.started_at),
+            }
+
+    def serve_forever(self):
+        from models.mask_detection import warm_up_mask_model
+
+        # 先載入並預熱模型，工作進程連上時即可推論
+        self.model_loaded = warm_up_mask_model()
+        if not self.model_loaded:
+            logger.error("口罩檢測模型無法載入，服務仍會啟動，請求將回報錯誤")
+
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        listener = Listener(self.address, family="AF_UNIX", authkey=_authkey())
+        # 只允許同一使用者與群組的工作進程連線
+        os.chmod(self.address, 0o660)
+        threading.Thread(target=self._run_inference, name="vision-inference", daemon=True).start()
+        logger.info(f"視覺推論服務已啟動: {self.address} (每批最多 {self.batch_max} 張)")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except AuthenticationError:
+                    logger.warning("拒絕驗證金鑰不符的連線")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,),
+                                 name="vision-client", daemon=True).start()
+        finally:
+            listener.close()
+
+
+class VisionServerClient:
+    """工作進程端的視覺推論服務客戶端 (可作為 mask_detection 的口罩分類後端)
+
+    連線在多個執行緒間以連線池共用，每個連線同一時間只處理一個請求；
+    逾時或出錯的連線直接關閉，不放回連線池。
+    """
+
+    def __init__(self, address, timeout):
+        self.address = address
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _call(self, message, timeout=None):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        # 連線池中的連線可能在服務重啟後失效，失敗時以新連線重試一次
+        retry = conn is not None
+        while True:
+            try:
+                if conn is None:
+                    conn = Client(self.address, family="AF_UNIX", authkey=_authkey())
+                conn.send(message)
+                if not conn.poll(timeout or self.timeout):
+                    raise VisionServerError("視覺推論服務回應逾時")
+                status, payload = conn.recv()
+                break
+            except VisionServerError:
+                conn.close()
+                raise
+            except (OSError, EOFError, AuthenticationError) as e:
+                if conn is not None:
+                    conn.close()
+                conn = None
+                if retry:
+                    retry = False
+                    continue
+                raise VisionServerError(f"無法連線視覺推論服務 {self.address}: {str(e)}")
+        with self._lock:
+            self._idle.append(conn)
+        if status != "ok":
+            raise VisionServerError(payload)
+        return payload
+
+    def classify(self, face_imgs, bgr):
+        """把人臉裁剪送到服務分類，返回 bool 列表"""
+        return self._call(("masks", list(face_imgs), bgr))
+
+    def ready(self):
+        """服務可連線且模型已載入"""
+        try:
+            return bool(self._call(("stats",), timeout=2.0)["model_loaded"])
+        except VisionServerError as e:
+            logger.warning(str(e))
+            return False
+
+    def stats(self):
+        try:
+            stats = self._call(("stats",), timeout=1.0)
+        except VisionServerError as e:
+            return {"enabled": True, "reachable": False, "error": str(e)}
+        return {"enabled": True, "reachable": True, **stats}
+
+
+# 工作進程的服務客戶端，未設置 VISION_SERVER_SOCKET 時為None
+vision_server_client = None
+
+
+def connect_vision_server():
+    """工作進程啟動時調用：設置了 VISION_SERVER_SOCKET 時，口罩分類改由視覺推論服務執行"""
+    global vision_server_client
+    if not settings.VISION_SERVER_SOCKET or vision_server_client is not None:
+        return
+    from models.mask_detection import set_mask_classifier_backend
+
+    vision_server_client = VisionServerClient(settings.VISION_SERVER_SOCKET, settings.VISION_TIMEOUT)
+    set_mask_classifier_backend(vision_server_client)
+    logger.info(f"口罩分類使用視覺推論服務: {settings.VISION_SERVER_SOCKET}")
+
+
+def vision_server_stats():
+    if vision_server_client is None:
+        return {"enabled": False}
+    return vision_server_client.stats()
+
+
+def _exit(signum, frame):
+    raise SystemExit(0)
+
+
+def main():
+    """在 backend 目錄下執行: python -m app.vision_server [--socket /run/attendance/vision.sock]
+
+    工作進程設置相同的 VISION_SERVER_SOCKET 後即改用本服務；未設置時仍在進程內推論。
+    """
+    parser = argparse.ArgumentParser(description="共用的視覺推論服務")
+    parser.add_argument("--socket", default=settings.VISION_SERVER_SOCKET, help="Unix socket 路徑")
+    parser.add_argument("--batch-max", type=int, default=settings.VISION_SERVER_BATCH_MAX,
+                        help="每批推論的最大裁剪數")
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("請以 --socket 或 VISION_SERVER_SOCKET 指定 Unix socket 路徑")
+
+    logging.basicConfig(level=logging.INFO)
+    # 收到 SIGTERM 時正常結束，關閉監聽並刪除 socket 文件
+    signal.signal(signal.SIGTERM, _exit)
+    VisionServer(args.socket, args.batch_max).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
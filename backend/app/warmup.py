@@ -0,0 +1,90 @@
+import time
+import logging
+import threading
+
+from app.config import settings
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+# 各元件的預熱狀態: cold (未載入) / warming (預熱中) / warm (可用) / failed (預熱失敗)
+_components = {}
+_components_lock = threading.Lock()
+_warmup_thread = None
+
+
+def _set_state(name, state, seconds=None, error=None):
+    with _components_lock:
+        _components[name] = {"state": state, "seconds": seconds, "error": error}
+
+
+def warm_component(name, func):
+    """執行一個元件的預熱函數並記錄狀態與耗時；函數返回 False 或拋出異常視為失敗"""
+    _set_state(name, "warming")
+    start = time.perf_counter()
+    try:
+        ok = func()
+        error = None if ok is not False else "預熱未成功"
+    except Exception as e:
+        ok, error = False, str(e)
+    seconds = round(time.perf_counter() - start, 3)
+    if ok is False:
+        logger.error(f"元件 {name} 預熱失敗 ({seconds}s): {error}")
+        _set_state(name, "failed", seconds, error)
+    else:
+        logger.info(f"元件 {name} 預熱完成 ({seconds}s)")
+        _set_state(name, "warm", seconds)
+
+
+def _warm_face_pipeline():
+    # 以空白影格執行一次檢測與編碼，載入級聯分類器與 HOG 描述子
+    import numpy as np
+    from models.face_recognition import detect_faces_gray, encode_faces, face_cascade
+
+    if face_cascade is None:
+        return False
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    detect_faces_gray(frame[:, :, 0])
+    encode_faces(frame, [[200, 120, 160, 160]])
+    return True
+
+
+def _warm_mask_model():
+    from models.mask_detection import warm_up_mask_model
+    return warm_up_mask_model()
+
+
+def _run_warmup():
+    warm_component("face_pipeline", _warm_face_pipeline)
+    warm_component("mask_model", _warm_mask_model)
+
+
+def start_warmup():
+    """在背景執行緒中預熱人臉管線與口罩模型，不阻塞應用啟動"""
+    global _warmup_thread
+    if not settings.WARMUP_ON_STARTUP or _warmup_thread is not None:
+        return
+    for name in ("face_pipeline", "mask_model"):
+        _set_state(name, "warming")
+    _warmup_thread = threading.Thread(target=_run_warmup, name="warmup", daemon=True)
+    _warmup_thread.start()
+
+
+def warmup_report():
+    """返回 (是否就緒, 各元件狀態)；仍有元件在預熱中時視為未就緒
+
+    預熱失敗的元件不阻擋流量 (例如口罩模型無法載入時，口罩檢測會退回未佩戴)，
+    但會在狀態中標示，供監控發現。
+    """
+    from models.face_recognition import face_gallery
+
+    with _components_lock:
+        components = {name: dict(info) for name, info in _components.items()}
+    components.setdefault("face_pipeline", {"state": "cold", "seconds": None, "error": None})
+    components.setdefault("mask_model", {"state": "cold", "seconds": None, "error": None})
+    components["face_gallery"] = {
+        "state": "warm" if face_gallery.loaded else "cold",
+        "entries": len(face_gallery),
+    }
+    ready = not any(info["state"] == "warming" for info in components.values())
+    return ready, components
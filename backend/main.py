@@ -1,16 +1,28 @@
 from fastapi import FastAPI, Request, Depends, HTTPException, status, Form, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 import socketio
 import logging
 import os
 from datetime import datetime, date, timedelta
-from app.database import Base, engine, SessionLocal, Employee, ClockRecord, get_db
+from app.database import Base, engine, SessionLocal, Employee, ClockRecord, get_db, upgrade_schema
 from app.api import auth, attendance, employee
 from app.config import settings
 from app.auth import get_password_hash, verify_password, create_access_token
+from app.face_store import load_face_gallery
+from app.vision import get_vision_executor, shutdown_vision_executor, recognition_scheduler
+from app.face_batching import face_match_batcher
+from app.punch_replay import punch_replay_cache
+from app.punch_debounce import punch_debouncer
+from app.mask_verification import mask_verifier
+from app.vision_server import connect_vision_server, vision_server_stats
+from app.warmup import start_warmup, warmup_report
+from models.face_recognition import face_gallery, configure_face_detection, FACE_ENCODER_VERSION
+from models.face_projection import load_face_projection
+from models.image_decode import configure_image_decoding
 from sqlalchemy.orm import Session
 
 # 設置日誌
@@ -20,8 +32,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger("main")
 
-# 創建數據庫表
+# 創建數據庫表，並為已存在的表補上新增的欄位
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 # 創建默認管理員賬戶（如果不存在）
 def create_default_admin():
@@ -63,6 +76,17 @@ def create_default_admin():
 # 執行初始化
 create_default_admin()
 
+# 預先載入人臉特徵庫，讓打卡請求不需再讀取資料庫
+def preload_face_gallery():
+    db = SessionLocal()
+    try:
+        count = load_face_gallery(db)
+        logger.info(f"人臉特徵庫預載完成，共 {count} 筆")
+    except Exception as e:
+        logger.error(f"預載人臉特徵庫時發生錯誤: {str(e)}")
+    finally:
+        db.close()
+
 # 建立 Socket.IO 伺服器
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 socket_app = socketio.ASGIApp(sio)
@@ -100,6 +124,39 @@ app.include_router(auth.router, prefix="/api/auth", tags=["認證"])
 app.include_router(attendance.router, prefix="/api/attendance", tags=["打卡"])
 app.include_router(employee.router, prefix="/api/employees", tags=["員工管理"])
 
+# 配置人臉特徵庫後預先載入
+@app.on_event("startup")
+async def start_face_gallery():
+    # 特徵庫索引後端
+    if settings.FACE_INDEX_BACKEND == "ivf":
+        face_gallery.set_index("ivf", nlist=settings.FACE_INDEX_NLIST, nprobe=settings.FACE_INDEX_NPROBE,
+                               train_min=settings.FACE_INDEX_TRAIN_MIN)
+    else:
+        face_gallery.set_index(settings.FACE_INDEX_BACKEND)
+    # 特徵庫人數上限 (0 表示不限)
+    face_gallery.max_entries = settings.FACE_GALLERY_MAX_ENTRIES
+    # 載入降維投影 (若已擬合)，特徵庫與識別都會使用同一個投影
+    face_gallery.set_projection(load_face_projection(settings.FACE_PROJECTION_PATH, FACE_ENCODER_VERSION))
+    preload_face_gallery()
+
+# 視覺處理執行緒池隨應用啟動與關閉
+@app.on_event("startup")
+async def start_vision_executor():
+    # 配置人臉檢測解析度，以及上傳圖像的大小限制與縮小解碼
+    configure_face_detection(settings.FACE_DETECT_MAX_EDGE, settings.FACE_DETECT_REFINE)
+    configure_image_decoding(settings.MAX_IMAGE_SIZE, settings.MAX_IMAGE_PIXELS, settings.IMAGE_DECODE_MAX_EDGE)
+    get_vision_executor()
+    # 設置了共用的視覺推論服務時，口罩分類改由服務執行
+    connect_vision_server()
+    # 在背景預熱人臉管線與口罩模型，預熱完成前 /health 回應 503
+    start_warmup()
+
+@app.on_event("shutdown")
+async def stop_vision_executor():
+    shutdown_vision_executor()
+    # 等待已排入的背景口罩驗證寫入資料庫
+    mask_verifier.stop()
+
 # 將 Socket.IO 應用掛載到 FastAPI
 app.mount("/socket.io", socket_app)
 
@@ -296,7 +353,25 @@ async def api_root():
 # 健康检查端点
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    # 仍有元件在預熱中時回應 503，負載平衡器只會將流量導向已預熱的工作進程
+    ready, components = warmup_report()
+    # 共用視覺推論服務的隊列深度需經 socket 查詢，不在事件循環中阻塞
+    vision_server = await run_in_threadpool(vision_server_stats)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "healthy" if ready else "warming",
+            "timestamp": datetime.now().isoformat(),
+            "components": components,
+            # 本工作進程的視覺請求隊列深度與等待時間
+            "recognition_queue": recognition_scheduler.stats(),
+            "face_match_batching": face_match_batcher.stats(),
+            "punch_replay": punch_replay_cache.stats(),
+            "punch_debounce": punch_debouncer.stats(),
+            "mask_verification": mask_verifier.stats(),
+            "vision_server": vision_server
+        }
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,483 @@
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("face_index")
+
+# 延遲導入處理依賴
+def load_np():
+    try:
+        import numpy as np
+        return np
+    except ImportError as e:
+        logger.error(f"無法導入NumPy: {str(e)}")
+        raise
+
+# 支持的索引後端
+INDEX_BACKENDS = ("exact", "ivf")
+
+
+def _top_k(ids, sq_dists, k):
+    """從平方距離中取前k名，返回 [(employee_id, distance), ...]；無窮大表示已刪除"""
+    np = load_np()
+    k = min(k, len(sq_dists))
+    if k < len(sq_dists):
+        top = np.argpartition(sq_dists, k - 1)[:k]
+    else:
+        top = np.arange(len(sq_dists))
+    top = top[np.argsort(sq_dists[top])]
+    top = top[np.isfinite(sq_dists[top])]
+    dists = np.sqrt(np.maximum(sq_dists[top], 0.0))
+    return [(ids[row], float(dist)) for row, dist in zip(top, dists)]
+
+
+class ExactFaceIndex:
+    """精確索引：所有向量保存在一個連續的 float32 矩陣中並預先計算平方範數，
+    一次矩陣向量乘法 (BLAS) 算出探針與全部向量的距離。
+
+    本類不加鎖，由 FaceGallery 負責同步。
+    """
+
+    backend = "exact"
+
+    def __init__(self):
+        self._ids = []        # 第i列對應的員工ID (str)
+        self._rows = {}       # 格式: {employee_id(str): 列索引}
+        self._matrix = None   # 形狀 (容量, 維度) 的 float32 矩陣，前 len(self) 列有效
+        self._sq_norms = None # 每列的平方範數
+
+    @property
+    def dim(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @property
+    def nbytes(self):
+        if self._matrix is None:
+            return 0
+        return self._matrix.nbytes + self._sq_norms.nbytes
+
+    def _reserve(self, capacity, dim):
+        """確保矩陣至少有 capacity 列，以倍增方式擴容"""
+        np = load_np()
+        if self._matrix is not None and self._matrix.shape[0] >= capacity:
+            return
+        new_capacity = max(capacity, 16 if self._matrix is None else self._matrix.shape[0] * 2)
+        matrix = np.zeros((new_capacity, dim), dtype=np.float32)
+        sq_norms = np.zeros(new_capacity, dtype=np.float32)
+        if self._matrix is not None:
+            matrix[:len(self._ids)] = self._matrix[:len(self._ids)]
+            sq_norms[:len(self._ids)] = self._sq_norms[:len(self._ids)]
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+
+    def build(self, ids, matrix):
+        """以完整的 (ids, 矩陣) 替換索引內容"""
+        np = load_np()
+        self._ids = list(ids)
+        self._rows = {emp_id: row for row, emp_id in enumerate(self._ids)}
+        if len(self._ids):
+            self._matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            self._sq_norms = np.einsum("ij,ij->i", self._matrix, self._matrix)
+        else:
+            self._matrix = None
+            self._sq_norms = None
+
+    def add(self, employee_id, vector):
+        """新增或替換單一向量"""
+        if self._matrix is not None and vector.shape[0] != self.dim:
+            raise ValueError(f"人臉編碼維度 {vector.shape[0]} 與索引維度 {self.dim} 不一致")
+        row = self._rows.get(employee_id)
+        if row is None:
+            row = len(self._ids)
+            self._reserve(row + 1, vector.shape[0])
+            self._ids.append(employee_id)
+            self._rows[employee_id] = row
+        self._matrix[row] = vector
+        self._sq_norms[row] = float(vector @ vector)
+
+    def remove(self, employee_id):
+        """移除單一向量（以最後一列填補空位）"""
+        row = self._rows.pop(employee_id, None)
+        if row is None:
+            return False
+        last = len(self._ids) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._ids.pop()
+        self._shrink()
+        return True
+
+    def _shrink(self):
+        """大量刪除後使用率低於四分之一時減半容量，避免長時間運行的進程只增不減"""
+        np = load_np()
+        capacity = self._matrix.shape[0]
+        size = len(self._ids)
+        if capacity <= 64 or size * 4 > capacity:
+            return
+        new_capacity = max(capacity // 2, 16)
+        self._matrix = np.array(self._matrix[:new_capacity])
+        self._sq_norms = np.array(self._sq_norms[:new_capacity])
+
+    def search(self, probe, k=1):
+        """返回與探針距離最近的前k名 [(employee_id, distance), ...]，按距離升序"""
+        np = load_np()
+        size = len(self._ids)
+        if size == 0:
+            return []
+        if probe.shape[0] != self.dim:
+            raise ValueError(f"探針維度 {probe.shape[0]} 與索引維度 {self.dim} 不一致")
+
+        # ||x - q||^2 = ||x||^2 - 2 x·q + ||q||^2，一次矩陣向量乘法完成所有比對
+        sq_dists = self._sq_norms[:size] - 2.0 * (self._matrix[:size] @ probe) + float(probe @ probe)
+        return _top_k(self._ids, sq_dists, k)
+
+    def search_batch(self, probes, k=1):
+        """一次比對多個探針 (形狀 (P, 維度))，返回每個探針的前k名列表
+
+        P 個探針的距離由一次矩陣乘法 (GEMM) 算出，特徵庫矩陣只讀取一遍。
+        """
+        np = load_np()
+        size = len(self._ids)
+        if size == 0:
+            return [[] for _ in range(len(probes))]
+        if probes.shape[1] != self.dim:
+            raise ValueError(f"探針維度 {probes.shape[1]} 與索引維度 {self.dim} 不一致")
+
+        sq_dists = self._sq_norms[:size] - 2.0 * (probes @ self._matrix[:size].T)
+        sq_dists += np.einsum("ij,ij->i", probes, probes)[:, None]
+        return [_top_k(self._ids, row, k) for row in sq_dists]
+
+    def arrays(self):
+        """返回 (ids, 矩陣視圖)，僅包含有效列"""
+        if self._matrix is None:
+            return [], None
+        return list(self._ids), self._matrix[:len(self._ids)]
+
+    def vector(self, employee_id):
+        row = self._rows.get(employee_id)
+        return None if row is None else self._matrix[row]
+
+    def __contains__(self, employee_id):
+        return employee_id in self._rows
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class IVFFlatFaceIndex:
+    """近似索引 (IVF-flat)：以 k-means 將向量分到 nlist 個倒排列表，
+    查詢時只掃描距離探針最近的 nprobe 個列表。
+
+    每個倒排列表都是一個 ExactFaceIndex，因此新增、替換、刪除都是增量操作。
+    向量數少於 train_min 時尚未訓練，行為與精確索引相同；
+    訓練後向量數增長到訓練時的 retrain_factor 倍會自動重新訓練。
+    """
+
+    backend = "ivf"
+
+    def __init__(self, nlist=0, nprobe=8, train_min=1024, retrain_factor=2.0, seed=0):
+        self.nlist = nlist          # 0 表示依訓練時的向量數自動決定 (約 4*sqrt(N))
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self._centroids = None
+        self._centroid_sq_norms = None
+        self._lists = [ExactFaceIndex()]
+        self._assignment = {}       # 格式: {employee_id(str): 列表編號}
+        self._trained_size = 0
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    @property
+    def dim(self):
+        for inverted_list in self._lists:
+            if inverted_list.dim is not None:
+                return inverted_list.dim
+        return None
+
+    @property
+    def nbytes(self):
+        total = sum(inverted_list.nbytes for inverted_list in self._lists)
+        if self._centroids is not None:
+            total += self._centroids.nbytes + self._centroid_sq_norms.nbytes
+        return total
+
+    def _kmeans(self, matrix, nlist, iterations=10):
+        """以 NumPy 實現的 k-means，返回質心矩陣"""
+        np = load_np()
+        rng = np.random.default_rng(self.seed)
+        # 大型特徵庫只取樣本訓練，每個質心約256個樣本已足夠
+        sample_size = min(len(matrix), nlist * 256)
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._nearest_centroids(sample, centroids)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # 依列表排序後以 reduceat 分段求和，比 np.add.at 快得多
+            order = np.argsort(assign, kind="stable")
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.add.reduceat(sample[order], starts[~empty], axis=0)
+            centroids[~empty] = sums / counts[~empty, None]
+            # 空的列表以隨機樣本重新初始化
+            if empty.any():
+                centroids[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+        return centroids
+
+    def _nearest_centroids(self, matrix, centroids, chunk=8192):
+        """返回每列最近質心的編號"""
+        np = load_np()
+        c_sq = np.einsum("ij,ij->i", centroids, centroids)
+        assign = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), chunk):
+            block = matrix[start:start + chunk]
+            assign[start:start + len(block)] = np.argmin(c_sq - 2.0 * (block @ centroids.T), axis=1)
+        return assign
+
+    def _train_and_assign(self, ids, matrix):
+        np = load_np()
+        nlist = self.nlist or int(4 * np.sqrt(len(ids)))
+        nlist = max(1, min(nlist, len(ids)))
+        centroids = self._kmeans(matrix, nlist)
+        assign = self._nearest_centroids(matrix, centroids)
+
+        lists = []
+        for list_no in range(nlist):
+            members = np.flatnonzero(assign == list_no)
+            inverted_list = ExactFaceIndex()
+            inverted_list.build([ids[i] for i in members], matrix[members])
+            lists.append(inverted_list)
+
+        self._centroids = centroids
+        self._centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+        self._lists = lists
+        self._assignment = {emp_id: int(list_no) for emp_id, list_no in zip(ids, assign)}
+        self._trained_size = len(ids)
+        logger.info(f"IVF 索引訓練完成: {len(ids)} 筆向量, {nlist} 個列表, nprobe={self.nprobe}")
+
+    def build(self, ids, matrix):
+        """以完整的 (ids, 矩陣) 替換索引內容，向量足夠時訓練質心"""
+        ids = list(ids)
+        if len(ids) >= self.train_min:
+            self._train_and_assign(ids, matrix)
+            return
+        flat = ExactFaceIndex()
+        flat.build(ids, matrix)
+        self._centroids = None
+        self._centroid_sq_norms = None
+        self._lists = [flat]
+        self._assignment = {emp_id: 0 for emp_id in ids}
+        self._trained_size = 0
+
+    def rebuild(self):
+        """以目前所有向量重新訓練索引"""
+        ids, matrix = self.arrays()
+        self.build(ids, matrix)
+
+    def add(self, employee_id, vector):
+        """新增或替換單一向量"""
+        np = load_np()
+        if self.trained:
+            list_no = int(np.argmin(self._centroid_sq_norms - 2.0 * (self._centroids @ vector)))
+        else:
+            list_no = 0
+        old_list = self._assignment.get(employee_id)
+        if old_list is not None and old_list != list_no:
+            self._lists[old_list].remove(employee_id)
+        self._lists[list_no].add(employee_id, vector)
+        self._assignment[employee_id] = list_no
+
+        # 未訓練時達到門檻，或訓練後規模明顯增長，則重新訓練
+        if (not self.trained and len(self) >= self.train_min) or \
+                (self.trained and len(self) >= self._trained_size * self.retrain_factor):
+            self.rebuild()
+
+    def remove(self, employee_id):
+        list_no = self._assignment.pop(employee_id, None)
+        if list_no is None:
+            return False
+        return self._lists[list_no].remove(employee_id)
+
+    def search(self, probe, k=1):
+        """只在最近的 nprobe 個列表中搜索，返回 [(employee_id, distance), ...]"""
+        np = load_np()
+        if not self.trained:
+            return self._lists[0].search(probe, k)
+
+        nprobe = min(self.nprobe, len(self._lists))
+        centroid_dists = self._centroid_sq_norms - 2.0 * (self._centroids @ probe)
+        probed = np.argpartition(centroid_dists, nprobe - 1)[:nprobe]
+        candidates = []
+        for list_no in probed:
+            candidates.extend(self._lists[list_no].search(probe, k))
+        candidates.sort(key=lambda item: item[1])
+        return candidates[:k]
+
+    def search_batch(self, probes, k=1):
+        """逐個探針搜索 (各探針探測的列表不同，無法合併為一次矩陣乘法)"""
+        return [self.search(probe, k) for probe in probes]
+
+    def arrays(self):
+        """返回 (ids, 矩陣)，矩陣為各列表的合併副本"""
+        np = load_np()
+        ids, blocks = [], []
+        for inverted_list in self._lists:
+            list_ids, block = inverted_list.arrays()
+            if list_ids:
+                ids.extend(list_ids)
+                blocks.append(block)
+        return ids, (np.vstack(blocks) if blocks else None)
+
+    def vector(self, employee_id):
+        list_no = self._assignment.get(employee_id)
+        return None if list_no is None else self._lists[list_no].vector(employee_id)
+
+    def __contains__(self, employee_id):
+        return employee_id in self._assignment
+
+    def __len__(self):
+        return len(self._assignment)
+
+
+class MappedFaceIndex:
+    """以共享快照為基底的精確索引
+
+    基底向量來自以 np.memmap 打開的快照文件 (只讀)，多個工作進程共用作業系統
+    頁面快取中的同一份數據；本進程內的新增與替換寫入私有的 ExactFaceIndex，
+    刪除與被替換的基底列以遮罩標記，不會修改快照。
+    """
+
+    backend = "exact"
+
+    def __init__(self, ids, matrix, sq_norms):
+        np = load_np()
+        self._base_ids = list(ids)
+        self._base_rows = {emp_id: row for row, emp_id in enumerate(self._base_ids)}
+        self._base_matrix = matrix
+        self._base_sq_norms = sq_norms
+        self._base_alive = np.ones(len(self._base_ids), dtype=bool)
+        self._base_live = len(self._base_ids)
+        self._delta = ExactFaceIndex()
+
+    @property
+    def dim(self):
+        if self._base_ids:
+            return self._base_matrix.shape[1]
+        return self._delta.dim
+
+    @property
+    def nbytes(self):
+        """本進程私有的記憶體用量 (不含共享快照)"""
+        return self._delta.nbytes + self._base_alive.nbytes
+
+    @property
+    def stale_rows(self):
+        """快照中已被刪除或替換、仍佔用映射空間的列數"""
+        return len(self._base_ids) - self._base_live
+
+    @property
+    def mapped_bytes(self):
+        """共享快照映射的大小"""
+        if not self._base_ids:
+            return 0
+        return self._base_matrix.nbytes + self._base_sq_norms.nbytes
+
+    def _kill_base(self, employee_id):
+        row = self._base_rows.get(employee_id)
+        if row is None or not self._base_alive[row]:
+            return False
+        self._base_alive[row] = False
+        self._base_live -= 1
+        return True
+
+    def add(self, employee_id, vector):
+        """新增或替換單一向量（寫入私有增量，基底中的舊向量標記為刪除）"""
+        if self.dim is not None and vector.shape[0] != self.dim:
+            raise ValueError(f"人臉編碼維度 {vector.shape[0]} 與索引維度 {self.dim} 不一致")
+        self._kill_base(employee_id)
+        self._delta.add(employee_id, vector)
+
+    def remove(self, employee_id):
+        if self._delta.remove(employee_id):
+            return True
+        return self._kill_base(employee_id)
+
+    def search(self, probe, k=1):
+        np = load_np()
+        if self.dim is not None and probe.shape[0] != self.dim:
+            raise ValueError(f"探針維度 {probe.shape[0]} 與索引維度 {self.dim} 不一致")
+        candidates = []
+        if self._base_live:
+            sq_dists = self._base_sq_norms - 2.0 * (self._base_matrix @ probe) + float(probe @ probe)
+            if self._base_live < len(self._base_ids):
+                sq_dists[~self._base_alive] = np.inf
+            candidates.extend(_top_k(self._base_ids, sq_dists, k))
+        candidates.extend(self._delta.search(probe, k))
+        candidates.sort(key=lambda item: item[1])
+        return candidates[:k]
+
+    def search_batch(self, probes, k=1):
+        np = load_np()
+        if self.dim is not None and probes.shape[1] != self.dim:
+            raise ValueError(f"探針維度 {probes.shape[1]} 與索引維度 {self.dim} 不一致")
+        results = [[] for _ in range(len(probes))]
+        if self._base_live:
+            sq_dists = self._base_sq_norms - 2.0 * (probes @ self._base_matrix.T)
+            sq_dists += np.einsum("ij,ij->i", probes, probes)[:, None]
+            if self._base_live < len(self._base_ids):
+                sq_dists[:, ~self._base_alive] = np.inf
+            for candidates, row in zip(results, sq_dists):
+                candidates.extend(_top_k(self._base_ids, row, k))
+        for candidates, delta in zip(results, self._delta.search_batch(probes, k)):
+            candidates.extend(delta)
+            candidates.sort(key=lambda item: item[1])
+            del candidates[k:]
+        return results
+
+    def arrays(self):
+        """返回 (ids, 矩陣)，矩陣為有效基底列與增量的合併副本"""
+        np = load_np()
+        ids, blocks = [], []
+        if self._base_live:
+            alive_rows = np.flatnonzero(self._base_alive)
+            ids.extend(self._base_ids[row] for row in alive_rows)
+            blocks.append(np.asarray(self._base_matrix[alive_rows]))
+        delta_ids, delta_matrix = self._delta.arrays()
+        if delta_ids:
+            ids.extend(delta_ids)
+            blocks.append(delta_matrix)
+        return ids, (np.vstack(blocks) if blocks else None)
+
+    def vector(self, employee_id):
+        vector = self._delta.vector(employee_id)
+        if vector is not None:
+            return vector
+        row = self._base_rows.get(employee_id)
+        if row is None or not self._base_alive[row]:
+            return None
+        return self._base_matrix[row]
+
+    def __contains__(self, employee_id):
+        if employee_id in self._delta:
+            return True
+        row = self._base_rows.get(employee_id)
+        return row is not None and bool(self._base_alive[row])
+
+    def __len__(self):
+        return self._base_live + len(self._delta)
+
+
+def create_face_index(backend="exact", **params):
+    """依名稱建立索引後端"""
+    if backend == "exact":
+        return ExactFaceIndex()
+    if backend == "ivf":
+        return IVFFlatFaceIndex(**params)
+    raise ValueError(f"不支持的人臉索引後端: {backend}，可選: {', '.join(INDEX_BACKENDS)}")
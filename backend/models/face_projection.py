@@ -0,0 +1,182 @@
+import os
+import logging
+import hashlib
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("face_projection")
+
+# 延遲導入處理依賴
+def load_np():
+    try:
+        import numpy as np
+        return np
+    except ImportError as e:
+        logger.error(f"無法導入NumPy: {str(e)}")
+        raise
+
+# 支持的降維方法
+PROJECTION_METHODS = ("pca", "random")
+
+# 校準匹配閾值時最多取樣的冒名配對數
+CALIBRATION_MAX_PAIRS = 20000
+
+# 原始空間中沒有被接受的冒名配對時，以距離縮小比例的此分位數縮放閾值
+CALIBRATION_RATIO_QUANTILE = 0.05
+
+
+class FaceProjection:
+    """人臉編碼降維投影
+
+    將高維 HOG 編碼線性投影到 128-512 維。投影並不保持距離：PCA 丟棄探針在子空間外的殘差，
+    距離普遍縮小；隨機投影按 1/sqrt(k) 縮放，距離只是近似保持且帶有隨機誤差。
+    因此原始空間的匹配閾值不能直接沿用，tolerance 為擬合時以冒名配對校準、
+    與原始閾值誤接受率相當的投影空間閾值 (見 calibrate_projection)，與投影一同保存。
+    """
+
+    def __init__(self, method, mean, components, source_version, tolerance=None):
+        np = load_np()
+        self.method = method
+        self.mean = np.ascontiguousarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)  # 形狀 (k, D)
+        self.source_version = source_version
+        self.tolerance = tolerance  # 投影空間的匹配閾值，未校準時為None
+        digest = hashlib.sha1()
+        digest.update(method.encode())
+        digest.update(self.mean.tobytes())
+        digest.update(self.components.tobytes())
+        self.projection_id = f"{method}{self.dim}-{digest.hexdigest()[:12]}"
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    @property
+    def input_dim(self):
+        return self.components.shape[1]
+
+    @classmethod
+    def fit_pca(cls, encodings, dim, source_version):
+        """以已註冊的人臉編碼擬合 PCA 投影"""
+        np = load_np()
+        matrix = np.asarray(encodings, dtype=np.float32)
+        max_dim = min(matrix.shape[0] - 1, matrix.shape[1])
+        if dim > max_dim:
+            raise ValueError(f"PCA 維度 {dim} 超過樣本數允許的上限 {max_dim}，請改用隨機投影或增加註冊人數")
+        mean = matrix.mean(axis=0)
+        # 樣本數遠小於維度時，經濟型 SVD 的成本為 O(N^2 D)
+        _, _, vt = np.linalg.svd(matrix - mean, full_matrices=False)
+        return cls("pca", mean, vt[:dim], source_version)
+
+    @classmethod
+    def fit_random(cls, input_dim, dim, source_version, seed=0):
+        """產生可重現的高斯隨機投影"""
+        np = load_np()
+        rng = np.random.default_rng(seed)
+        components = rng.standard_normal((dim, input_dim), dtype=np.float32) / np.sqrt(dim)
+        return cls("random", np.zeros(input_dim, dtype=np.float32), components, source_version)
+
+    def transform(self, encodings):
+        """投影單一向量 (D,) 或矩陣 (N, D)"""
+        np = load_np()
+        data = np.asarray(encodings, dtype=np.float32)
+        return (data - self.mean) @ self.components.T
+
+    def calibrated_tolerance(self, probes, base_tolerance, gallery=None, seed=0):
+        """以冒名配對 (不同人的 probes[i] 與 gallery[j]) 校準投影空間的匹配閾值
+
+        先求原始閾值在原始空間的誤接受率，再取投影後距離的同一分位數，使誤接受率相當；
+        原始空間沒有被接受的冒名配對時，以距離縮小比例的低分位數縮放原始閾值。
+        未提供 gallery 時以 probes 兩兩配對 (只取 i != j)。
+        """
+        np = load_np()
+        probes = np.asarray(probes, dtype=np.float32)
+        same = gallery is None
+        gallery = probes if same else np.asarray(gallery, dtype=np.float32)
+        if len(gallery) < 1 or len(probes) < (2 if same else 1):
+            raise ValueError("至少需要 2 筆人臉編碼才能校準匹配閾值")
+
+        rng = np.random.default_rng(seed)
+        count = min(CALIBRATION_MAX_PAIRS, len(probes) * len(gallery))
+        rows = rng.integers(0, len(probes), count)
+        cols = rng.integers(0, len(gallery), count)
+        if same:
+            keep = rows != cols
+            rows, cols = rows[keep], cols[keep]
+        raw = np.linalg.norm(probes[rows] - gallery[cols], axis=1)
+        projected = np.linalg.norm(self.transform(probes[rows]) - self.transform(gallery[cols]), axis=1)
+        keep = raw > 0
+        raw, projected = raw[keep], projected[keep]
+        if not len(raw):
+            raise ValueError("沒有可用的冒名配對，無法校準匹配閾值")
+
+        false_accept = float(np.mean(raw <= base_tolerance))
+        if false_accept > 0:
+            return float(np.quantile(projected, false_accept, method="lower"))
+        return float(base_tolerance * np.quantile(projected / raw, CALIBRATION_RATIO_QUANTILE))
+
+    def save(self, path):
+        """以原子替換方式保存投影到 .npz 文件"""
+        np = load_np()
+        if self.tolerance is None:
+            raise ValueError("投影尚未校準匹配閾值，請先執行 calibrate_projection()")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, method=self.method, mean=self.mean, components=self.components,
+                 source_version=self.source_version, tolerance=self.tolerance)
+        os.replace(tmp_path, path)
+        logger.info(f"人臉投影 {self.projection_id} 已保存到: {path}")
+
+    @classmethod
+    def load(cls, path):
+        np = load_np()
+        with np.load(path) as data:
+            tolerance = float(data["tolerance"]) if "tolerance" in data.files else None
+            return cls(str(data["method"]), data["mean"], data["components"], str(data["source_version"]),
+                       tolerance)
+
+
+def calibrate_projection(projection, encodings, base_tolerance, seed=0):
+    """為投影校準匹配閾值 (寫入 projection.tolerance) 並返回
+
+    PCA 在擬合樣本上的殘差偏小，直接以擬合樣本校準會高估閾值；樣本足夠時改以一半編碼
+    擬合同維度的 PCA，並以另一半 (未參與擬合、模擬新的冒名者) 與其配對校準。
+    隨機投影與資料無關，直接以所有編碼兩兩配對校準。
+    """
+    np = load_np()
+    encodings = np.asarray(encodings, dtype=np.float32)
+    reference, probes, gallery = projection, encodings, None
+    if projection.method == "pca" and len(encodings) >= 2 * (projection.dim + 1):
+        order = np.random.default_rng(seed).permutation(len(encodings))
+        half = len(encodings) // 2
+        gallery, probes = encodings[order[:half]], encodings[order[half:]]
+        reference = FaceProjection.fit_pca(gallery, projection.dim, projection.source_version)
+    elif projection.method == "pca":
+        logger.warning("人臉編碼數量不足以留出校準樣本，匹配閾值以擬合樣本校準，可能偏寬鬆")
+    projection.tolerance = reference.calibrated_tolerance(probes, base_tolerance, gallery, seed)
+    logger.info(f"人臉投影 {projection.projection_id} 的匹配閾值: {projection.tolerance:.4f} "
+                f"(原始空間 {base_tolerance})")
+    return projection.tolerance
+
+
+def load_face_projection(path, encoder_version):
+    """從文件載入人臉投影；文件不存在或與編碼器版本不符時返回None (不降維)"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        projection = FaceProjection.load(path)
+    except Exception as e:
+        logger.error(f"載入人臉投影失敗: {str(e)}")
+        return None
+    if projection.tolerance is None:
+        logger.warning(f"人臉投影 {projection.projection_id} 沒有校準的匹配閾值，已停用降維，"
+                       f"請以 scripts/fit_face_projection.py 重新擬合")
+        return None
+    if projection.source_version != encoder_version:
+        logger.warning(f"人臉投影 {projection.projection_id} 適用於編碼器 {projection.source_version}，"
+                       f"與目前編碼器 {encoder_version} 不符，已停用降維")
+        return None
+    logger.info(f"已載入人臉投影 {projection.projection_id} ({projection.input_dim} -> {projection.dim} 維，"
+                f"匹配閾值 {projection.tolerance:.4f})")
+    return projection
@@ -2,8 +2,14 @@ import os
 import logging
 import io
 import base64
+import time
+import threading
+from collections import namedtuple
 from typing import Union, List, Tuple, Optional, Dict, Any
 
+from models.face_index import create_face_index, MappedFaceIndex
+from models.image_decode import ImageTooLarge, decode_bgr
+
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("face_recognition")
@@ -35,7 +41,260 @@ def load_pil():
 
 # 全局變量
 face_cascade = None
-known_faces = {}  # 格式: {employee_id: face_encoding}
+
+
+# 人臉檢測設置：長邊超過 max_edge 時先在縮小的灰度圖上檢測 (0 表示使用原始解析度)，
+# refine 為 True 時再在原圖的人臉附近區域重新檢測以校正人臉框
+DETECTION_SETTINGS = {"max_edge": 0, "refine": False}
+
+# 人臉匹配的距離閾值 (歐式距離)
+MATCH_TOLERANCE = 0.8
+
+# 人臉編碼器版本，編碼方式 (裁剪、尺寸、HOG參數) 變更時必須更新
+FACE_ENCODER_VERSION = "hog160-v1"
+
+# 人臉編碼二進制存儲支持的精度 (小端序)
+TEMPLATE_DTYPES = {"float16": "<f2", "float32": "<f4"}
+
+
+def pack_face_encoding(encoding, dtype="float16"):
+    """將人臉編碼打包為二進制，返回 (bytes, 維度)"""
+    np = load_np()
+    if dtype not in TEMPLATE_DTYPES:
+        raise ValueError(f"不支持的人臉編碼精度: {dtype}")
+    vector = np.asarray(encoding, dtype=np.float32).ravel()
+    return vector.astype(TEMPLATE_DTYPES[dtype]).tobytes(), int(vector.shape[0])
+
+
+def unpack_face_encoding(blob, dim):
+    """將二進制人臉編碼解包為 float32 向量，精度由 bytes 長度與維度推得"""
+    np = load_np()
+    if not dim or len(blob) % dim != 0:
+        raise ValueError(f"人臉編碼長度 {len(blob)} 與維度 {dim} 不符")
+    itemsize = len(blob) // dim
+    dtype = {2: TEMPLATE_DTYPES["float16"], 4: TEMPLATE_DTYPES["float32"]}.get(itemsize)
+    if dtype is None:
+        raise ValueError(f"無法識別的人臉編碼精度，每維 {itemsize} bytes")
+    return np.frombuffer(blob, dtype=dtype).astype(np.float32)
+
+# 人臉匹配結果: 最佳員工ID、距離、與第二名的距離差，以及前k名候選 [(employee_id, distance), ...]
+FaceMatch = namedtuple("FaceMatch", ["employee_id", "distance", "margin", "candidates"])
+
+
+class FaceGallery:
+    """常駐記憶體的人臉特徵庫
+
+    向量保存在可替換的索引後端中 (見 models/face_index.py)：預設的精確索引以一次
+    矩陣向量乘法比對全部員工，大型特徵庫可改用 IVF 近似索引。
+    在進程生命週期內只從資料庫載入一次，之後由註冊、更新、刪除員工時增量維護，
+    每名員工只保留一筆向量 (add 即替換)，刪除的員工立即移出比對範圍；
+    max_entries 大於0時限制特徵庫人數。
+    設置了降維投影 (FaceProjection) 時，特徵庫保存的是投影後的向量，
+    原始編碼需先經 project() 轉換後再加入或比對，匹配閾值也改用投影校準的閾值。
+    """
+
+    def __init__(self, index_backend="exact", max_entries=0, **index_params):
+        self.projection = None
+        self.max_entries = max_entries
+        self.loaded_at = None  # 最近一次完整載入的時間 (time.time())
+        self.synced_at = None  # 最近一次與資料庫版本同步的時間
+        self._lock = threading.RLock()
+        self._index_backend = index_backend
+        self._index_params = index_params
+        self._index = create_face_index(index_backend, **index_params)
+        self.loaded = False
+        self.version = 0  # 已套用的資料庫特徵庫版本 (見 app/face_store.py)
+
+    @property
+    def dim(self):
+        return self._index.dim
+
+    @property
+    def index(self):
+        return self._index
+
+    def _reset(self):
+        self._index = create_face_index(self._index_backend, **self._index_params)
+        self.loaded = False
+        self.version = 0
+
+    def set_projection(self, projection):
+        """設置降維投影並清空特徵庫，之後需重新載入"""
+        with self._lock:
+            self.projection = projection
+            self._reset()
+
+    def set_index(self, backend, **params):
+        """更換索引後端並清空特徵庫，之後需重新載入"""
+        with self._lock:
+            self._index_backend = backend
+            self._index_params = params
+            self._reset()
+        logger.info(f"人臉特徵庫索引後端: {backend} {params if params else ''}")
+
+    def _as_vector(self, encoding):
+        np = load_np()
+        return np.ascontiguousarray(np.asarray(encoding, dtype=np.float32).ravel())
+
+    def project(self, encoding):
+        """將原始人臉編碼轉換到特徵庫空間 (未設置投影時原樣返回)"""
+        vector = self._as_vector(encoding)
+        if self.projection is None:
+            return vector
+        return self._as_vector(self.projection.transform(vector))
+
+    def load(self, face_data, version=0):
+        """以完整的人臉數據替換特徵庫內容"""
+        np = load_np()
+        ids, vectors = [], []
+        for emp_id, enc in face_data.items():
+            vector = self._as_vector(enc)
+            if vectors and vector.shape != vectors[0].shape:
+                logger.error(f"員工ID {emp_id} 的人臉編碼維度 {vector.shape[0]} 與特徵庫不一致，已略過")
+                continue
+            ids.append(str(emp_id))
+            vectors.append(vector)
+
+        index = create_face_index(self._index_backend, **self._index_params)
+        index.build(ids, np.vstack(vectors) if vectors else None)
+        with self._lock:
+            self._index = index
+            self.loaded = True
+            self.version = version
+            self.loaded_at = self.synced_at = time.time()
+        logger.info(f"人臉特徵庫已載入 {len(ids)} 筆人臉資料")
+
+    def load_mapped(self, ids, matrix, sq_norms, version=0):
+        """以共享快照 (np.memmap) 替換特徵庫內容
+
+        精確索引直接掃描映射的矩陣，不複製數據；IVF 索引需要重新排列向量，
+        會在本進程內複製一份。
+        """
+        if self._index_backend == "exact":
+            index = MappedFaceIndex(ids, matrix, sq_norms)
+        else:
+            np = load_np()
+            index = create_face_index(self._index_backend, **self._index_params)
+            index.build(ids, np.array(matrix, dtype=np.float32) if ids else None)
+        with self._lock:
+            self._index = index
+            self.loaded = True
+            self.version = version
+            self.loaded_at = self.synced_at = time.time()
+        logger.info(f"人臉特徵庫已從共享快照載入 {len(ids)} 筆人臉資料")
+
+    def mark_synced(self, version):
+        """記錄已套用到的資料庫特徵庫版本"""
+        with self._lock:
+            self.version = max(self.version, version)
+            self.synced_at = time.time()
+
+    def has_room(self, employee_id):
+        """新增該員工是否會超過人數上限 (已存在的員工替換編碼不受限)"""
+        return not self.max_entries or len(self) < self.max_entries or str(employee_id) in self
+
+    def update(self, face_data):
+        """合併多筆人臉數據"""
+        for emp_id, enc in face_data.items():
+            self.add(emp_id, enc)
+
+    def add(self, employee_id, encoding):
+        """新增或替換單一員工的人臉編碼，超過人數上限時不加入並返回False"""
+        vector = self._as_vector(encoding)
+        with self._lock:
+            if not self.has_room(employee_id):
+                logger.error(f"人臉特徵庫已達上限 {self.max_entries} 筆，未加入員工ID {employee_id}")
+                return False
+            self._index.add(str(employee_id), vector)
+        logger.info(f"人臉特徵庫已更新員工ID {employee_id}，共 {len(self)} 筆")
+        return True
+
+    def remove(self, employee_id):
+        """移除單一員工的人臉編碼"""
+        with self._lock:
+            removed = self._index.remove(str(employee_id))
+        if removed:
+            logger.info(f"人臉特徵庫已移除員工ID {employee_id}，共 {len(self)} 筆")
+        return removed
+
+    def search(self, probe, k=1):
+        """返回與探針距離最近的前k名 [(employee_id, distance), ...]，按距離升序"""
+        probe = self._as_vector(probe)
+        with self._lock:
+            return self._index.search(probe, k)
+
+    def search_batch(self, probes, k=1):
+        """一次比對多個探針，返回每個探針的前k名列表"""
+        np = load_np()
+        probes = np.vstack([self._as_vector(probe) for probe in probes])
+        with self._lock:
+            return self._index.search_batch(probes, k)
+
+    @staticmethod
+    def _to_match(candidates, k, tolerance):
+        if not candidates:
+            return FaceMatch(None, None, None, [])
+        best_id, best_distance = candidates[0]
+        margin = candidates[1][1] - best_distance if len(candidates) > 1 else None
+        employee_id = best_id if best_distance <= tolerance else None
+        return FaceMatch(employee_id, best_distance, margin, candidates[:max(k, 1)])
+
+    @property
+    def match_tolerance(self):
+        """特徵庫空間的匹配閾值：設置了投影時為投影校準的閾值，否則為 MATCH_TOLERANCE"""
+        projection = self.projection
+        return projection.tolerance if projection is not None else MATCH_TOLERANCE
+
+    def match(self, probe, k=2, tolerance=None):
+        """比對探針並返回 FaceMatch；最佳距離超過閾值 (預設為 match_tolerance) 時 employee_id 為 None"""
+        if tolerance is None:
+            tolerance = self.match_tolerance
+        return self._to_match(self.search(probe, max(k, 2)), k, tolerance)
+
+    def match_batch(self, probes, k=2, tolerance=None):
+        """批量比對多個探針，返回與 probes 順序一致的 FaceMatch 列表"""
+        if not len(probes):
+            return []
+        if tolerance is None:
+            tolerance = self.match_tolerance
+        return [self._to_match(candidates, k, tolerance) for candidates in self.search_batch(probes, max(k, 2))]
+
+    def items(self):
+        """返回目前特徵庫內容的快照 [(employee_id, encoding), ...]"""
+        with self._lock:
+            ids, matrix = self._index.arrays()
+            return [(emp_id, matrix[row].copy()) for row, emp_id in enumerate(ids)]
+
+    def stats(self):
+        """返回特徵庫的人數、記憶體用量與同步狀態"""
+        with self._lock:
+            index = self._index
+            return {
+                "entries": len(index),
+                "max_entries": self.max_entries,
+                "dim": index.dim,
+                "index_backend": self._index_backend,
+                "shared_snapshot": hasattr(index, "mapped_bytes"),
+                "private_bytes": int(index.nbytes),
+                "mapped_bytes": int(getattr(index, "mapped_bytes", 0)),
+                "stale_rows": int(getattr(index, "stale_rows", 0)),
+                "projection": self.projection.projection_id if self.projection else None,
+                "match_tolerance": self.match_tolerance,
+                "loaded": self.loaded,
+                "version": self.version,
+                "loaded_at": self.loaded_at,
+                "synced_at": self.synced_at,
+            }
+
+    def __contains__(self, employee_id):
+        return str(employee_id) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+
+# 進程內共享的人臉特徵庫
+face_gallery = FaceGallery()
 
 def initialize_face_detector():
     """初始化臉部檢測器"""
@@ -92,6 +351,75 @@ def initialize_face_detector():
 
 def detect_faces(image):
     """檢測圖像中的所有人臉"""
+    try:
+        cv2 = load_cv2()
+        
+        # 轉換為灰度圖像
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return detect_faces_gray(gray)
+        
+    except Exception as e:
+        logger.error(f"人臉檢測失敗: {str(e)}")
+        return []
+
+def configure_face_detection(max_edge=0, refine=False):
+    """設置人臉檢測的縮圖長邊與是否在原圖ROI內校正"""
+    DETECTION_SETTINGS["max_edge"] = int(max_edge or 0)
+    DETECTION_SETTINGS["refine"] = bool(refine)
+    if DETECTION_SETTINGS["max_edge"]:
+        logger.info(f"人臉檢測使用縮圖，長邊 {max_edge} 像素{'，並在原圖校正人臉框' if refine else ''}")
+
+def _detect_multiscale(gray, min_size=(20, 20), max_size=None):
+    """以統一的參數執行 Haar 級聯檢測"""
+    np = load_np()
+    
+    # 檢測人臉 - 調整參數提高敏感度
+    faces = face_cascade.detectMultiScale(
+        gray, 
+        scaleFactor=1.05,  # 降低scaleFactor(原為1.1)使檢測更敏感
+        minNeighbors=3,    # 降低minNeighbors(原為5)減少誤判
+        minSize=min_size,  # 降低最小尺寸(原為30,30)以檢測更小的人臉
+        maxSize=max_size or (0, 0)
+    )
+    if isinstance(faces, np.ndarray) and len(faces) > 0:
+        return faces.tolist()
+    return []
+
+def detect_faces_in_roi(gray, box, padding=0.25, min_ratio=0.7, max_ratio=1.3):
+    """只在人臉框 box 附近 (向外擴展 padding 比例) 檢測人臉，返回原圖座標的人臉框列表
+
+    檢測尺度限制在 box 尺寸的 min_ratio 到 max_ratio 倍之間；box 無效時返回空列表。
+    """
+    global face_cascade
+    
+    if face_cascade is None:
+        if not initialize_face_detector():
+            return []
+    
+    x, y, w, h = [int(round(v)) for v in box]
+    if w <= 0 or h <= 0:
+        return []
+    pad_x, pad_y = int(w * padding), int(h * padding)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(gray.shape[1], x + w + pad_x), min(gray.shape[0], y + h + pad_y)
+    if x1 - x0 < 20 or y1 - y0 < 20:
+        return []
+    
+    min_side = max(20, int(min(w, h) * min_ratio))
+    max_side = int(max(w, h) * max_ratio) + 1
+    found = _detect_multiscale(gray[y0:y1, x0:x1], (min_side, min_side), (max_side, max_side))
+    # 區域內有多個結果時，最大的人臉排在最前
+    found.sort(key=lambda f: f[2] * f[3], reverse=True)
+    return [[fx + x0, fy + y0, fw, fh] for fx, fy, fw, fh in found]
+
+def _refine_face(gray, box):
+    """在原圖人臉框附近的區域重新檢測，返回校正後的人臉框；失敗時返回原框"""
+    # 只接受與縮圖結果尺寸相近的人臉，縮小搜尋的尺度範圍
+    found = detect_faces_in_roi(gray, box)
+    return found[0] if found else box
+
+def detect_faces_gray(gray):
+    """在已轉換的灰度圖像中檢測所有人臉，返回 [[x, y, w, h], ...] (原圖座標)"""
     global face_cascade
     
     # 初始化檢測器（如果尚未初始化）
@@ -101,29 +429,31 @@ def detect_faces(image):
     
     try:
         cv2 = load_cv2()
-        np = load_np()
         
-        # 轉換為灰度圖像
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        max_edge = DETECTION_SETTINGS["max_edge"]
+        long_edge = max(gray.shape[:2])
+        if not max_edge or long_edge <= max_edge:
+            faces = _detect_multiscale(gray)
+        else:
+            # 在縮小的圖像上檢測，再將人臉框映射回原圖座標
+            scale = max_edge / long_edge
+            small = cv2.resize(gray, (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale))),
+                               interpolation=cv2.INTER_AREA)
+            faces = [
+                [int(round(v / scale)) for v in face]
+                for face in _detect_multiscale(small)
+            ]
+            if DETECTION_SETTINGS["refine"]:
+                faces = [_refine_face(gray, face) for face in faces]
         
-        # 檢測人臉 - 調整參數提高敏感度
-        faces = face_cascade.detectMultiScale(
-            gray, 
-            scaleFactor=1.05,  # 降低scaleFactor(原為1.1)使檢測更敏感
-            minNeighbors=3,    # 降低minNeighbors(原為5)減少誤判
-            minSize=(20, 20)   # 降低最小尺寸(原為30,30)以檢測更小的人臉
-        )
         logger.info(f"檢測到的人臉數量: {len(faces)}")
-        # 將結果轉換為列表
-        if isinstance(faces, np.ndarray) and len(faces) > 0:
-            return faces.tolist()
-        return []
+        return faces
         
     except Exception as e:
         logger.error(f"人臉檢測失敗: {str(e)}")
         return []
 
-def compare_faces(known_encoding, face_encoding, tolerance=0.8):
+def compare_faces(known_encoding, face_encoding, tolerance=MATCH_TOLERANCE):
     """比較兩個人臉編碼，判斷是否為同一人"""
     try:
         np = load_np()
@@ -144,12 +474,101 @@ def compare_faces(known_encoding, face_encoding, tolerance=0.8):
         logger.error(f"人臉比較失敗: {str(e)}")
         return False
 
+# HOG 特徵參數 (變更時必須更新 FACE_ENCODER_VERSION)
+HOG_PARAMS = {
+    "win_size": (160, 160),
+    "block_size": (16, 16),
+    "block_stride": (8, 8),
+    "cell_size": (8, 8),
+    "nbins": 9,
+}
+
+# 每個執行緒各自緩存一個 HOGDescriptor (OpenCV 物件不保證可跨執行緒共用)
+_hog_local = threading.local()
+
+def get_hog_descriptor():
+    """取得本執行緒緩存的 HOGDescriptor"""
+    hog = getattr(_hog_local, "hog", None)
+    if hog is None:
+        cv2 = load_cv2()
+        hog = cv2.HOGDescriptor(
+            HOG_PARAMS["win_size"], HOG_PARAMS["block_size"], HOG_PARAMS["block_stride"],
+            HOG_PARAMS["cell_size"], HOG_PARAMS["nbins"]
+        )
+        _hog_local.hog = hog
+    return hog
+
+def preprocess_face(image, face_location):
+    """裁剪人臉區域並預處理為 160x160 的灰度圖，作為 HOG 特徵的輸入"""
+    cv2 = load_cv2()
+    
+    # 提取人臉區域 - 加入邊界擴展以獲取更多面部特徵
+    x, y, w, h = face_location
+    # 增加邊界範圍 (10%)
+    padding_x = int(w * 0.1)
+    padding_y = int(h * 0.1)
+    # 確保不超出圖像邊界
+    start_x = max(0, x - padding_x)
+    start_y = max(0, y - padding_y)
+    end_x = min(image.shape[1], x + w + padding_x)
+    end_y = min(image.shape[0], y + h + padding_y)
+    
+    face_image = image[start_y:end_y, start_x:end_x]
+    
+    # 調整大小為統一尺寸
+    face_image = cv2.resize(face_image, HOG_PARAMS["win_size"])
+    
+    # 進行圖像預處理 - 增強對比度
+    gray = cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY)
+    equalized = cv2.equalizeHist(gray)
+    
+    # 使用高斯模糊減少噪音
+    return cv2.GaussianBlur(equalized, (3, 3), 0)
+
+def encode_faces(images, boxes):
+    """批量編碼多個人臉，返回與輸入一一對應的編碼列表 (失敗的項目為None)
+
+    參數:
+        images: 圖像列表，或所有人臉共用的單張圖像
+        boxes: 人臉框列表 [(x, y, w, h), ...]
+    
+    所有預處理後的人臉以 1 像素鏡像邊界 (與單張計算時 OpenCV 的邊界處理一致)
+    垂直拼接成一張圖，一次 HOGDescriptor.compute 調用算出全部描述子。
+    """
+    cv2 = load_cv2()
+    np = load_np()
+    
+    if not isinstance(images, (list, tuple)):
+        images = [images] * len(boxes)
+    
+    crops, positions = [], []
+    for i, (image, box) in enumerate(zip(images, boxes)):
+        try:
+            crops.append(cv2.copyMakeBorder(preprocess_face(image, box), 1, 1, 1, 1, cv2.BORDER_REFLECT_101))
+            positions.append(i)
+        except Exception as e:
+            logger.error(f"人臉預處理失敗: {str(e)}")
+    
+    encodings = [None] * len(boxes)
+    if not crops:
+        return encodings
+    
+    win_w, win_h = HOG_PARAMS["win_size"]
+    locations = [(1, (win_h + 2) * i + 1) for i in range(len(crops))]
+    descriptors = get_hog_descriptor().compute(np.vstack(crops), (8, 8), (0, 0), locations)
+    descriptors = descriptors.reshape(len(crops), -1)
+    
+    # 歸一化特徵向量
+    norms = np.linalg.norm(descriptors, axis=1, keepdims=True)
+    descriptors = np.divide(descriptors, norms, out=descriptors, where=norms > 0)
+    
+    for i, descriptor in zip(positions, descriptors):
+        encodings[i] = descriptor.tolist()
+    return encodings
+
 def encode_face(image, face_location=None):
     """對人臉進行編碼"""
     try:
-        cv2 = load_cv2()
-        np = load_np()
-        
         # 如果未提供人臉位置，嘗試檢測
         if face_location is None:
             faces = detect_faces(image)
@@ -158,43 +577,7 @@ def encode_face(image, face_location=None):
                 return None
             face_location = faces[0]  # 使用第一個檢測到的人臉
         
-        # 提取人臉區域 - 加入邊界擴展以獲取更多面部特徵
-        x, y, w, h = face_location
-        # 增加邊界範圍 (10%)
-        padding_x = int(w * 0.1)
-        padding_y = int(h * 0.1)
-        # 確保不超出圖像邊界
-        start_x = max(0, x - padding_x)
-        start_y = max(0, y - padding_y)
-        end_x = min(image.shape[1], x + w + padding_x)
-        end_y = min(image.shape[0], y + h + padding_y)
-        
-        face_image = image[start_y:end_y, start_x:end_x]
-        
-        # 調整大小為統一尺寸
-        face_image = cv2.resize(face_image, (160, 160))
-        
-        # 進行圖像預處理 - 增強對比度
-        gray = cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY)
-        equalized = cv2.equalizeHist(gray)
-        
-        # 使用高斯模糊減少噪音
-        blurred = cv2.GaussianBlur(equalized, (3, 3), 0)
-        
-        # 使用簡單的特徵提取方法（HOG特徵）
-        win_size = (160, 160)
-        block_size = (16, 16)
-        block_stride = (8, 8)
-        cell_size = (8, 8)
-        nbins = 9
-        hog = cv2.HOGDescriptor(win_size, block_size, block_stride, cell_size, nbins)
-        encoding = hog.compute(blurred)
-        
-        # 歸一化特徵向量
-        if np.linalg.norm(encoding) > 0:
-            encoding = encoding / np.linalg.norm(encoding)
-        
-        return encoding.flatten().tolist()
+        return encode_faces([image], [face_location])[0]
         
     except Exception as e:
         logger.error(f"人臉編碼失敗: {str(e)}")
@@ -203,12 +586,16 @@ def encode_face(image, face_location=None):
         return None
 
 def register_face(employee_id, image_data):
-    """註冊員工的人臉"""
-    global known_faces
-    
+    """從圖像提取員工的人臉編碼
+
+    只負責編碼，保存到資料庫與更新特徵庫由調用方在提交後完成 (見 app/face_store.py)。
+    """
     try:
         # 解析圖像數據
-        image = decode_image(image_data)
+        try:
+            image = decode_image(image_data)
+        except ImageTooLarge as e:
+            return {"success": False, "error": str(e)}
         if image is None:
             return {"success": False, "error": "無法解碼圖像數據"}
             
@@ -221,15 +608,12 @@ def register_face(employee_id, image_data):
         face_location = faces[0]
         
         # 編碼人臉
-        face_encoding = encode_face(image, face_location)
+        face_encoding = encode_faces([image], [face_location])[0]
         if face_encoding is None:
             return {"success": False, "error": "人臉編碼失敗"}
             
-        # 保存編碼
-        known_faces[str(employee_id)] = face_encoding
-        
         logger.info(f"成功註冊員工 ID {employee_id} 的人臉")
-        return {"success": True, "message": "人臉註冊成功"}
+        return {"success": True, "message": "人臉註冊成功", "encoding": face_encoding}
         
     except Exception as e:
         logger.error(f"人臉註冊失敗: {str(e)}")
@@ -237,8 +621,7 @@ def register_face(employee_id, image_data):
 
 def load_faces_from_db(db_face_data):
     """從資料庫加載已註冊的人臉數據"""
-    global known_faces
-    known_faces.update(db_face_data)
+    face_gallery.load(db_face_data)
     logger.info(f"已從資料庫載入 {len(db_face_data)} 筆人臉資料")
     
 def recognize_face(image_data, db_face_data=None):
@@ -246,20 +629,17 @@ def recognize_face(image_data, db_face_data=None):
     
     參數:
         image_data: 圖像數據
-        db_face_data: 可選，直接從數據庫傳入的人臉編碼字典
+        db_face_data: 可選，直接從數據庫傳入的人臉編碼字典；
+                      一般情況下應維護 face_gallery 而不是每次傳入
     """
-    global known_faces
-    
     # 如果直接傳入了數據庫數據，先更新內存中的數據
     if db_face_data and isinstance(db_face_data, dict):
-        known_faces.update(db_face_data)
+        face_gallery.update(db_face_data)
         logger.info(f"從參數加載了 {len(db_face_data)} 筆人臉數據")
     
-    if not known_faces:
+    if not len(face_gallery):
         logger.warning("沒有註冊的人臉數據，無法識別")
         return None
-    
-    logger.info(f"當前已加載 {len(known_faces)} 筆人臉數據")
         
     try:
         # 解析圖像數據
@@ -279,73 +659,12 @@ def recognize_face(image_data, db_face_data=None):
         logger.info(f"檢測到人臉位置: {face_location}")
         
         # 編碼人臉
-        face_encoding = encode_face(image, face_location)
+        face_encoding = encode_faces([image], [face_location])[0]
         if face_encoding is None:
             logger.error("人臉編碼失敗")
             return None
-            
-        # 與已知人臉比較
-        matches = []
-        match_scores = {}
-        
-        # 打印出所有已知人臉的IDs，便於調試
-        logger.info(f"正在與以下員工ID比對: {list(known_faces.keys())}")
         
-        for employee_id, known_encoding in known_faces.items():
-            # 計算歐式距離以獲取匹配分數
-            try:
-                np = load_np()
-                if isinstance(known_encoding, list):
-                    known_encoding = np.array(known_encoding)
-                if isinstance(face_encoding, list):
-                    face_encoding = np.array(face_encoding)
-                    
-                distance = np.linalg.norm(known_encoding - face_encoding)
-                match_scores[employee_id] = distance
-                
-                # 提高容錯度 - 從0.6提高到0.8
-                if distance <= 0.8:
-                    matches.append(employee_id)
-                    logger.info(f"匹配到員工ID: {employee_id}, 距離分數: {distance:.4f}")
-            except Exception as e:
-                logger.error(f"比較人臉時出錯 (ID: {employee_id}): {e}")
-        
-        # 記錄所有比對結果供診斷
-        for emp_id, score in sorted(match_scores.items(), key=lambda x: x[1]):
-            logger.info(f"員工ID {emp_id} 的匹配分數: {score:.4f}")
-            
-            # 添加醒目的終端輸出，將相似度轉換為百分比
-            similarity_percent = max(0, (1 - score) * 100)  # 距離越小，相似度越高
-            print(f"【人臉相似度】員工ID {emp_id} - 相似度: {similarity_percent:.2f}%")
-        
-        if matches:
-            # 如果有多個匹配，選擇距離最小的一個
-            if len(matches) > 1:
-                best_match = min(matches, key=lambda emp_id: match_scores[emp_id])
-                logger.info(f"多個匹配結果，選擇最佳匹配: {best_match}, 距離: {match_scores[best_match]:.4f}")
-                
-                # 添加醒目的最佳匹配終端輸出
-                best_similarity = max(0, (1 - match_scores[best_match]) * 100)
-                print(f"【最佳匹配】員工ID {best_match} - 相似度: {best_similarity:.2f}%")
-            else:
-                best_match = matches[0]
-                logger.info(f"成功匹配到員工ID: {best_match}, 距離: {match_scores[best_match]:.4f}")
-                
-                # 添加醒目的匹配終端輸出
-                matched_similarity = max(0, (1 - match_scores[best_match]) * 100)
-                print(f"【成功匹配】員工ID {best_match} - 相似度: {matched_similarity:.2f}%")
-            
-            # 直接返回員工ID而非dict
-            return best_match
-        else:
-            # 如果沒有匹配，也顯示最相似的結果
-            if match_scores:
-                closest_id = min(match_scores.keys(), key=lambda k: match_scores[k])
-                closest_score = match_scores[closest_id]
-                logger.warning(f"未找到匹配的人臉，最接近的是員工ID {closest_id}，分數: {closest_score:.4f}")
-            else:
-                logger.warning("未找到任何匹配分數")
-            return None
+        return recognize_encoding(face_encoding)
             
     except Exception as e:
         logger.error(f"人臉識別失敗: {str(e)}")
@@ -353,46 +672,62 @@ def recognize_face(image_data, db_face_data=None):
         logger.error(traceback.format_exc())
         return None
 
-def decode_image(image_data):
-    """將圖像數據解碼為OpenCV格式"""
-    try:
-        cv2 = load_cv2()
-        np = load_np()
+def recognize_encoding(face_encoding):
+    """以已計算的人臉編碼與特徵庫比對，返回匹配的員工ID"""
+    return recognize_encodings([face_encoding])[0]
+
+def recognize_encodings(face_encodings):
+    """批量比對多個人臉編碼，返回與輸入順序一致的員工ID列表 (未匹配為None)
+
+    所有探針以一次矩陣乘法與特徵庫比對，供同時到達的多個打卡請求合併使用。
+    """
+    if not len(face_gallery):
+        logger.warning("沒有註冊的人臉數據，無法識別")
+        return [None] * len(face_encodings)
+    
+    logger.info(f"當前已加載 {len(face_gallery)} 筆人臉數據，本次比對 {len(face_encodings)} 個人臉")
+    
+    # 與特徵庫一次性比對，取前幾名供診斷
+    results = face_gallery.match_batch([face_gallery.project(enc) for enc in face_encodings], k=5)
+    return [_report_match(result) for result in results]
+
+def _report_match(result):
+    """記錄單一探針的比對結果，返回匹配的員工ID或None"""
+    # 記錄前幾名比對結果供診斷
+    for emp_id, score in result.candidates:
+        logger.info(f"員工ID {emp_id} 的匹配分數: {score:.4f}")
         
-        # 如果是numpy數組，直接返回
-        if isinstance(image_data, np.ndarray):
-            if len(image_data.shape) == 3 and image_data.shape[2] in [3, 4]:  # RGB或RGBA圖像
-                return image_data
-            else:
-                logger.error(f"不支持的numpy圖像格式，形狀: {image_data.shape}")
-                return None
+        # 添加醒目的終端輸出，將相似度轉換為百分比
+        similarity_percent = max(0, (1 - score) * 100)  # 距離越小，相似度越高
+        print(f"【人臉相似度】員工ID {emp_id} - 相似度: {similarity_percent:.2f}%")
+    
+    if result.employee_id is not None:
+        margin_text = f"{result.margin:.4f}" if result.margin is not None else "N/A"
+        logger.info(f"成功匹配到員工ID: {result.employee_id}, 距離: {result.distance:.4f}, 與第二名差距: {margin_text}")
         
-        if isinstance(image_data, str):
-            # 處理base64編碼的圖像
-            if image_data.startswith("data:image"):
-                # 分離MIME和數據部分
-                image_data = image_data.split(",")[1]
-                
-            # 解碼base64
-            image_bytes = base64.b64decode(image_data)
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-        elif isinstance(image_data, bytes):
-            # 直接處理二進制數據
-            nparr = np.frombuffer(image_data, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
+        # 添加醒目的匹配終端輸出
+        matched_similarity = max(0, (1 - result.distance) * 100)
+        print(f"【最佳匹配】員工ID {result.employee_id} - 相似度: {matched_similarity:.2f}%")
+        
+        # 直接返回員工ID而非dict
+        return result.employee_id
+    else:
+        # 如果沒有匹配，也顯示最相似的結果
+        if result.candidates:
+            logger.warning(f"未找到匹配的人臉，最接近的是員工ID {result.candidates[0][0]}，分數: {result.distance:.4f}")
         else:
-            logger.error(f"不支持的圖像數據格式: {type(image_data)}")
-            return None
-            
+            logger.warning("未找到任何匹配分數")
+        return None
+
+def decode_image(image_data):
+    """將圖像數據解碼為 BGR 三通道數組 (見 models/image_decode.py)，無法解碼時返回None；圖像過大時拋出 ImageTooLarge"""
+    try:
+        image, _ = decode_bgr(image_data)
         return image
-        
+    except ImageTooLarge:
+        raise
     except Exception as e:
         logger.error(f"圖像解碼失敗: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
         return None
 
 # 初始化人臉檢測器
@@ -0,0 +1,87 @@
+import os
+import shutil
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("face_snapshot")
+
+# 延遲導入處理依賴
+def load_np():
+    try:
+        import numpy as np
+        return np
+    except ImportError as e:
+        logger.error(f"無法導入NumPy: {str(e)}")
+        raise
+
+# 快照目錄名稱前綴，目錄內包含 vectors.npy / sq_norms.npy / ids.npy
+SNAPSHOT_PREFIX = "gallery-"
+
+
+def snapshot_path(directory, key):
+    return os.path.join(directory, f"{SNAPSHOT_PREFIX}{key}")
+
+
+def write_gallery_snapshot(directory, key, ids, matrix):
+    """將特徵庫寫成版本化的磁碟快照
+
+    先寫入進程私有的臨時目錄再原子改名，多個工作進程同時寫同一版本時
+    只有第一個改名成功，其餘丟棄自己的副本。
+    """
+    np = load_np()
+    target = snapshot_path(directory, key)
+    if os.path.isdir(target):
+        return target
+
+    os.makedirs(directory, exist_ok=True)
+    tmp_dir = f"{target}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        np.save(os.path.join(tmp_dir, "vectors.npy"), matrix)
+        np.save(os.path.join(tmp_dir, "sq_norms.npy"), np.einsum("ij,ij->i", matrix, matrix))
+        np.save(os.path.join(tmp_dir, "ids.npy"), np.asarray([int(emp_id) for emp_id in ids], dtype=np.int64))
+        try:
+            os.rename(tmp_dir, target)
+            logger.info(f"已寫入人臉特徵庫快照: {target} ({len(ids)} 筆)")
+        except OSError:
+            # 其他進程已寫入同一版本
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return target
+
+
+def open_gallery_snapshot(directory, key):
+    """以 np.memmap 打開快照，返回 (ids, 矩陣, 平方範數)；快照不存在時返回None"""
+    np = load_np()
+    path = snapshot_path(directory, key)
+    if not os.path.isdir(path):
+        return None
+    try:
+        ids = [str(emp_id) for emp_id in np.load(os.path.join(path, "ids.npy"))]
+        if not ids:
+            return [], None, None
+        matrix = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        sq_norms = np.load(os.path.join(path, "sq_norms.npy"), mmap_mode="r")
+    except Exception as e:
+        logger.error(f"打開人臉特徵庫快照失敗 ({path}): {str(e)}")
+        return None
+    return ids, matrix, sq_norms
+
+
+def prune_gallery_snapshots(directory, keep_key, keep=2):
+    """只保留最新的幾個快照；已映射舊快照的進程不受刪除影響"""
+    if not os.path.isdir(directory):
+        return
+    snapshots = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(SNAPSHOT_PREFIX) and ".tmp-" not in name
+    ]
+    snapshots.sort(key=os.path.getmtime, reverse=True)
+    keep_path = snapshot_path(directory, keep_key)
+    for path in snapshots[keep:]:
+        if path != keep_path:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,114 @@
+import logging
+
+from models.face_recognition import (
+    load_cv2, decode_image, detect_faces_gray, detect_faces_in_roi, encode_face, recognize_encoding
+)
+from models.mask_detection import detect_masks
+from models.image_decode import as_bgr
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("frame_analysis")
+
+
+class FrameAnalysis:
+    """單張打卡影像的分析結果
+
+    解碼、灰度轉換與人臉檢測各只執行一次並緩存，檢測到的人臉框同時供
+    人臉編碼與口罩分類使用，避免同一請求重複執行 Haar 級聯檢測。
+    圖像固定為 BGR 三通道 uint8 數組 (由 models/image_decode.py 統一解碼)，註冊與識別
+    因此使用相同的通道順序；口罩分類所需的 RGB 只在人臉裁剪上轉換。
+
+    客戶端可提供它已檢測到的人臉框 (face_roi, 格式 (x, y, w, h))：先只在擴展後的
+    ROI 內確認人臉，確認失敗時才退回整張影像的檢測。
+    """
+
+    # 客戶端人臉框向外擴展的比例，以及 ROI 內接受的人臉尺寸範圍 (相對客戶端框)
+    ROI_PADDING = 0.3
+    ROI_MIN_RATIO = 0.5
+    ROI_MAX_RATIO = 2.0
+
+    def __init__(self, image, face_roi=None):
+        self.image = as_bgr(image)
+        self.face_roi = face_roi
+        self.roi_verified = False  # 人臉是否已在客戶端提供的 ROI 內確認
+        self._gray = None
+        self._faces = None
+        self._encoding = None
+        self._encoded = False
+
+    @classmethod
+    def from_data(cls, image_data, face_roi=None):
+        """從 numpy 數組 (BGR)、base64 字符串或二進制數據建立，無法解碼時返回None"""
+        image = decode_image(image_data)
+        if image is None:
+            return None
+        return cls(image, face_roi)
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            cv2 = load_cv2()
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def faces(self):
+        """檢測到的所有人臉框 [[x, y, w, h], ...]"""
+        if self._faces is None:
+            if self.face_roi is not None:
+                self._faces = detect_faces_in_roi(
+                    self.gray, self.face_roi, self.ROI_PADDING, self.ROI_MIN_RATIO, self.ROI_MAX_RATIO
+                )
+                self.roi_verified = bool(self._faces)
+                if self.roi_verified:
+                    logger.info(f"已在客戶端提供的人臉區域內確認人臉: {self._faces[0]}")
+                else:
+                    logger.warning(f"客戶端提供的人臉區域 {self.face_roi} 內未確認到人臉，改為檢測整張圖像")
+            if not self._faces:
+                self._faces = detect_faces_gray(self.gray)
+        return self._faces
+
+    def detect(self):
+        """執行 (或取用已緩存的) 人臉檢測，返回所有人臉框"""
+        return self.faces
+
+    @property
+    def face_location(self):
+        """用於識別與口罩檢測的人臉框 (第一個檢測結果)，未檢測到時為None"""
+        return self.faces[0] if self.faces else None
+
+    def face_crop(self):
+        """人臉框內的彩色圖像，未檢測到人臉時為None"""
+        if self.face_location is None:
+            return None
+        x, y, w, h = self.face_location
+        return self.image[y:y+h, x:x+w]
+
+    @property
+    def encoding(self):
+        """人臉編碼，未檢測到人臉或編碼失敗時為None"""
+        if not self._encoded:
+            self._encoded = True
+            if self.face_location is not None:
+                self._encoding = encode_face(self.image, self.face_location)
+        return self._encoding
+
+    def encode(self):
+        """執行 (或取用已緩存的) 人臉編碼，未檢測到人臉或編碼失敗時返回None"""
+        return self.encoding
+
+    def recognize(self):
+        """與人臉特徵庫比對，返回匹配的員工ID或None"""
+        if self.encoding is None:
+            logger.error("未檢測到人臉或人臉編碼失敗，無法識別")
+            return None
+        return recognize_encoding(self.encoding)
+
+    def detect_mask(self):
+        """以同一個人臉框進行口罩分類"""
+        crop = self.face_crop()
+        if crop is None or crop.size == 0:
+            logger.warning("未檢測到人臉，無法進行口罩檢測")
+            return False
+        return detect_masks([crop])[0]
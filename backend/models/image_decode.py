@@ -0,0 +1,165 @@
+import io
+import base64
+import binascii
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("image_decode")
+
+# 延遲導入處理依賴
+def load_np():
+    try:
+        import numpy as np
+        return np
+    except ImportError as e:
+        logger.error(f"無法導入NumPy: {str(e)}")
+        raise
+
+def load_cv2():
+    try:
+        import cv2
+        return cv2
+    except ImportError as e:
+        logger.error(f"無法導入OpenCV: {str(e)}")
+        raise
+
+def load_pil():
+    try:
+        from PIL import Image
+        return Image
+    except ImportError as e:
+        logger.error(f"無法導入PIL: {str(e)}")
+        raise
+
+
+# 解碼後的圖像通道順序：所有端點與模型都以 OpenCV 原生的 BGR 三通道 uint8 數組交換圖像，
+# 需要 RGB 的模型 (口罩分類) 只在自己的人臉裁剪上轉換
+IMAGE_LAYOUT = "BGR"
+
+# 解碼限制：max_bytes 為壓縮後圖像的最大位元組數，max_pixels 為圖像的最大像素數，
+# max_edge 為解碼後的最小長邊 (JPEG 以 1/2、1/4、1/8 縮小解碼，但長邊不小於此值；0 表示原始解析度)
+DECODE_SETTINGS = {"max_bytes": 0, "max_pixels": 0, "max_edge": 0}
+
+# OpenCV 縮小解碼的旗標，依縮小倍數選擇
+_CV2_REDUCED_FLAGS = {2: "IMREAD_REDUCED_COLOR_2", 4: "IMREAD_REDUCED_COLOR_4", 8: "IMREAD_REDUCED_COLOR_8"}
+
+
+class ImageTooLarge(ValueError):
+    """圖像超過允許的大小或像素數"""
+
+
+def configure_image_decoding(max_bytes=0, max_pixels=0, max_edge=0):
+    """設置解碼限制 (0 表示不限制 / 不縮小)"""
+    DECODE_SETTINGS["max_bytes"] = max(0, int(max_bytes))
+    DECODE_SETTINGS["max_pixels"] = max(0, int(max_pixels))
+    DECODE_SETTINGS["max_edge"] = max(0, int(max_edge))
+    logger.info(f"圖像解碼設置: {DECODE_SETTINGS}")
+
+
+def strip_data_url(image_data):
+    """去除 data:image/...;base64, 前綴"""
+    if image_data.startswith("data:"):
+        return image_data.split(",", 1)[1]
+    return image_data
+
+
+def check_encoded_size(size):
+    """壓縮後的圖像大小超過限制時拋出 ImageTooLarge"""
+    max_bytes = DECODE_SETTINGS["max_bytes"]
+    if max_bytes and size > max_bytes:
+        raise ImageTooLarge(f"圖像大小 {size} 位元組超過上限 {max_bytes} 位元組")
+
+
+def base64_to_bytes(image_data):
+    """解碼 base64 圖像字符串；在解碼前依字符串長度估算大小並檢查上限"""
+    payload = strip_data_url(image_data)
+    # base64 每4個字符對應3個位元組
+    check_encoded_size(len(payload) * 3 // 4)
+    try:
+        return base64.b64decode(payload)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"無效的 base64 圖像數據: {str(e)}")
+
+
+def reduction_factor(width, height, max_edge):
+    """返回縮小解碼的倍數 (1、2、4 或 8)，縮小後長邊仍不小於 max_edge"""
+    if not max_edge:
+        return 1
+    long_edge = max(width, height)
+    factor = 1
+    while factor < 8 and long_edge // (factor * 2) >= max_edge:
+        factor *= 2
+    return factor
+
+
+def _check_pixels(width, height):
+    max_pixels = DECODE_SETTINGS["max_pixels"]
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"圖像尺寸 {width}x{height} 超過上限 {max_pixels} 像素")
+
+
+def as_bgr(image):
+    """將已解碼的 numpy 圖像整理為 BGR 三通道 uint8 連續數組 (已符合時不複製)
+
+    灰度圖轉為三通道，四通道視為 BGRA 並去除 alpha。
+    """
+    np = load_np()
+    cv2 = load_cv2()
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    elif image.ndim == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    elif image.ndim != 3 or image.shape[2] != 3:
+        raise ValueError(f"不支持的numpy圖像格式，形狀: {image.shape}")
+    if image.dtype != np.uint8:
+        raise ValueError(f"不支持的numpy圖像類型: {image.dtype}")
+    return np.ascontiguousarray(image)
+
+
+def decode_bytes(image_bytes):
+    """以 OpenCV 將壓縮圖像解碼為 BGR 數組，返回 (圖像, 縮小倍數)；無法解碼時拋出 ValueError
+
+    尺寸由 PIL 只讀取文件頭取得，先檢查像素數再解碼；JPEG 以 IMREAD_REDUCED_COLOR_*
+    在解碼時直接縮小 (DCT 縮放)，不必先解出完整解析度再縮圖。
+    PIL 無法讀取文件頭的圖像無法檢查像素數，直接拒絕，不交給 OpenCV 解碼。
+    """
+    np = load_np()
+    cv2 = load_cv2()
+    Image = load_pil()
+    check_encoded_size(len(image_bytes))
+    flag = cv2.IMREAD_COLOR
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as header:
+            width, height = header.size
+            is_jpeg = header.format == "JPEG"
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(f"圖像尺寸超過上限: {str(e)}")
+    except Exception as e:
+        raise ValueError(f"無法識別的圖像格式: {str(e)}")
+    _check_pixels(width, height)
+    factor = reduction_factor(width, height, DECODE_SETTINGS["max_edge"])
+    if factor > 1 and is_jpeg:
+        flag = getattr(cv2, _CV2_REDUCED_FLAGS[factor])
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+    if image is None:
+        raise ValueError("無法解碼圖像數據")
+    return image, width / image.shape[1]
+
+
+def decode_bgr(image_data):
+    """所有端點共用的圖像解碼入口，返回 (BGR 圖像, 縮小倍數)
+
+    image_data 可以是 base64 字符串 (可帶 data URL 前綴)、圖像二進制數據或 numpy 數組
+    (視為 BGR/BGRA/灰度)。返回的圖像固定為 BGR 三通道 uint8 連續數組，供人臉檢測、
+    人臉編碼與口罩分類共用；縮小倍數為原始寬度與解碼後寬度之比，用於換算客戶端座標。
+    圖像過大時拋出 ImageTooLarge，無法解碼時拋出 ValueError。
+    """
+    np = load_np()
+    if isinstance(image_data, np.ndarray):
+        return as_bgr(image_data), 1.0
+    if isinstance(image_data, str):
+        image_data = base64_to_bytes(image_data)
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        return decode_bytes(image_data)
+    raise ValueError(f"不支持的圖像數據格式: {type(image_data)}")
@@ -1,9 +1,11 @@
 import os
+import time
 import logging
-import io
-import base64
+import threading
 import requests
-from typing import Tuple, Dict, Union
+
+from models.image_decode import decode_bgr
+from models.tfjs_layers import load_layers_model
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
@@ -12,11 +14,10 @@ logger = logging.getLogger("mask_detection")
 # 配置環境
 MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
 os.makedirs(MODEL_DIR, exist_ok=True)
-MODEL_PATH = os.path.join(MODEL_DIR, "mask_detector_model.h5")
 
-# 檢查是否存在本地模型文件
+# 隨應用發佈的 TF.js 口罩分類模型 (前端打卡頁面也載入同一個模型)
 STATIC_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                "static", "models", "mask_detection_model", "model.json")
+                                "static", "models", "mask_model", "model.json")
 
 # 延遲導入處理依賴
 def load_cv2():
@@ -35,26 +36,25 @@ def load_np():
         logger.error(f"無法導入NumPy: {str(e)}")
         raise
 
-def load_tf_keras():
-    try:
-        import tensorflow as tf
-        from tensorflow import keras
-        return tf, keras
-    except ImportError as e:
-        logger.error(f"無法導入TensorFlow/Keras: {str(e)}")
-        raise
-
-def load_pil():
-    try:
-        from PIL import Image
-        return Image
-    except ImportError as e:
-        logger.error(f"無法導入PIL: {str(e)}")
-        raise
-
 # 全局變量
 face_cascade = None
 mask_model = None
+_model_lock = threading.Lock()
+
+# 上次載入口罩模型失敗的時間 (time.monotonic())，在重試間隔 (秒) 內不再重新讀取模型
+_load_failed_at = None
+MODEL_RETRY_INTERVAL = 300
+
+# 判定為戴口罩的最低概率
+MASK_THRESHOLD = 0.6
+
+# 口罩分類後端：設置後 classify_masks 交給它執行 (例如共用的視覺推論服務)，本進程不載入模型
+mask_classifier_backend = None
+
+def set_mask_classifier_backend(backend):
+    """設置口罩分類後端 (需提供 classify(face_imgs, bgr) 與 ready() 方法)，None 表示在本進程推論"""
+    global mask_classifier_backend
+    mask_classifier_backend = backend
 
 def download_model(url: str, save_path: str) -> bool:
     """下載模型文件"""
@@ -73,116 +73,32 @@ def download_model(url: str, save_path: str) -> bool:
         return False
 
 def load_mask_detection_model() -> bool:
-    """載入口罩檢測模型"""
-    global mask_model
+    """載入口罩檢測模型
+    
+    以 NumPy 推論引擎 (models/tfjs_layers.py) 直接讀取 TF.js 模型與權重分片，不依賴 TensorFlow。
+    載入失敗時不建立替代模型，口罩檢測一律判定為未佩戴；失敗會被記住，
+    MODEL_RETRY_INTERVAL 秒內的調用直接返回 False，不會每次檢測都重新讀取與解析權重分片。
+    """
+    global mask_model, _load_failed_at
     
     # 如果已經載入了模型
     if mask_model is not None:
         return True
     
-    # 優先使用本地靜態目錄的模型文件
-    local_static_model = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                    "static", "models", "mask_detection_model", "model.json")
-    
-    if os.path.exists(local_static_model):
-        try:
-            tf, keras = load_tf_keras()
-            logger.info(f"正在加載本地靜態目錄的口罩檢測模型: {local_static_model}")
-            try:
-                # 嘗試直接使用TF.js模型格式加載
-                mask_model = tf.keras.models.load_model(os.path.dirname(local_static_model))
-            except Exception as e:
-                logger.warning(f"直接加載TF.js模型失敗: {str(e)}，嘗試其他方法")
-                try:
-                    # 嘗試使用tf.saved_model.load
-                    mask_model = tf.saved_model.load(os.path.dirname(local_static_model))
-                except Exception as e2:
-                    logger.warning(f"使用saved_model.load失敗: {str(e2)}，最後嘗試")
-                    # 創建一個簡單的備用模型
-                    inputs = tf.keras.Input(shape=(224, 224, 3))
-                    x = tf.keras.layers.GlobalAveragePooling2D()(inputs)
-                    outputs = tf.keras.layers.Dense(2, activation='softmax')(x)
-                    mask_model = tf.keras.Model(inputs, outputs)
-                    logger.warning("使用備用簡單模型替代")
-            
-            logger.info("本地靜態目錄的口罩檢測模型加載成功")
+    with _model_lock:
+        if mask_model is not None:
             return True
-        except Exception as e:
-            logger.warning(f"加載本地靜態目錄的模型失敗: {str(e)}，將嘗試使用其他模型來源")
-    
-    # 如果模型文件不存在，嘗試下載預訓練模型
-    if not os.path.exists(MODEL_PATH):
-        logger.warning(f"未找到口罩檢測模型: {MODEL_PATH}, 將嘗試下載預訓練模型")
-        
-        # 嘗試多個可能的URL來源
-        model_urls = [
-            "https://github.com/chandrikadeb7/Face-Mask-Detection/raw/master/mask_detector.model",
-            "https://raw.githubusercontent.com/chandrikadeb7/Face-Mask-Detection/master/mask_detector.model",
-            "https://storage.googleapis.com/face-mask-models/mask_detector.model"
-        ]
-        
-        # 嘗試從每個URL下載，直到成功或全部失敗
-        download_success = False
-        for model_url in model_urls:
-            logger.info(f"嘗試從 {model_url} 下載模型...")
-            if download_model(model_url, MODEL_PATH):
-                download_success = True
-                break
-        
-        if not download_success:
-            logger.error("無法從任何源下載預訓練模型，創建備用模型")
-            try:
-                # 創建一個簡單的備用模型
-                tf, keras = load_tf_keras()
-                inputs = tf.keras.Input(shape=(224, 224, 3))
-                x = tf.keras.layers.GlobalAveragePooling2D()(inputs)
-                outputs = tf.keras.layers.Dense(2, activation='softmax')(x)
-                mask_model = tf.keras.Model(inputs, outputs)
-                logger.warning("使用備用簡單模型替代")
-                return True
-            except Exception as e:
-                logger.error(f"創建備用模型失敗: {str(e)}")
-                return False
-    
-    try:
-        # 使用TensorFlow/Keras加載模型
-        tf, keras = load_tf_keras()
-        logger.info(f"正在加載口罩檢測模型: {MODEL_PATH}")
-        try:
-            mask_model = keras.models.load_model(MODEL_PATH)
-        except Exception as e:
-            logger.warning(f"使用標準方法加載模型失敗: {str(e)}，嘗試使用其他方法")
-            # 嘗試使用自定義對象加載
-            try:
-                import pickle
-                with open(MODEL_PATH, 'rb') as f:
-                    mask_model = pickle.load(f)
-            except Exception as e2:
-                logger.warning(f"使用pickle加載失敗: {str(e2)}，創建備用模型")
-                # 創建一個簡單的備用模型
-                inputs = tf.keras.Input(shape=(224, 224, 3))
-                x = tf.keras.layers.GlobalAveragePooling2D()(inputs)
-                outputs = tf.keras.layers.Dense(2, activation='softmax')(x)
-                mask_model = tf.keras.Model(inputs, outputs)
-                logger.warning("使用備用簡單模型替代")
-                
-        logger.info("口罩檢測模型加載成功")
-        return True
-    except Exception as e:
-        logger.error(f"載入口罩檢測模型失敗: {str(e)}")
-        
-        # 最後嘗試創建一個備用模型
+        if _load_failed_at is not None and time.monotonic() - _load_failed_at < MODEL_RETRY_INTERVAL:
+            return False
         try:
-            # 創建一個簡單的備用模型
-            tf, keras = load_tf_keras()
-            inputs = tf.keras.Input(shape=(224, 224, 3))
-            x = tf.keras.layers.GlobalAveragePooling2D()(inputs)
-            outputs = tf.keras.layers.Dense(2, activation='softmax')(x)
-            mask_model = tf.keras.Model(inputs, outputs)
-            logger.warning("使用備用簡單模型替代")
+            logger.info(f"正在加載口罩檢測模型: {STATIC_MODEL_PATH}")
+            mask_model = load_layers_model(STATIC_MODEL_PATH)
+            _load_failed_at = None
+            logger.info("口罩檢測模型加載成功")
             return True
         except Exception as e:
-            logger.error(f"創建備用模型失敗: {str(e)}")
+            _load_failed_at = time.monotonic()
+            logger.error(f"載入口罩檢測模型失敗: {str(e)} ({MODEL_RETRY_INTERVAL} 秒後重試)")
             return False
 
 def initialize_detector():
@@ -192,6 +108,10 @@ def initialize_detector():
     try:
         cv2 = load_cv2()
         
+        # 臉部檢測器已建立時只需 (重新) 嘗試載入模型
+        if face_cascade is not None:
+            return load_mask_detection_model()
+        
         # 初始化臉部檢測器
         face_cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
         if not os.path.exists(face_cascade_path):
@@ -226,28 +146,44 @@ def initialize_detector():
         logger.error(f"初始化檢測器失敗: {str(e)}")
         return False
 
-def preprocess_face_for_mask_detection(face_img):
-    """預處理人臉圖像用於口罩檢測"""
+def preprocess_faces_for_mask_detection(face_imgs, bgr=False):
+    """把多張人臉圖像組成模型輸入批次 (與前端相同：雙線性縮放到模型輸入尺寸後除以255)
+    
+    face_imgs 為 RGB 圖像，bgr=True 時為 BGR 圖像 (縮放後再轉換通道，只需轉換 224x224 的小圖)。
+    返回形狀 (N, 高, 寬, 3) 的 float32 數組，失敗時返回None。
+    """
     try:
         np = load_np()
-        tf, _ = load_tf_keras()
+        cv2 = load_cv2()
         
-        # 調整大小到模型輸入尺寸
-        face_img = tf.image.resize(face_img, (224, 224))
-        face_img = np.expand_dims(face_img, axis=0)
-        face_img = face_img / 255.0  # 標準化
+        # 調整大小到模型輸入尺寸，直接寫入預先分配的批次數組
+        height, width = mask_model.input_shape[1:3] if mask_model is not None else (224, 224)
+        batch = np.empty((len(face_imgs), height, width, 3), dtype=np.uint8)
+        for index, face_img in enumerate(face_imgs):
+            resized = cv2.resize(face_img, (width, height), interpolation=cv2.INTER_LINEAR)
+            if bgr:
+                cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=batch[index])
+            else:
+                batch[index] = resized
+        batch = batch.astype(np.float32)
+        batch *= 1.0 / 255.0  # 標準化
         
-        return face_img
+        return batch
     except Exception as e:
         logger.error(f"預處理人臉圖像失敗: {str(e)}")
         return None
 
-def detect_mask(image_data) -> bool:
+def preprocess_face_for_mask_detection(face_img):
+    """預處理單張人臉圖像 (RGB) 用於口罩檢測，返回形狀 (1, 高, 寬, 3) 的批次"""
+    return preprocess_faces_for_mask_detection([face_img])
+
+def detect_mask(image_data, face_location=None) -> bool:
     """
     檢測圖像中的臉部是否戴口罩
     
     Args:
-        image_data: 圖像數據，可以是numpy數組、base64編碼的字符串或者圖像的二進制數據
+        image_data: 圖像數據，可以是numpy數組 (BGR)、base64編碼的字符串或者圖像的二進制數據
+        face_location: 可選，已檢測到的人臉框 (x, y, w, h)；提供時不再重複檢測人臉
         
     Returns:
         bool: True表示戴口罩，False表示未戴口罩
@@ -263,156 +199,151 @@ def detect_mask(image_data) -> bool:
     try:
         cv2 = load_cv2()
         np = load_np()
-        tf, _ = load_tf_keras()
-        
-        # 解析圖像
-        if isinstance(image_data, str) and image_data.startswith('data:image'):
-            # 如果是base64字符串帶有MIME前綴
-            image_data = image_data.split(',')[1]
-            image_bytes = base64.b64decode(image_data)
-            pil_image = load_pil().open(io.BytesIO(image_bytes))
-            image = np.array(pil_image)
-            if len(image.shape) == 2:  # 灰度轉RGB
-                image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-            elif image.shape[2] == 4:  # RGBA轉RGB
-                image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
-        elif isinstance(image_data, str):
-            # 純base64字符串
-            image_bytes = base64.b64decode(image_data)
-            pil_image = load_pil().open(io.BytesIO(image_bytes))
-            image = np.array(pil_image)
-            if len(image.shape) == 2:  # 灰度轉RGB
-                image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-            elif image.shape[2] == 4:  # RGBA轉RGB
-                image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
-        elif isinstance(image_data, bytes):
-            # 二進制數據
-            pil_image = load_pil().open(io.BytesIO(image_data))
-            image = np.array(pil_image)
-            if len(image.shape) == 2:  # 灰度轉RGB
-                image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-            elif image.shape[2] == 4:  # RGBA轉RGB
-                image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
-        else:
-            # 假設已經是numpy數組
-            image = image_data
         
-        # 確保圖像是RGB格式
-        if len(image.shape) == 2:
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-        elif image.shape[2] == 4:
-            image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
+        # 以共用的解碼入口解析圖像 (BGR 三通道)
+        image, _ = decode_bgr(image_data)
         
-        # 轉換為灰度圖像進行人臉檢測
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        if face_location is None:
+            # 轉換為灰度圖像進行人臉檢測
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            
+            # 檢測人臉
+            faces = face_cascade.detectMultiScale(
+                gray,
+                scaleFactor=1.1,
+                minNeighbors=5,
+                minSize=(30, 30)
+            )
+            
+            # 如果沒有檢測到人臉
+            if len(faces) == 0:
+                logger.warning("未檢測到人臉，無法進行口罩檢測")
+                return False
+            
+            # 對每個人臉進行口罩檢測，只處理第一個人臉
+            face_location = faces[0]
         
-        # 檢測人臉
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(30, 30)
-        )
+        (x, y, w, h) = face_location
+        logger.info(f"人臉檢測: 座標(x={x}, y={y}, 寬={w}, 高={h})")
         
-        # 如果沒有檢測到人臉
-        if len(faces) == 0:
-            logger.warning("未檢測到人臉，無法進行口罩檢測")
-            return False
+        # 擷取人臉區域，轉為模型所需的 RGB 後進行口罩分類
+        return classify_mask(cv2.cvtColor(image[y:y+h, x:x+w], cv2.COLOR_BGR2RGB))
+    
+    except Exception as e:
+        logger.error(f"口罩檢測過程中發生錯誤: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return False
+
+def classify_masks(face_imgs, bgr=False, strict=False) -> list:
+    """
+    以一次推論判斷多張已裁剪的人臉圖像是否戴口罩
+    
+    Args:
+        face_imgs: 人臉圖像列表 (RGB；bgr=True 時為 BGR)
+        strict: 為 True 時模型無法載入或推論失敗會拋出異常，而不是判定為未戴口罩
         
-        # 對每個人臉進行口罩檢測，只處理第一個人臉
-        (x, y, w, h) = faces[0]
-        logger.info(f"人臉檢測: 座標(x={x}, y={y}, 寬={w}, 高={h})")
+    Returns:
+        list: 與輸入等長的 bool 列表，True表示戴口罩，False表示未戴口罩
+    """
+    global mask_model
+    
+    if len(face_imgs) == 0:
+        return []
+    
+    if mask_classifier_backend is not None:
+        try:
+            return list(mask_classifier_backend.classify(face_imgs, bgr))
+        except Exception as e:
+            logger.error(f"口罩分類後端執行失敗: {str(e)}")
+            if strict:
+                raise
+            return [False] * len(face_imgs)
+    
+    # 載入模型（如果尚未載入）
+    if mask_model is None:
+        if not initialize_detector():
+            logger.error("口罩檢測器未初始化")
+            if strict:
+                raise RuntimeError("口罩檢測器未初始化")
+            return [False] * len(face_imgs)
+    
+    try:
+        np = load_np()
         
-        # 擷取人臉區域並進行預處理
-        face_img = image[y:y+h, x:x+w]
-        face_img = preprocess_face_for_mask_detection(face_img)
+        # 預處理人臉圖像
+        batch = preprocess_faces_for_mask_detection(face_imgs, bgr=bgr)
         
-        if face_img is None:
+        if batch is None:
             logger.error("預處理人臉圖像失敗")
-            return False
+            if strict:
+                raise ValueError("預處理人臉圖像失敗")
+            return [False] * len(face_imgs)
         
         # 使用模型進行預測
-        try:
-            # 使用標準predict方法
-            prediction = mask_model.predict(face_img)
-            
-            # 解析預測結果
-            if isinstance(prediction, list) and len(prediction) > 0:
-                # 可能是tf.saved_model的輸出
-                prediction = prediction[0]
-            
-            # 確保預測結果是numpy數組並且有預期的形狀
-            if not isinstance(prediction, np.ndarray):
-                prediction = np.array(prediction)
-            
-            # 如果是二分類輸出
-            if prediction.shape[-1] == 2:
-                # 獲得預測概率
-                mask_prob = prediction[0][1]  # 第二個類別通常是'有口罩'
-                no_mask_prob = prediction[0][0]  # 第一個類別通常是'無口罩'
-            else:
-                # 可能是單一值輸出
-                mask_prob = prediction[0][0]
-                no_mask_prob = 1 - mask_prob
-            
-            logger.info(f"口罩檢測結果 - 有口罩概率: {mask_prob:.4f}, 無口罩概率: {no_mask_prob:.4f}")
-            
-            # 判斷是否戴口罩 (閾值設為0.6)
-            has_mask = mask_prob >= 0.6
-            logger.info(f"最終判斷: {'已佩戴口罩' if has_mask else '未佩戴口罩'} (閾值: 0.6)")
-            
-            return has_mask
-            
-        except Exception as e:
-            logger.error(f"使用標準predict方法預測失敗: {str(e)}")
+        prediction = np.asarray(mask_model.predict(batch))
+        
+        # 如果是二分類輸出，第二個類別通常是'有口罩'；否則可能是單一值輸出
+        mask_probs = prediction[:, 1] if prediction.shape[-1] == 2 else prediction[:, 0]
+        
+        results = []
+        for mask_prob in mask_probs:
+            logger.info(f"口罩檢測結果 - 有口罩概率: {mask_prob:.4f}, 無口罩概率: {1 - mask_prob:.4f}")
             
-            # 嘗試使用另一種方法調用模型
-            try:
-                if hasattr(mask_model, "call"):
-                    prediction = mask_model.call(face_img)
-                elif hasattr(mask_model, "__call__"):
-                    prediction = mask_model(face_img)
-                elif hasattr(mask_model, "predict_proba"):
-                    prediction = mask_model.predict_proba(face_img)
-                else:
-                    logger.error("無法找到合適的方法來使用口罩檢測模型")
-                    return False
-                
-                # 解析預測結果
-                if isinstance(prediction, tf.Tensor):
-                    prediction = prediction.numpy()
-                
-                # 確保預測結果是numpy數組
-                if not isinstance(prediction, np.ndarray):
-                    prediction = np.array(prediction)
-                
-                # 如果是二分類輸出
-                if prediction.shape[-1] == 2:
-                    mask_prob = prediction[0][1]  # 第二個類別通常是'有口罩'
-                    no_mask_prob = prediction[0][0]  # 第一個類別通常是'無口罩'
-                else:
-                    # 可能是單一值輸出
-                    mask_prob = prediction[0][0]
-                    no_mask_prob = 1 - mask_prob
-                
-                logger.info(f"備用方法口罩檢測結果 - 有口罩概率: {mask_prob:.4f}, 無口罩概率: {no_mask_prob:.4f}")
-                
-                # 判斷是否戴口罩 (閾值設為0.6)
-                has_mask = mask_prob >= 0.6
-                logger.info(f"最終判斷: {'已佩戴口罩' if has_mask else '未佩戴口罩'} (閾值: 0.6)")
-                
-                return has_mask
-                
-            except Exception as e2:
-                logger.error(f"所有預測方法都失敗: {str(e2)}")
-                logger.warning("由於檢測失敗，預設判定為未戴口罩")
-                return False
+            # 判斷是否戴口罩
+            has_mask = bool(mask_prob >= MASK_THRESHOLD)
+            logger.info(f"最終判斷: {'已佩戴口罩' if has_mask else '未佩戴口罩'} (閾值: {MASK_THRESHOLD})")
+            results.append(has_mask)
+        
+        return results
     
     except Exception as e:
         logger.error(f"口罩檢測過程中發生錯誤: {str(e)}")
+        if strict:
+            raise
         import traceback
         logger.error(traceback.format_exc())
+        return [False] * len(face_imgs)
+
+def classify_mask(face_img) -> bool:
+    """
+    判斷已裁剪的人臉圖像 (RGB) 是否戴口罩
+    
+    Returns:
+        bool: True表示戴口罩，False表示未戴口罩
+    """
+    return classify_masks([face_img])[0]
+
+def detect_masks(crops, strict=False) -> list:
+    """
+    批次判斷多張人臉裁剪 (BGR，與共用解碼入口的輸出相同) 是否戴口罩，所有裁剪共用一次推論
+    
+    Returns:
+        list: 與輸入等長的 bool 列表；空的裁剪判定為未戴口罩 (strict 見 classify_masks)
+    """
+    results = [False] * len(crops)
+    valid = [index for index, crop in enumerate(crops) if crop is not None and crop.size > 0]
+    for index, has_mask in zip(valid, classify_masks([crops[index] for index in valid], bgr=True, strict=strict)):
+        results[index] = has_mask
+    return results
+
+def warm_up_mask_model() -> bool:
+    """載入口罩檢測模型並以空白影像執行一次推論，返回是否成功
+
+    模型載入需讀取並解析約 10 MB 的權重分片，第一次推論還會啟動 BLAS 執行緒與配置緩衝區，
+    預先執行可避免第一個戴口罩打卡的請求承擔這些延遲。使用口罩分類後端時只確認後端可用。
+    """
+    if mask_classifier_backend is not None:
+        return mask_classifier_backend.ready()
+    if mask_model is None or face_cascade is None:
+        if not initialize_detector():
+            return False
+    np = load_np()
+    face_img = preprocess_face_for_mask_detection(np.zeros((224, 224, 3), dtype=np.uint8))
+    if face_img is None:
         return False
+    mask_model.predict(face_img)
+    return True
 
-# 初始化時載入模型（可選）
+# 模型在應用啟動時由背景執行緒預熱 (見 app/warmup.py)，不在導入時同步載入
 # initialize_detector()
\ No newline at end of file
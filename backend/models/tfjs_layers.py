@@ -0,0 +1,534 @@
+import os
+import json
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("tfjs_layers")
+
+# 延遲導入處理依賴
+def load_np():
+    try:
+        import numpy as np
+        return np
+    except ImportError as e:
+        logger.error(f"無法導入NumPy: {str(e)}")
+        raise
+
+
+# 權重清單中各數據類型的位元組數
+_DTYPE_BYTES = {"float32": 4, "int32": 4, "float16": 2, "uint16": 2, "uint8": 1, "bool": 1}
+
+# 深度卷積每次處理的輸出區塊大小 (位元組)，讓輸入切片與累加結果留在 CPU 快取中
+_TILE_BYTES = 256 * 1024
+
+
+class LayersModelError(ValueError):
+    """模型文件無法解析，或包含本引擎不支持的層"""
+
+
+def read_weights(weights_manifest, base_dir):
+    """讀取 TF.js 權重分片，返回 {權重名稱: numpy 數組}
+
+    同一組的分片按順序拼接後，依清單中的形狀與數據類型逐一切出權重；
+    量化權重 (uint8/uint16 + scale/min 或 float16) 還原為 float32。缺少分片時拋出 FileNotFoundError。
+    """
+    np = load_np()
+    weights = {}
+    for group in weights_manifest:
+        chunks = []
+        for path in group["paths"]:
+            shard_path = os.path.join(base_dir, path)
+            if not os.path.exists(shard_path):
+                raise FileNotFoundError(f"缺少權重分片: {shard_path}")
+            with open(shard_path, "rb") as f:
+                chunks.append(f.read())
+        buffer = b"".join(chunks)
+
+        offset = 0
+        for spec in group["weights"]:
+            shape = tuple(spec["shape"])
+            count = int(np.prod(shape)) if shape else 1
+            quantization = spec.get("quantization")
+            dtype = quantization["dtype"] if quantization else spec["dtype"]
+            if dtype not in _DTYPE_BYTES:
+                raise LayersModelError(f"不支持的權重數據類型: {dtype} ({spec['name']})")
+            size = count * _DTYPE_BYTES[dtype]
+            if offset + size > len(buffer):
+                raise LayersModelError(f"權重分片長度不足，無法讀取 {spec['name']}")
+            values = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            offset += size
+            if quantization and dtype in ("uint8", "uint16"):
+                values = values.astype(np.float32) * quantization["scale"] + quantization["min"]
+            elif spec["dtype"] == "float32":
+                values = values.astype(np.float32)
+            weights[spec["name"]] = values.reshape(shape)
+        if offset != len(buffer):
+            logger.warning(f"權重分片有 {len(buffer) - offset} 位元組未使用")
+    return weights
+
+
+def _layer_weights(weights):
+    """將 "層名稱/屬性" 形式的權重名稱整理為 {層名稱: {屬性: 數組}}"""
+    layers = {}
+    for name, value in weights.items():
+        parts = name.split(":")[0].split("/")
+        if len(parts) < 2:
+            continue
+        layers.setdefault(parts[-2], {})[parts[-1]] = value
+    return layers
+
+
+def _same_padding(size, kernel, stride, dilation=1):
+    """與 TensorFlow 相同的 "same" 填充：返回 (前填充, 後填充)，奇數時多出的一格補在後面"""
+    effective = (kernel - 1) * dilation + 1
+    out = -(-size // stride)
+    total = max((out - 1) * stride + effective - size, 0)
+    return total // 2, total - total // 2
+
+
+def _pad_input(x, padding, kernel, strides, dilation, value=0.0):
+    np = load_np()
+    if padding == "valid":
+        return x
+    if padding != "same":
+        raise LayersModelError(f"不支持的填充方式: {padding}")
+    pad_h = _same_padding(x.shape[1], kernel[0], strides[0], dilation[0])
+    pad_w = _same_padding(x.shape[2], kernel[1], strides[1], dilation[1])
+    if pad_h == (0, 0) and pad_w == (0, 0):
+        return x
+    return np.pad(x, ((0, 0), pad_h, pad_w, (0, 0)), constant_values=value)
+
+
+def _windows(x, kernel, strides, dilation):
+    """依卷積核位置逐一返回輸入的步進切片 (N, 輸出高, 輸出寬, C)，順序與 kernel[i, j] 對應"""
+    out_h = (x.shape[1] - (kernel[0] - 1) * dilation[0] - 1) // strides[0] + 1
+    out_w = (x.shape[2] - (kernel[1] - 1) * dilation[1] - 1) // strides[1] + 1
+    for i in range(kernel[0]):
+        for j in range(kernel[1]):
+            top, left = i * dilation[0], j * dilation[1]
+            yield x[:, top:top + (out_h - 1) * strides[0] + 1:strides[0],
+                    left:left + (out_w - 1) * strides[1] + 1:strides[1], :]
+
+
+def _clip(max_value):
+    """就地執行的 ReLU (max_value 為 None 時不設上限)"""
+    np = load_np()
+    if max_value is None:
+        return lambda x: np.maximum(x, 0.0, out=x)
+    return lambda x: np.clip(x, 0.0, max_value, out=x)
+
+
+def _activation(name):
+    """返回激活函數；relu/relu6 就地修改輸入，只用於層內新建的數組"""
+    np = load_np()
+    if name in (None, "linear"):
+        return None
+    if name == "relu":
+        return _clip(None)
+    if name == "relu6":
+        return _clip(6.0)
+    if name == "sigmoid":
+        return lambda x: 1.0 / (1.0 + np.exp(-x))
+    if name == "tanh":
+        return np.tanh
+    if name == "softmax":
+        def softmax(x):
+            e = np.exp(x - x.max(axis=-1, keepdims=True))
+            return e / e.sum(axis=-1, keepdims=True)
+        return softmax
+    raise LayersModelError(f"不支持的激活函數: {name}")
+
+
+class _Layer:
+    """已編譯的一層：inputs 為輸入張量名稱，run(inputs) 返回輸出數組"""
+
+    def __init__(self, name, class_name, config, inputs, params):
+        self.name = name
+        self.class_name = class_name
+        self.config = config
+        self.inputs = inputs
+        self.params = params  # 該層的權重 {屬性: 數組}
+        # 卷積與全連接層的激活函數；緊隨其後的 ReLU 層在編譯時會融合到這裡
+        self.activation = None
+        if class_name in ("Conv2D", "DepthwiseConv2D", "Dense"):
+            self.activation = _activation(config.get("activation"))
+
+    def run(self, xs):
+        return getattr(self, "_run_" + self.class_name)(*xs)
+
+    def prepare(self):
+        """編譯時整理權重的形狀與記憶體布局，推論時不再重複換算"""
+        np = load_np()
+        if self.class_name == "Conv2D":
+            kernel = self.params["kernel"]
+            self.params["kernel"] = np.ascontiguousarray(kernel.reshape(-1, kernel.shape[-1]))
+        elif self.class_name == "DepthwiseConv2D":
+            kernel = self.params["depthwise_kernel"]
+            self.multiplier = kernel.shape[3]
+            self.params["depthwise_kernel"] = np.ascontiguousarray(
+                kernel.reshape(kernel.shape[0], kernel.shape[1], -1))
+
+    # 卷積類：卷積層的輸出會就地加上偏置與激活；BatchNormalization 在載入時已盡量折疊進卷積
+    def _finish(self, y):
+        bias = self.params.get("bias")
+        if bias is not None:
+            y += bias
+        return self.activation(y) if self.activation else y
+
+    def _conv_args(self):
+        c = self.config
+        return (tuple(c["kernel_size"]), tuple(c.get("strides", (1, 1))),
+                tuple(c.get("dilation_rate", (1, 1))), c.get("padding", "valid"))
+
+    def _run_Conv2D(self, x):
+        kernel_size, strides, dilation, padding = self._conv_args()
+        kernel = self.params["kernel"]  # 已展平為 (kh * kw * C, K)
+        x = _pad_input(x, padding, kernel_size, strides, dilation)
+        if kernel_size == (1, 1):
+            x = x[:, ::strides[0], ::strides[1], :]
+            patches = x
+        else:
+            # im2col：把各卷積核位置的切片沿通道拼接，與 (kh, kw, C, K) 核展平後的順序一致
+            patches = load_np().concatenate(list(_windows(x, kernel_size, strides, dilation)), axis=-1)
+        n, h, w, depth = patches.shape
+        y = patches.reshape(-1, depth) @ kernel
+        return self._finish(y.reshape(n, h, w, -1))
+
+    def _run_DepthwiseConv2D(self, x):
+        """深度卷積：逐張圖像、按輸出列分塊累加各卷積核位置的切片
+
+        整批一次累加時中間結果遠大於 CPU 快取，每個核位置都要重新從記憶體讀寫；
+        分塊後輸入切片與累加結果留在快取中，偏置與激活也在同一區塊上完成。
+        """
+        np = load_np()
+        kernel_size, strides, dilation, padding = self._conv_args()
+        kernel = self.params["depthwise_kernel"]  # 已整理為 (kh, kw, C * multiplier)
+        x = _pad_input(x, padding, kernel_size, strides, dilation)
+        if self.multiplier > 1:
+            x = np.repeat(x, self.multiplier, axis=-1)
+        n, height, width, channels = x.shape
+        out_h = (height - (kernel_size[0] - 1) * dilation[0] - 1) // strides[0] + 1
+        out_w = (width - (kernel_size[1] - 1) * dilation[1] - 1) // strides[1] + 1
+        y = np.empty((n, out_h, out_w, channels), dtype=np.float32)
+        rows = max(1, _TILE_BYTES // (out_w * channels * 4))
+        buffer = np.empty((min(rows, out_h), out_w, channels), dtype=np.float32)
+        for b in range(n):
+            for top in range(0, out_h, rows):
+                tile_h = min(rows, out_h - top)
+                out = y[b, top:top + tile_h]
+                tmp = buffer[:tile_h]
+                for index, (i, j) in enumerate(np.ndindex(*kernel_size)):
+                    row = top * strides[0] + i * dilation[0]
+                    col = j * dilation[1]
+                    window = x[b, row:row + (tile_h - 1) * strides[0] + 1:strides[0],
+                               col:col + (out_w - 1) * strides[1] + 1:strides[1]]
+                    if index == 0:
+                        np.multiply(window, kernel[i, j], out=out)
+                    else:
+                        np.multiply(window, kernel[i, j], out=tmp)
+                        out += tmp
+                # 激活函數不一定就地運算，需寫回結果
+                out[...] = self._finish(out)
+        return y
+
+    def _run_BatchNormalization(self, x):
+        return x * self.params["scale"] + self.params["shift"]
+
+    def _run_ReLU(self, x):
+        np = load_np()
+        c = self.config
+        max_value = c.get("max_value")
+        slope = c.get("negative_slope") or 0.0
+        threshold = c.get("threshold") or 0.0
+        if slope == 0.0 and threshold == 0.0:
+            return np.clip(x, 0.0, max_value) if max_value is not None else np.maximum(x, 0.0)
+        y = np.where(x >= threshold, x, slope * (x - threshold))
+        return np.minimum(y, max_value) if max_value is not None else y
+
+    def _run_Activation(self, x):
+        activation = _activation(self.config["activation"])
+        return activation(x.copy()) if activation else x
+
+    def _run_ZeroPadding2D(self, x):
+        padding = self.config["padding"]
+        if isinstance(padding, int):
+            padding = ((padding, padding), (padding, padding))
+        elif isinstance(padding[0], int):
+            padding = ((padding[0], padding[0]), (padding[1], padding[1]))
+        return load_np().pad(x, ((0, 0), tuple(padding[0]), tuple(padding[1]), (0, 0)))
+
+    def _pool(self, x, reduce, pad_value):
+        c = self.config
+        pool = tuple(c["pool_size"])
+        strides = tuple(c.get("strides") or pool)
+        padding = c.get("padding", "valid")
+        n, h, w, ch = x.shape
+        if padding == "valid" and pool == strides and h % pool[0] == 0 and w % pool[1] == 0:
+            # 不重疊且整除時直接重塑後歸約
+            blocks = x.reshape(n, h // pool[0], pool[0], w // pool[1], pool[1], ch)
+            return reduce(blocks, axis=(2, 4))
+        if reduce.__name__ == "mean" and padding != "valid":
+            raise LayersModelError("不支持 same 填充的平均池化")
+        x = _pad_input(x, padding, pool, strides, (1, 1), value=pad_value)
+        return reduce(load_np().stack(list(_windows(x, pool, strides, (1, 1)))), axis=0)
+
+    def _run_AveragePooling2D(self, x):
+        return self._pool(x, load_np().mean, 0.0)
+
+    def _run_MaxPooling2D(self, x):
+        np = load_np()
+        return self._pool(x, np.max, -np.inf)
+
+    def _run_GlobalAveragePooling2D(self, x):
+        return x.mean(axis=(1, 2))
+
+    def _run_GlobalMaxPooling2D(self, x):
+        return x.max(axis=(1, 2))
+
+    def _run_Flatten(self, x):
+        return x.reshape(x.shape[0], -1)
+
+    def _run_Dense(self, x):
+        return self._finish(x @ self.params["kernel"])
+
+    def _run_Add(self, *xs):
+        y = xs[0] + xs[1]
+        for x in xs[2:]:
+            y += x
+        return y
+
+    def _run_Multiply(self, *xs):
+        y = xs[0] * xs[1]
+        for x in xs[2:]:
+            y *= x
+        return y
+
+    def _run_Concatenate(self, *xs):
+        return load_np().concatenate(xs, axis=self.config.get("axis", -1))
+
+    def _run_Identity(self, x):
+        # InputLayer、Dropout 等推論時不改變數值的層
+        return x
+
+
+# 推論時等同恆等映射的層
+_IDENTITY_LAYERS = ("InputLayer", "Dropout", "SpatialDropout2D", "GaussianNoise", "GaussianDropout")
+
+
+class LayersModel:
+    """以 NumPy 執行的 TF.js layers 模型 (channels_last，float32)
+
+    只實現推論：載入時把 BatchNormalization 與 ReLU 融合進前一層、整理好權重布局，
+    得到固定輸入形狀的執行計劃；推論時層按拓撲順序執行，張量在最後一次使用後即釋放。
+    模型載入後不可變，可在多個執行緒中同時調用 predict()。
+    """
+
+    # predict() 每次送入執行計劃的最大圖像數，避免大批次的中間張量佔用過多記憶體
+    max_batch = 4
+
+    def __init__(self, layers, input_name, output_name, input_shape):
+        self.layers = layers
+        self.input_name = input_name
+        self.output_name = output_name
+        self.input_shape = input_shape  # 例如 (None, 224, 224, 3)
+        # 每個張量最後一次被使用的層索引，之後即可釋放
+        self._last_use = {}
+        for index, layer in enumerate(layers):
+            for name in layer.inputs:
+                self._last_use[name] = index
+
+    @property
+    def nbytes(self):
+        return sum(value.nbytes for layer in self.layers for value in layer.params.values())
+
+    def predict(self, batch, batch_size=None):
+        """對形狀 (N, 高, 寬, 通道) 的批次執行推論，返回輸出層的數組
+
+        超過 batch_size (預設 max_batch) 張時分段執行後拼接。
+        """
+        np = load_np()
+        batch = np.asarray(batch, dtype=np.float32)
+        expected = tuple(self.input_shape[1:])
+        if batch.ndim != 4 or (None not in expected and batch.shape[1:] != expected):
+            raise ValueError(f"輸入形狀 {batch.shape} 與模型輸入 {self.input_shape} 不符")
+        batch_size = batch_size or self.max_batch
+        if len(batch) <= batch_size:
+            return self._execute(batch)
+        return np.concatenate([self._execute(batch[start:start + batch_size])
+                               for start in range(0, len(batch), batch_size)])
+
+    def _execute(self, batch):
+        tensors = {self.input_name: batch}
+        for index, layer in enumerate(self.layers):
+            if layer.class_name == "InputLayer":
+                continue
+            tensors[layer.name] = layer.run([tensors[name] for name in layer.inputs])
+            for name in layer.inputs:
+                if self._last_use.get(name) == index and name != self.output_name:
+                    del tensors[name]
+        return tensors[self.output_name]
+
+
+def _inbound_names(layer_config, previous):
+    """返回該層的輸入層名稱；Sequential 模型沒有 inbound_nodes，依序連接上一層"""
+    nodes = layer_config.get("inbound_nodes")
+    if nodes is None:
+        return [previous] if previous else []
+    if not nodes:
+        return []
+    if len(nodes) > 1:
+        raise LayersModelError(f"不支持共享層: {layer_config.get('name')}")
+    return [inbound[0] for inbound in nodes[0]]
+
+
+def _fold_batch_norm(layers, consumers):
+    """把緊接在卷積或全連接層後的 BatchNormalization 折疊進前一層的權重與偏置
+
+    前一層的輸出只被該 BatchNormalization 使用時才折疊；折疊後的 BatchNormalization
+    改為恆等層。MobileNet 等網路每個卷積後都有 BN，折疊可省去約三分之一的逐元素運算。
+    """
+    np = load_np()
+    by_name = {layer.name: layer for layer in layers}
+    for layer in layers:
+        if layer.class_name != "BatchNormalization":
+            continue
+        source = by_name.get(layer.inputs[0])
+        if source is None or consumers.get(source.name) != 1:
+            continue
+        if source.class_name not in ("Conv2D", "DepthwiseConv2D", "Dense"):
+            continue
+        if source.config.get("activation") not in (None, "linear"):
+            continue
+        scale, shift = layer.params["scale"], layer.params["shift"]
+        if source.class_name == "DepthwiseConv2D":
+            kernel = source.params["depthwise_kernel"]
+            source.params["depthwise_kernel"] = kernel * scale.reshape(kernel.shape[2], kernel.shape[3])
+        else:
+            source.params["kernel"] = source.params["kernel"] * scale
+        bias = source.params.get("bias")
+        source.params["bias"] = (shift if bias is None else bias * scale + shift).astype(np.float32)
+        layer.class_name = "Identity"
+        layer.params = {}
+
+
+def _fuse_relu(layers, consumers):
+    """把緊接在卷積或全連接層後的 ReLU 層融合為該層的就地激活 (前一層無激活且輸出只被該 ReLU 使用)"""
+    by_name = {layer.name: layer for layer in layers}
+    for layer in layers:
+        if layer.class_name != "ReLU":
+            continue
+        if (layer.config.get("negative_slope") or 0.0) != 0.0 or (layer.config.get("threshold") or 0.0) != 0.0:
+            continue
+        source = by_name.get(layer.inputs[0])
+        if source is None or consumers.get(source.name) != 1 or source.activation is not None:
+            continue
+        if source.class_name not in ("Conv2D", "DepthwiseConv2D", "Dense"):
+            continue
+        source.activation = _clip(layer.config.get("max_value"))
+        layer.class_name = "Identity"
+
+
+def _batch_norm_params(config, params):
+    """將 BatchNormalization 的參數換算為 y = x * scale + shift"""
+    np = load_np()
+    variance = params["moving_variance"]
+    scale = 1.0 / np.sqrt(variance + config.get("epsilon", 1e-3))
+    if config.get("scale", True):
+        scale = scale * params["gamma"]
+    shift = -params["moving_mean"] * scale
+    if config.get("center", True):
+        shift = shift + params["beta"]
+    return {"scale": scale.astype(np.float32), "shift": shift.astype(np.float32)}
+
+
+def build_layers_model(topology, weights):
+    """由模型拓撲 (Keras 模型配置) 與權重建立 LayersModel"""
+    model_config = topology.get("model_config", topology)
+    config = model_config["config"]
+    layer_configs = config["layers"] if isinstance(config, dict) else config
+    params_by_layer = _layer_weights(weights)
+
+    layers = []
+    previous = None
+    input_shape = None
+    for layer_config in layer_configs:
+        class_name = layer_config["class_name"]
+        cfg = layer_config["config"]
+        name = layer_config.get("name") or cfg["name"]
+        inputs = _inbound_names(layer_config, previous)
+        params = dict(params_by_layer.get(name, {}))
+
+        if class_name == "InputLayer":
+            input_shape = tuple(cfg["batch_input_shape"])
+        elif input_shape is None and cfg.get("batch_input_shape"):
+            # Sequential 模型把輸入形狀寫在第一層
+            input_shape = tuple(cfg["batch_input_shape"])
+            inputs = ["input"]
+        if cfg.get("data_format", "channels_last") != "channels_last":
+            raise LayersModelError(f"只支持 channels_last: {name}")
+        if class_name == "BatchNormalization":
+            params = _batch_norm_params(cfg, params)
+        elif class_name in _IDENTITY_LAYERS and class_name != "InputLayer":
+            class_name = "Identity"
+        if class_name not in ("InputLayer", "Identity") and not hasattr(_Layer, "_run_" + class_name):
+            raise LayersModelError(f"不支持的層類型: {layer_config['class_name']} ({name})")
+        if class_name in ("Conv2D", "DepthwiseConv2D", "Dense") and not cfg.get("use_bias", True):
+            params.pop("bias", None)
+
+        layers.append(_Layer(name, class_name, cfg, inputs, params))
+        previous = name
+
+    if input_shape is None:
+        raise LayersModelError("模型缺少輸入形狀")
+    if isinstance(config, dict) and config.get("input_layers"):
+        input_name = config["input_layers"][0][0]
+        output_name = config["output_layers"][0][0]
+    else:
+        input_name = layers[0].inputs[0] if layers[0].inputs else layers[0].name
+        output_name = layers[-1].name
+
+    consumers = {}
+    for layer in layers:
+        for inbound in layer.inputs:
+            consumers[inbound] = consumers.get(inbound, 0) + 1
+    _fold_batch_norm(layers, consumers)
+
+    # 恆等層直接改寫下游的輸入名稱，執行時不再經過
+    aliases = {}
+    compiled = []
+    for layer in layers:
+        layer.inputs = [aliases.get(name, name) for name in layer.inputs]
+        if layer.class_name == "Identity" and len(layer.inputs) == 1:
+            aliases[layer.name] = layer.inputs[0]
+            continue
+        compiled.append(layer)
+
+    # BN 折疊後卷積的唯一使用者變為 ReLU，再把 ReLU 融合進卷積
+    consumers = {}
+    for layer in compiled:
+        for inbound in layer.inputs:
+            consumers[inbound] = consumers.get(inbound, 0) + 1
+    _fuse_relu(compiled, consumers)
+    layers, compiled = compiled, []
+    for layer in layers:
+        layer.inputs = [aliases.get(name, name) for name in layer.inputs]
+        if layer.class_name == "Identity":
+            aliases[layer.name] = layer.inputs[0]
+            continue
+        layer.prepare()
+        compiled.append(layer)
+    output_name = aliases.get(output_name, output_name)
+    return LayersModel(compiled, input_name, output_name, input_shape)
+
+
+def load_layers_model(model_path):
+    """載入 TF.js layers 格式的模型 (model.json 及同目錄下的權重分片)"""
+    with open(model_path, "r", encoding="utf-8") as f:
+        artifacts = json.load(f)
+    if artifacts.get("format", "layers-model") != "layers-model":
+        raise LayersModelError(f"只支持 layers-model 格式，實際為: {artifacts.get('format')}")
+    weights = read_weights(artifacts.get("weightsManifest", []), os.path.dirname(os.path.abspath(model_path)))
+    model = build_layers_model(artifacts["modelTopology"], weights)
+    logger.info(f"已載入 TF.js 模型 {model_path}: {len(model.layers)} 層, 權重 {model.nbytes / 1e6:.1f} MB")
+    return model
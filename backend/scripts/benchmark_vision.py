@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+"""視覺管線效能基準測試
+
+用法:
+    python scripts/benchmark_vision.py matching [--sizes 100,1000,10000,100000] [--dim 12996]
+    python scripts/benchmark_vision.py projection [--size 2000] [--dims 128,256,512] [--from-db]
+    python scripts/benchmark_vision.py index [--sizes 10000,50000] [--dim 256] [--nprobes 1,4,8,16,32]
+    python scripts/benchmark_vision.py detection --images 照片目錄 [--max-edges 0,320,480,640] [--frame-width 1280]
+    python scripts/benchmark_vision.py encoding [--batch-sizes 1,4,16,64] [--repeat 20]
+    python scripts/benchmark_vision.py batch-matching [--size 10000] [--dim 12996] [--batch-sizes 1,4,16,32]
+    python scripts/benchmark_vision.py mask [--batch-sizes 1,2,4,8,16] [--chunk 4] [--random-weights]
+"""
+import os
+import sys
+import glob
+import time
+import json
+import argparse
+import logging
+
+import numpy as np
+
+# 添加父目錄到系統路徑，以便導入models模塊
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models import face_recognition
+from models.face_recognition import FaceGallery, FACE_ENCODER_VERSION, MATCH_TOLERANCE
+from models.face_projection import FaceProjection, calibrate_projection
+from models.face_index import ExactFaceIndex, IVFFlatFaceIndex
+from models import mask_detection
+from models.tfjs_layers import build_layers_model, load_layers_model
+
+# 設置日誌
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger("benchmark_vision")
+
+# HOG 人臉編碼的預設維度
+HOG_DIM = 12996
+
+
+def parse_sizes(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def random_unit_vectors(rng, count, dim, chunk=4096):
+    """以分塊方式產生單位向量，避免一次產生 float64 大矩陣"""
+    matrix = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, chunk):
+        block = rng.standard_normal((min(chunk, count - start), dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        matrix[start:start + len(block)] = block
+    return matrix
+
+
+def time_call(func, repeat):
+    """返回多次調用的中位數延遲 (毫秒)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def legacy_match(known_faces, probe):
+    """舊版逐員工比對的實現，作為對照組"""
+    match_scores = {}
+    for employee_id, known_encoding in known_faces.items():
+        match_scores[employee_id] = np.linalg.norm(np.array(known_encoding) - probe)
+    return min(match_scores, key=match_scores.get)
+
+
+def bench_matching(args):
+    rng = np.random.default_rng(args.seed)
+    print(f"{'gallery':>10} {'legacy ms':>12} {'gallery ms':>12} {'top-k ms':>10} {'speedup':>9}")
+    for size in parse_sizes(args.sizes):
+        required_mb = size * args.dim * 4 / 1024 / 1024
+        if required_mb > args.max_mb:
+            print(f"{size:>10} 略過: 需要約 {required_mb:.0f} MB，超過 --max-mb {args.max_mb}")
+            continue
+
+        matrix = random_unit_vectors(rng, size, args.dim)
+        gallery = FaceGallery()
+        gallery.load({str(i): matrix[i] for i in range(size)})
+        # 探針取自特徵庫中的某一列並加入噪聲
+        probe = matrix[size // 2] + rng.standard_normal(args.dim, dtype=np.float32) * (0.1 / np.sqrt(args.dim))
+
+        gallery_ms = time_call(lambda: gallery.match(probe), args.repeat)
+        topk_ms = time_call(lambda: gallery.search(probe, k=args.k), args.repeat)
+
+        if size <= args.legacy_max:
+            # 舊實現將編碼保存為 Python list
+            known_faces = {str(i): matrix[i].tolist() for i in range(size)}
+            legacy_ms = time_call(lambda: legacy_match(known_faces, probe), max(1, args.repeat // 5))
+            del known_faces
+            print(f"{size:>10} {legacy_ms:>12.2f} {gallery_ms:>12.2f} {topk_ms:>10.2f} {legacy_ms / gallery_ms:>8.1f}x")
+        else:
+            print(f"{size:>10} {'-':>12} {gallery_ms:>12.2f} {topk_ms:>10.2f} {'-':>9}")
+
+        assert gallery.match(probe).employee_id == str(size // 2)
+        del gallery, matrix
+
+
+def synthetic_identities(rng, size, dim, rank=64, noise=0.3):
+    """產生具有低秩結構的模擬人臉編碼，返回 (註冊編碼, 探針編碼)"""
+    basis = rng.standard_normal((rank, dim), dtype=np.float32)
+    codes = rng.standard_normal((size, rank), dtype=np.float32)
+    templates = codes @ basis + noise * rng.standard_normal((size, dim), dtype=np.float32) * np.sqrt(rank)
+    probes = codes @ basis + noise * rng.standard_normal((size, dim), dtype=np.float32) * np.sqrt(rank)
+    templates /= np.linalg.norm(templates, axis=1, keepdims=True)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return templates, probes
+
+
+def db_identities(rng, noise):
+    """以資料庫中的人臉編碼為註冊編碼，加入噪聲作為探針"""
+    from app.database import SessionLocal
+    from scripts.fit_face_projection import load_raw_encodings
+    db = SessionLocal()
+    try:
+        templates = load_raw_encodings(db)
+    finally:
+        db.close()
+    probes = templates + rng.standard_normal(templates.shape, dtype=np.float32) * (noise / np.sqrt(templates.shape[1]))
+    return templates, probes
+
+
+def top1(gallery, probes, project=None):
+    """返回每個探針的最佳匹配ID與平均延遲 (毫秒)"""
+    ids = []
+    start = time.perf_counter()
+    for probe in probes:
+        if project is not None:
+            probe = project.transform(probe)
+        ids.append(gallery.search(probe, k=1)[0][0])
+    return ids, (time.perf_counter() - start) * 1000 / len(probes)
+
+
+def accept_rates(gallery, genuine, truth, impostors, tolerance=None):
+    """返回 (正確接受率, 誤接受率)：真實探針以正確ID被接受，冒名探針被接受為任何員工"""
+    matches = gallery.match_batch(list(genuine), tolerance=tolerance)
+    tar = np.mean([m.employee_id == t for m, t in zip(matches, truth)])
+    far = np.mean([m.employee_id is not None for m in gallery.match_batch(list(impostors), tolerance=tolerance)])
+    return tar, far
+
+
+def bench_projection(args):
+    rng = np.random.default_rng(args.seed)
+    if args.from_db:
+        templates, probes = db_identities(rng, args.noise)
+        impostor_count = min(args.probes, len(templates) // 4)
+    else:
+        impostor_count = args.probes
+        templates, probes = synthetic_identities(rng, args.size + impostor_count, args.dim, noise=args.noise)
+    # 留出部分身份不註冊，其探針作為冒名者，用於量測誤接受率
+    order = rng.permutation(len(templates))
+    enrolled, held_out = order[:len(templates) - impostor_count], order[len(templates) - impostor_count:]
+    impostors = probes[held_out]
+    templates, probes = templates[enrolled], probes[enrolled]
+    size = len(templates)
+    probe_count = min(args.probes, size)
+    probe_rows = rng.choice(size, probe_count, replace=False)
+    truth = [str(row) for row in probe_rows]
+
+    full = FaceGallery()
+    full.load({str(i): templates[i] for i in range(size)})
+    full_ids, full_ms = top1(full, probes[probe_rows])
+    full_acc = np.mean([a == b for a, b in zip(full_ids, truth)])
+    full_tar, full_far = accept_rates(full, probes[probe_rows], truth, impostors)
+    print(f"特徵庫 {size} 筆, 原始維度 {templates.shape[1]}, 探針 {probe_count} 筆, 冒名探針 {len(impostors)} 筆")
+    print(f"{'method':>8} {'dim':>6} {'match ms':>10} {'speedup':>9} {'top-1 agree':>12} {'top-1 acc':>10} "
+          f"{'tolerance':>10} {'TAR':>8} {'FAR':>8} {'FAR@raw':>8}")
+    print(f"{'full':>8} {templates.shape[1]:>6} {full_ms:>10.3f} {'1.0x':>9} {'-':>12} {full_acc:>10.2%} "
+          f"{MATCH_TOLERANCE:>10.4f} {full_tar:>8.2%} {full_far:>8.2%} {'-':>8}")
+
+    for method in args.methods.split(","):
+        for dim in parse_sizes(args.dims):
+            try:
+                if method == "pca":
+                    projection = FaceProjection.fit_pca(templates, dim, FACE_ENCODER_VERSION)
+                else:
+                    # 與模擬數據使用不同的種子，否則投影矩陣與模擬數據的低秩基底相同
+                    projection = FaceProjection.fit_random(templates.shape[1], dim, FACE_ENCODER_VERSION, args.seed + 1)
+                calibrate_projection(projection, templates, MATCH_TOLERANCE, args.seed)
+            except ValueError as e:
+                print(f"{method:>8} {dim:>6} 略過: {e}")
+                continue
+            reduced = FaceGallery()
+            reduced.set_projection(projection)
+            reduced.load({str(i): row for i, row in enumerate(projection.transform(templates))})
+            ids, ms = top1(reduced, probes[probe_rows], projection)
+            agree = np.mean([a == b for a, b in zip(ids, full_ids)])
+            acc = np.mean([a == b for a, b in zip(ids, truth)])
+            genuine = projection.transform(probes[probe_rows])
+            projected_impostors = projection.transform(impostors)
+            tar, far = accept_rates(reduced, genuine, truth, projected_impostors)
+            # 未校準、直接沿用原始閾值時的誤接受率
+            _, raw_far = accept_rates(reduced, genuine, truth, projected_impostors, MATCH_TOLERANCE)
+            print(f"{method:>8} {dim:>6} {ms:>10.3f} {full_ms / ms:>8.1f}x {agree:>12.2%} {acc:>10.2%} "
+                  f"{projection.tolerance:>10.4f} {tar:>8.2%} {far:>8.2%} {raw_far:>8.2%}")
+
+
+def clustered_vectors(rng, size, dim, clusters=256, spread=0.5):
+    """產生帶有群聚結構的單位向量 (模擬不同光線、年齡、性別下的人臉分佈)"""
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, size)
+    matrix = centers[labels] + spread * rng.standard_normal((size, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def latency_stats(index, probes, k):
+    """返回 (每個探針的 top-k ID, 中位數延遲 ms, p95 延遲 ms)"""
+    results, samples = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        results.append([emp_id for emp_id, _ in index.search(probe, k)])
+        samples.append((time.perf_counter() - start) * 1000)
+    return results, float(np.median(samples)), float(np.percentile(samples, 95))
+
+
+def recall_at(results, truth, k):
+    """近似結果前k名中包含精確最近鄰的比例"""
+    return float(np.mean([t[0] in r[:k] for r, t in zip(results, truth)]))
+
+
+def bench_index(args):
+    rng = np.random.default_rng(args.seed)
+    if args.from_db:
+        matrix, _ = db_identities(rng, 0.0)
+        sizes = [len(matrix)]
+    else:
+        sizes = parse_sizes(args.sizes)
+
+    for size in sizes:
+        if not args.from_db:
+            matrix = clustered_vectors(rng, size, args.dim)
+        ids = [str(i) for i in range(size)]
+        rows = rng.choice(size, min(args.probes, size), replace=False)
+        probes = matrix[rows] + rng.standard_normal((len(rows), matrix.shape[1]), dtype=np.float32) * (args.noise / np.sqrt(matrix.shape[1]))
+
+        exact = ExactFaceIndex()
+        exact.build(ids, matrix)
+        truth, exact_p50, exact_p95 = latency_stats(exact, probes, args.k)
+
+        start = time.perf_counter()
+        ivf = IVFFlatFaceIndex(nlist=args.nlist, train_min=0, seed=args.seed)
+        ivf.build(ids, matrix)
+        build_s = time.perf_counter() - start
+
+        print(f"\n特徵庫 {size} 筆, 維度 {matrix.shape[1]}, IVF 列表 {len(ivf._lists)} 個, 訓練 {build_s:.2f}s")
+        print(f"{'backend':>10} {'nprobe':>7} {'p50 ms':>9} {'p95 ms':>9} {'speedup':>9} {'recall@1':>9} {'recall@' + str(args.k):>9}")
+        print(f"{'exact':>10} {'-':>7} {exact_p50:>9.3f} {exact_p95:>9.3f} {'1.0x':>9} {1.0:>9.2%} {1.0:>9.2%}")
+        for nprobe in parse_sizes(args.nprobes):
+            ivf.nprobe = nprobe
+            results, p50, p95 = latency_stats(ivf, probes, args.k)
+            print(f"{'ivf':>10} {nprobe:>7} {p50:>9.3f} {p95:>9.3f} {exact_p50 / p50:>8.1f}x "
+                  f"{recall_at(results, truth, 1):>9.2%} {recall_at(results, truth, args.k):>9.2%}")
+
+
+def load_frames(patterns, frame_width):
+    """讀取測試照片並縮放到指定寬度，模擬打卡機的攝像頭影格"""
+    import cv2
+
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, "*"))))
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+
+    frames = []
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        if frame_width:
+            height = int(round(image.shape[0] * frame_width / image.shape[1]))
+            image = cv2.resize(image, (frame_width, height), interpolation=cv2.INTER_AREA)
+        frames.append((path, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)))
+    return frames
+
+
+def box_iou(a, b):
+    ax1, ay1, ax2, ay2 = a[0], a[1], a[0] + a[2], a[1] + a[3]
+    bx1, by1, bx2, by2 = b[0], b[1], b[0] + b[2], b[1] + b[3]
+    inter = max(0, min(ax2, bx2) - max(ax1, bx1)) * max(0, min(ay2, by2) - max(ay1, by1))
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+
+def bench_detection(args):
+    frames = load_frames(args.images, args.frame_width)
+    if not frames:
+        print("找不到可讀取的測試照片，請以 --images 指定照片目錄或檔案")
+        return
+    if not face_recognition.initialize_face_detector():
+        print("臉部檢測器初始化失敗")
+        return
+    height, width = frames[0][1].shape
+    print(f"測試照片 {len(frames)} 張，第一張影格 {width}x{height}")
+
+    # 以原始解析度的檢測結果作為對照
+    face_recognition.configure_face_detection(0)
+    baseline = [face_recognition.detect_faces_gray(gray) for _, gray in frames]
+    baseline_boxes = sum(len(faces) for faces in baseline)
+
+    print(f"{'max_edge':>9} {'refine':>7} {'p50 ms':>9} {'p95 ms':>9} {'speedup':>9} {'detected':>9} {'recall':>7} {'IoU':>6}")
+    base_p50 = None
+    for max_edge in parse_sizes(args.max_edges):
+        for refine in ([False, True] if max_edge else [False]):
+            face_recognition.configure_face_detection(max_edge, refine)
+            samples, results = [], []
+            for _, gray in frames:
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    faces = face_recognition.detect_faces_gray(gray)
+                    timings.append((time.perf_counter() - start) * 1000)
+                samples.append(float(np.median(timings)))
+                results.append(faces)
+            p50, p95 = float(np.median(samples)), float(np.percentile(samples, 95))
+            if base_p50 is None:
+                base_p50 = p50
+            detected = sum(1 for faces in results if faces)
+            # 原始解析度檢測到的人臉框中，有多少被找回 (IoU >= 0.5)，以及找回框的平均 IoU
+            ious = [
+                max((box_iou(face, base_face) for face in faces), default=0.0)
+                for faces, base in zip(results, baseline) for base_face in base
+            ]
+            matched = [iou for iou in ious if iou >= 0.5]
+            recall = len(matched) / baseline_boxes if baseline_boxes else 0.0
+            mean_iou = float(np.mean(matched)) if matched else 0.0
+            print(f"{max_edge or 'full':>9} {'yes' if refine else 'no':>7} {p50:>9.2f} {p95:>9.2f} "
+                  f"{base_p50 / p50:>8.1f}x {detected / len(frames):>9.2%} {recall:>7.2%} {mean_iou:>6.2f}")
+
+
+def legacy_encode(image, face_location):
+    """舊版每次調用都建立新 HOGDescriptor 的編碼實現，作為對照組"""
+    import cv2
+
+    face = face_recognition.preprocess_face(image, face_location)
+    hog = cv2.HOGDescriptor((160, 160), (16, 16), (8, 8), (8, 8), 9)
+    encoding = hog.compute(face)
+    if np.linalg.norm(encoding) > 0:
+        encoding = encoding / np.linalg.norm(encoding)
+    return encoding.flatten().tolist()
+
+
+def bench_encoding(args):
+    rng = np.random.default_rng(args.seed)
+    # 模擬 1280x720 影格中大小不一的人臉框；編碼成本與圖像內容無關
+    frame = rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8)
+    max_batch = max(parse_sizes(args.batch_sizes))
+    boxes = []
+    for _ in range(max_batch):
+        side = int(rng.integers(80, 320))
+        boxes.append([int(rng.integers(0, 1280 - side)), int(rng.integers(0, 720 - side)), side, side])
+
+    print(f"{'batch':>6} {'legacy us/face':>15} {'cached us/face':>15} {'batch us/face':>14} {'speedup':>8}")
+    for batch in parse_sizes(args.batch_sizes):
+        batch_boxes = boxes[:batch]
+        legacy_ms = time_call(lambda: [legacy_encode(frame, box) for box in batch_boxes], args.repeat)
+        cached_ms = time_call(lambda: [face_recognition.encode_face(frame, box) for box in batch_boxes], args.repeat)
+        batch_ms = time_call(lambda: face_recognition.encode_faces(frame, batch_boxes), args.repeat)
+        print(f"{batch:>6} {legacy_ms * 1000 / batch:>15.1f} {cached_ms * 1000 / batch:>15.1f} "
+              f"{batch_ms * 1000 / batch:>14.1f} {legacy_ms / batch_ms:>7.2f}x")
+
+
+def bench_batch_matching(args):
+    rng = np.random.default_rng(args.seed)
+    matrix = random_unit_vectors(rng, args.size, args.dim)
+    gallery = FaceGallery()
+    gallery.load({str(i): matrix[i] for i in range(args.size)})
+    max_batch = max(parse_sizes(args.batch_sizes))
+    rows = rng.choice(args.size, max_batch, replace=args.size < max_batch)
+    probes = matrix[rows] + rng.standard_normal((max_batch, args.dim), dtype=np.float32) * (0.1 / np.sqrt(args.dim))
+
+    print(f"特徵庫 {args.size} 筆, 維度 {args.dim}")
+    print(f"{'batch':>6} {'single ms':>10} {'batched ms':>11} {'us/probe':>10} {'probes/s':>10} {'speedup':>8}")
+    for batch in parse_sizes(args.batch_sizes):
+        batch_probes = probes[:batch]
+        single_ms = time_call(lambda: [gallery.match(probe, k=5) for probe in batch_probes], args.repeat)
+        batched_ms = time_call(lambda: gallery.match_batch(batch_probes, k=5), args.repeat)
+        print(f"{batch:>6} {single_ms:>10.2f} {batched_ms:>11.2f} {batched_ms * 1000 / batch:>10.1f} "
+              f"{batch / batched_ms * 1000:>10.0f} {single_ms / batched_ms:>7.2f}x")
+
+        expected = [gallery.match(probe, k=5).employee_id for probe in batch_probes]
+        assert [m.employee_id for m in gallery.match_batch(batch_probes, k=5)] == expected
+
+
+def random_model_weights(rng, weights_manifest):
+    """依權重清單產生隨機權重 (推論耗時與權重數值無關，用於缺少權重分片時測試)"""
+    weights = {}
+    for group in weights_manifest:
+        for spec in group["weights"]:
+            if spec["name"].endswith("moving_variance"):
+                weights[spec["name"]] = rng.uniform(0.5, 1.5, spec["shape"]).astype(np.float32)
+            else:
+                weights[spec["name"]] = (rng.standard_normal(spec["shape"]) * 0.1).astype(np.float32)
+    return weights
+
+
+def bench_mask(args):
+    rng = np.random.default_rng(args.seed)
+    model = None
+    if not args.random_weights:
+        try:
+            model = load_layers_model(args.model)
+        except Exception as e:
+            print(f"無法載入模型權重 ({e})，改用隨機權重")
+    if model is None:
+        with open(args.model, "r", encoding="utf-8") as f:
+            artifacts = json.load(f)
+        model = build_layers_model(artifacts["modelTopology"], random_model_weights(rng, artifacts["weightsManifest"]))
+    if args.chunk:
+        model.max_batch = args.chunk
+    mask_detection.mask_model = model
+    # 逐張的 INFO 日誌會影響計時
+    logging.getLogger("mask_detection").setLevel(logging.WARNING)
+
+    max_batch = max(parse_sizes(args.batch_sizes))
+    crops = [rng.integers(0, 256, (args.crop, args.crop, 3), dtype=np.uint8) for _ in range(max_batch)]
+    inputs = mask_detection.preprocess_faces_for_mask_detection(crops[:1], bgr=True)
+    print(f"模型 {len(model.layers)} 層, 輸入 {model.input_shape}, 每段最多 {model.max_batch} 張")
+    print(f"單張延遲: 推論 {time_call(lambda: model.predict(inputs), args.repeat):.1f} ms, "
+          f"含預處理 {time_call(lambda: mask_detection.detect_masks(crops[:1]), args.repeat):.1f} ms")
+    print(f"{'batch':>6} {'single ms':>10} {'batched ms':>11} {'ms/image':>9} {'images/s':>9} {'speedup':>8}")
+    for batch in parse_sizes(args.batch_sizes):
+        batch_crops = crops[:batch]
+        single_ms = time_call(lambda: [mask_detection.detect_masks([crop]) for crop in batch_crops], args.repeat)
+        batched_ms = time_call(lambda: mask_detection.detect_masks(batch_crops), args.repeat)
+        print(f"{batch:>6} {single_ms:>10.1f} {batched_ms:>11.1f} {batched_ms / batch:>9.1f} "
+              f"{batch / batched_ms * 1000:>9.1f} {single_ms / batched_ms:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="視覺管線效能基準測試")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    matching = subparsers.add_parser("matching", help="人臉特徵庫比對延遲 vs 特徵庫大小")
+    matching.add_argument("--sizes", default="100,1000,10000,100000", help="以逗號分隔的特徵庫大小")
+    matching.add_argument("--dim", type=int, default=HOG_DIM, help="人臉編碼維度")
+    matching.add_argument("--k", type=int, default=5, help="top-k 查詢的k值")
+    matching.add_argument("--repeat", type=int, default=20, help="每個大小重複查詢次數")
+    matching.add_argument("--legacy-max", type=int, default=2000, help="超過此大小時不再測試舊實現")
+    matching.add_argument("--max-mb", type=int, default=4096, help="特徵庫矩陣允許的最大記憶體 (MB)")
+    matching.add_argument("--seed", type=int, default=0)
+    matching.set_defaults(func=bench_matching)
+
+    projection = subparsers.add_parser("projection", help="降維投影的比對延遲、top-1 一致率與誤接受率")
+    projection.add_argument("--size", type=int, default=2000, help="模擬特徵庫大小")
+    projection.add_argument("--dim", type=int, default=HOG_DIM, help="原始編碼維度")
+    projection.add_argument("--dims", default="128,256,512", help="以逗號分隔的投影維度")
+    projection.add_argument("--methods", default="pca,random", help="以逗號分隔的降維方法")
+    projection.add_argument("--probes", type=int, default=200, help="探針數量 (另有同樣數量的未註冊冒名探針)")
+    projection.add_argument("--noise", type=float, default=1.0, help="探針噪聲強度 (模擬數據為相對強度，--from-db 時為歐式範數)")
+    projection.add_argument("--from-db", action="store_true", help="使用資料庫中已註冊的人臉編碼")
+    projection.add_argument("--seed", type=int, default=0)
+    projection.set_defaults(func=bench_projection)
+
+    index = subparsers.add_parser("index", help="精確索引與 IVF 近似索引的延遲及召回率")
+    index.add_argument("--sizes", default="10000,50000", help="以逗號分隔的特徵庫大小")
+    index.add_argument("--dim", type=int, default=256, help="向量維度 (降維後)")
+    index.add_argument("--nlist", type=int, default=0, help="IVF 列表數，0 表示自動")
+    index.add_argument("--nprobes", default="1,4,8,16,32", help="以逗號分隔的 nprobe 值")
+    index.add_argument("--k", type=int, default=5)
+    index.add_argument("--probes", type=int, default=200, help="探針數量")
+    index.add_argument("--noise", type=float, default=0.3, help="探針噪聲的歐式範數")
+    index.add_argument("--from-db", action="store_true", help="使用資料庫中已註冊的人臉編碼")
+    index.add_argument("--seed", type=int, default=0)
+    index.set_defaults(func=bench_index)
+
+    detection = subparsers.add_parser("detection", help="縮圖人臉檢測的延遲與檢測率 vs 原始解析度")
+    detection.add_argument("--images", nargs="+", required=True, help="測試照片的目錄、檔案或萬用字元")
+    detection.add_argument("--max-edges", default="0,320,480,640", help="以逗號分隔的縮圖長邊，0 表示原始解析度")
+    detection.add_argument("--frame-width", type=int, default=1280, help="先將照片縮放到此寬度 (0 表示不縮放)")
+    detection.add_argument("--repeat", type=int, default=3, help="每張照片重複檢測次數")
+    detection.set_defaults(func=bench_detection)
+
+    encoding = subparsers.add_parser("encoding", help="HOG 人臉編碼的每張成本：舊實現、緩存描述子與批量編碼")
+    encoding.add_argument("--batch-sizes", default="1,4,16,64", help="以逗號分隔的批量大小")
+    encoding.add_argument("--repeat", type=int, default=20, help="每個批量重複次數")
+    encoding.add_argument("--seed", type=int, default=0)
+    encoding.set_defaults(func=bench_encoding)
+
+    batch_matching = subparsers.add_parser("batch-matching", help="微批次比對：逐個探針 vs 探針矩陣一次比對的吞吐量")
+    batch_matching.add_argument("--size", type=int, default=10000, help="特徵庫大小")
+    batch_matching.add_argument("--dim", type=int, default=HOG_DIM, help="人臉編碼維度")
+    batch_matching.add_argument("--batch-sizes", default="1,4,16,32", help="以逗號分隔的批量大小")
+    batch_matching.add_argument("--repeat", type=int, default=10, help="每個批量重複次數")
+    batch_matching.add_argument("--seed", type=int, default=0)
+    batch_matching.set_defaults(func=bench_batch_matching)
+
+    mask = subparsers.add_parser("mask", help="口罩分類：單張延遲與不同批量的吞吐量")
+    mask.add_argument("--model", default=mask_detection.STATIC_MODEL_PATH, help="TF.js 模型的 model.json 路徑")
+    mask.add_argument("--random-weights", action="store_true", help="不讀取權重分片，使用隨機權重 (缺少分片時自動使用)")
+    mask.add_argument("--batch-sizes", default="1,2,4,8,16", help="以逗號分隔的批量大小")
+    mask.add_argument("--chunk", type=int, default=0, help="每段推論的最大圖像數，0 表示使用模型預設值")
+    mask.add_argument("--crop", type=int, default=160, help="模擬人臉裁剪的邊長 (像素)")
+    mask.add_argument("--repeat", type=int, default=5, help="每個批量重複次數")
+    mask.add_argument("--seed", type=int, default=0)
+    mask.set_defaults(func=bench_mask)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
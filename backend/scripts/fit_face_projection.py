@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""擬合人臉編碼降維投影，並重新投影資料庫中已保存的人臉編碼
+
+用法:
+    python scripts/fit_face_projection.py --method pca --dim 256
+    python scripts/fit_face_projection.py --method random --dim 256 --seed 42
+    python scripts/fit_face_projection.py --remove
+
+擬合完成後需重啟應用程序，各進程才會載入新的投影。
+"""
+import os
+import sys
+import argparse
+import logging
+
+import numpy as np
+
+# 添加父目錄到系統路徑，以便導入app模塊
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.database import SessionLocal, Employee
+from app.config import settings
+from app.face_store import decode_face_encoding, reproject_face_templates, record_face_change
+from models.face_recognition import FACE_ENCODER_VERSION, MATCH_TOLERANCE
+from models.face_projection import FaceProjection, PROJECTION_METHODS, calibrate_projection
+
+# 設置日誌
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger("fit_face_projection")
+
+
+def load_raw_encodings(db):
+    """讀取所有員工的原始人臉編碼"""
+    encodings = []
+    for emp in db.query(Employee).filter(Employee.face_template.isnot(None)).all():
+        try:
+            encoding = decode_face_encoding(emp)
+            if encoding is not None:
+                encodings.append(encoding)
+        except Exception as e:
+            logger.error(f"解析員工 {emp.id} 的人臉編碼失敗: {str(e)}")
+    return np.asarray(encodings, dtype=np.float32)
+
+
+def remove_projection(db, path):
+    """停用降維：刪除投影文件並清空已保存的降維編碼"""
+    if os.path.exists(path):
+        os.remove(path)
+        logger.info(f"已刪除人臉投影文件: {path}")
+    cleared = db.query(Employee).filter(Employee.face_embedding.isnot(None)).update(
+        {Employee.face_embedding: None, Employee.face_embedding_version: None},
+        synchronize_session=False
+    )
+    record_face_change(db, None, "reload")
+    db.commit()
+    logger.info(f"已清空 {cleared} 筆降維人臉編碼")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="擬合人臉編碼降維投影")
+    parser.add_argument("--method", choices=PROJECTION_METHODS, default="pca", help="降維方法")
+    parser.add_argument("--dim", type=int, default=256, help="投影後的維度 (建議 128-512)")
+    parser.add_argument("--seed", type=int, default=0, help="隨機投影的隨機種子")
+    parser.add_argument("--output", default=settings.FACE_PROJECTION_PATH, help="投影文件路徑")
+    parser.add_argument("--remove", action="store_true", help="停用降維並清空降維編碼")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.remove:
+            remove_projection(db, args.output)
+            return
+
+        encodings = load_raw_encodings(db)
+        if len(encodings) == 0:
+            logger.error("資料庫中沒有可用的人臉編碼，無法擬合投影")
+            return
+        logger.info(f"讀取 {len(encodings)} 筆人臉編碼，原始維度 {encodings.shape[1]}")
+
+        if args.method == "pca":
+            try:
+                projection = FaceProjection.fit_pca(encodings, args.dim, FACE_ENCODER_VERSION)
+            except ValueError as e:
+                logger.error(str(e))
+                return
+            # 主成分保留的方差比例，用於評估降維後的信息損失
+            centered = encodings - projection.mean
+            total_var = float((centered ** 2).sum())
+            kept_var = float((projection.transform(encodings) ** 2).sum())
+            if total_var > 0:
+                logger.info(f"PCA 保留方差比例: {kept_var / total_var:.2%}")
+        else:
+            projection = FaceProjection.fit_random(encodings.shape[1], args.dim, FACE_ENCODER_VERSION, args.seed)
+
+        # 投影不保持距離，以冒名配對校準投影空間的匹配閾值，與投影一同保存
+        try:
+            calibrate_projection(projection, encodings, MATCH_TOLERANCE, args.seed)
+        except ValueError as e:
+            logger.error(str(e))
+            return
+
+        projection.save(args.output)
+        count = reproject_face_templates(db, projection)
+        logger.info(f"已以投影 {projection.projection_id} 重新投影 {count} 筆人臉編碼，請重啟應用以生效")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,10 @@ import time
 # 添加父目录到系统路径，以便导入app模块
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.database import Base, Employee, ClockRecord
+from app.database import Base, Employee, ClockRecord, upgrade_schema
 from app.auth import get_password_hash
 from app.config import settings
+from app.face_store import migrate_legacy_face_encodings
 
 # 设置日志
 logging.basicConfig(
@@ -55,6 +56,9 @@ def main():
         Base.metadata.create_all(bind=engine)
         logger.info("数据库表创建完成")
         
+        # 升级旧表结构并将 JSON 人脸编码转换为二进制格式
+        upgrade_schema(engine)
+        
         # 创建默认管理员账户
         db = SessionLocal()
         try:
@@ -75,6 +79,10 @@ def main():
                 logger.info(f"默认管理员已创建: {settings.DEFAULT_ADMIN_EMAIL}")
             else:
                 logger.info(f"默认管理员已存在: {settings.DEFAULT_ADMIN_EMAIL}")
+            
+            converted = migrate_legacy_face_encodings(db)
+            if converted:
+                logger.info(f"已将 {converted} 笔人脸编码转换为二进制格式")
         finally:
             db.close()
             
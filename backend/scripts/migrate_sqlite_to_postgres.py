@@ -13,6 +13,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from app.database import Base, Employee, ClockRecord
 from app.config import settings
+from models.face_recognition import pack_face_encoding, FACE_ENCODER_VERSION
 
 # 设置日志
 logging.basicConfig(
@@ -48,21 +49,59 @@ def bool_converter(value):
         return bool(value)
     return False
 
+def face_template_converter(face_encoding):
+    """将 JSON 格式的人脸编码转换为 (二进制编码, 编码器版本, 维度)"""
+    if not face_encoding or not face_encoding.strip():
+        return None, None, None
+    template, dim = pack_face_encoding(json.loads(face_encoding), settings.FACE_TEMPLATE_DTYPE)
+    return template, FACE_ENCODER_VERSION, dim
+
 def migrate_employees(sqlite_conn, postgres_session):
     """迁移员工数据"""
     logger.info("开始迁移员工数据...")
     cursor = sqlite_conn.cursor()
-    cursor.execute("SELECT id, name, email, hashed_password, is_admin, face_encoding, created_at, updated_at FROM employees")
+    
+    # 旧版 SQLite 数据库可能尚未执行 update_db.py，没有二进制人脸编码栏位
+    cursor.execute("PRAGMA table_info(employees)")
+    column_names = [col[1] for col in cursor.fetchall()]
+    has_face_template = "face_template" in column_names
+    has_face_embedding = "face_embedding" in column_names
+    
+    if has_face_template:
+        cursor.execute("SELECT id, name, email, hashed_password, is_admin, face_encoding, face_template, "
+                       "face_encoder_version, face_encoding_dim, created_at, updated_at FROM employees")
+    else:
+        cursor.execute("SELECT id, name, email, hashed_password, is_admin, face_encoding, created_at, updated_at FROM employees")
     rows = cursor.fetchall()
     
+    # 降维后的人脸编码与投影文件绑定，仅在来源已有时一并复制
+    embeddings = {}
+    if has_face_embedding:
+        cursor.execute("SELECT id, face_embedding, face_embedding_version FROM employees WHERE face_embedding IS NOT NULL")
+        embeddings = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    
     for row in rows:
-        id, name, email, hashed_password, is_admin, face_encoding, created_at, updated_at = row
+        if has_face_template:
+            (id, name, email, hashed_password, is_admin, face_encoding, face_template,
+             face_encoder_version, face_encoding_dim, created_at, updated_at) = row
+        else:
+            id, name, email, hashed_password, is_admin, face_encoding, created_at, updated_at = row
+            face_template = face_encoder_version = face_encoding_dim = None
+        face_embedding, face_embedding_version = embeddings.get(id, (None, None))
         
         # 检查用户是否已存在
         existing_employee = postgres_session.query(Employee).filter(Employee.id == id).first()
         if existing_employee:
             logger.info(f"员工 ID {id} 已存在，跳过...")
             continue
+        
+        # 仍为 JSON 格式的人脸编码在迁移时直接转换为二进制
+        if face_template is None and face_encoding:
+            try:
+                face_template, face_encoder_version, face_encoding_dim = face_template_converter(face_encoding)
+            except Exception as e:
+                logger.error(f"转换员工 ID {id} 的人脸编码失败: {str(e)}")
+                face_template = face_encoder_version = face_encoding_dim = None
             
         employee = Employee(
             id=id,
@@ -70,7 +109,12 @@ def migrate_employees(sqlite_conn, postgres_session):
             email=email,
             hashed_password=hashed_password,
             is_admin=bool_converter(is_admin),
-            face_encoding=face_encoding,
+            face_encoding=face_encoding if face_template is None else None,
+            face_template=face_template,
+            face_encoder_version=face_encoder_version,
+            face_encoding_dim=face_encoding_dim,
+            face_embedding=face_embedding,
+            face_embedding_version=face_embedding_version,
             created_at=datetime_converter(created_at),
             updated_at=datetime_converter(updated_at)
         )
@@ -1,12 +1,78 @@
 import sqlite3
 import os
-from datetime import date
+import sys
+import json
+from datetime import date, datetime
+
+# 添加父目錄到系統路徑，以便導入models模塊
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.config import settings
+from models.face_recognition import pack_face_encoding, FACE_ENCODER_VERSION
+
+def migrate_face_templates(conn, dtype):
+    """將 JSON 格式的人臉編碼轉換為二進制 face_template"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(employees)")
+    column_names = [col[1] for col in cursor.fetchall()]
+    
+    for column, column_type in (("face_template", "BLOB"),
+                                ("face_encoder_version", "TEXT"),
+                                ("face_encoding_dim", "INTEGER"),
+                                ("face_embedding", "BLOB"),
+                                ("face_embedding_version", "TEXT")):
+        if column not in column_names:
+            print(f"添加 {column} 欄位到 employees 表...")
+            cursor.execute(f"ALTER TABLE employees ADD COLUMN {column} {column_type}")
+            conn.commit()
+            print(f"成功添加 {column} 欄位")
+        else:
+            print(f"{column} 欄位已存在")
+    
+    # 逐筆轉換，避免一次將所有 JSON 讀入記憶體
+    cursor.execute("SELECT id FROM employees WHERE face_template IS NULL AND face_encoding IS NOT NULL")
+    employee_ids = [row[0] for row in cursor.fetchall()]
+    converted = 0
+    for employee_id in employee_ids:
+        cursor.execute("SELECT face_encoding FROM employees WHERE id = ?", (employee_id,))
+        face_encoding = cursor.fetchone()[0]
+        try:
+            if not face_encoding.strip():
+                cursor.execute("UPDATE employees SET face_encoding = NULL WHERE id = ?", (employee_id,))
+                continue
+            template, dim = pack_face_encoding(json.loads(face_encoding), dtype)
+            cursor.execute(
+                "UPDATE employees SET face_template = ?, face_encoder_version = ?, face_encoding_dim = ?, "
+                "face_encoding = NULL WHERE id = ?",
+                (template, FACE_ENCODER_VERSION, dim, employee_id)
+            )
+            converted += 1
+        except Exception as e:
+            print(f"轉換員工 {employee_id} 的人臉編碼失敗: {e}")
+    if converted:
+        # 記錄特徵庫變更，執行中的工作進程會重新載入人臉特徵庫
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='face_gallery_events'")
+        if cursor.fetchone():
+            cursor.execute(
+                "INSERT INTO face_gallery_events (employee_id, action, created_at) VALUES (NULL, 'reload', ?)",
+                (datetime.utcnow(),)
+            )
+    conn.commit()
+    print(f"已將 {converted} 筆人臉編碼轉換為 {dtype} 二進制格式")
+    
+    if converted:
+        # 回收舊 JSON 編碼佔用的空間
+        print("壓縮資料庫文件...")
+        conn.execute("VACUUM")
 
 def main():
     print("正在更新資料庫結構...")
     
-    # 資料庫文件路徑
-    db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "attendance.db")
+    # 資料庫文件路徑，可由命令行參數指定，預設為應用使用的 SQLite 資料庫
+    if len(sys.argv) > 1:
+        db_path = sys.argv[1]
+    else:
+        db_path = settings.sqlite_db_path
     print(f"資料庫路徑: {db_path}")
     
     try:
@@ -27,6 +93,9 @@ def main():
         else:
             print("face_encoding 欄位已存在")
         
+        # 遷移人臉編碼為二進制格式
+        migrate_face_templates(conn, settings.FACE_TEMPLATE_DTYPE)
+        
         # 檢查 clock_records 表是否存在
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='clock_records'")
         if not cursor.fetchone():
@@ -39,6 +108,9 @@ def main():
                 clock_in TIMESTAMP,
                 clock_out TIMESTAMP,
                 with_mask BOOLEAN DEFAULT 0,
+                mask_verified BOOLEAN,
+                mask_mismatch BOOLEAN,
+                mask_verified_at TIMESTAMP,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (employee_id) REFERENCES employees (id)
@@ -74,6 +146,18 @@ def main():
                 print("成功添加 with_mask 欄位")
             else:
                 print("with_mask 欄位已存在")
+            
+            # 背景口罩驗證的結果欄位
+            for column, column_type in (("mask_verified", "BOOLEAN"),
+                                        ("mask_mismatch", "BOOLEAN"),
+                                        ("mask_verified_at", "TIMESTAMP")):
+                if column not in column_names:
+                    print(f"添加 {column} 欄位到 clock_records 表...")
+                    cursor.execute(f"ALTER TABLE clock_records ADD COLUMN {column} {column_type}")
+                    conn.commit()
+                    print(f"成功添加 {column} 欄位")
+                else:
+                    print(f"{column} 欄位已存在")
         
         # 關閉連接
         conn.close()
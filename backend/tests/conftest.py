@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# 測試使用獨立的 SQLite 資料庫，須在導入 app 之前設置
+_db_dir = tempfile.mkdtemp(prefix="attendance-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'attendance.db')}?check_same_thread=False"
+
+# 添加 backend 目錄到系統路徑，以便導入 app 與 models 模塊
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,132 @@
+import base64
+from datetime import date
+
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from app.api import attendance
+from app.auth import create_access_token, get_password_hash
+from app.database import SessionLocal, Employee, ClockRecord
+
+
+@pytest.fixture
+def employee():
+    db = SessionLocal()
+    try:
+        emp = Employee(name="測試員工", email="punch-test@example.com",
+                       hashed_password=get_password_hash("secret"), is_admin=False)
+        db.add(emp)
+        db.commit()
+        db.refresh(emp)
+        yield emp.id
+        db.query(ClockRecord).filter(ClockRecord.employee_id == emp.id).delete()
+        db.query(Employee).filter(Employee.id == emp.id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def client(employee, monkeypatch):
+    # 人臉識別固定返回測試員工 (特徵庫中的員工ID為字符串)
+    async def recognize_frame(frame, deadline):
+        return str(employee)
+
+    monkeypatch.setattr(attendance, "recognize_frame", recognize_frame)
+    token = create_access_token(data={"sub": str(employee), "is_admin": False})
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {token}"
+    return client
+
+
+@pytest.fixture
+def jpeg():
+    image = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    ok, buffer = cv2.imencode(".jpg", image)
+    assert ok
+    return buffer.tobytes()
+
+
+def _record(employee_id):
+    db = SessionLocal()
+    try:
+        return db.query(ClockRecord).filter(
+            ClockRecord.employee_id == employee_id, ClockRecord.date == date.today()
+        ).first()
+    finally:
+        db.close()
+
+
+def test_clock_in_and_out_json(client, employee, jpeg):
+    image = base64.b64encode(jpeg).decode("ascii")
+
+    response = client.post("/api/attendance/clock-in",
+                           json={"employee_id": employee, "image": image, "has_mask": False})
+    assert response.status_code == 201, response.text
+    assert response.json()["success"] is True
+
+    response = client.post("/api/attendance/clock-out", json={"employee_id": employee, "image": image})
+    assert response.status_code == 200, response.text
+    assert response.json()["success"] is True
+
+    record = _record(employee)
+    assert record.clock_in is not None and record.clock_out is not None
+
+
+def test_clock_in_and_out_image(client, employee, jpeg):
+    response = client.post("/api/attendance/clock-in/image",
+                           params={"employee_id": employee, "has_mask": "false"},
+                           content=jpeg, headers={"Content-Type": "image/jpeg"})
+    assert response.status_code == 201, response.text
+    assert response.json()["success"] is True
+
+    response = client.post("/api/attendance/clock-out/image",
+                           data={"employee_id": str(employee)},
+                           files={"image": ("frame.jpg", jpeg, "image/jpeg")})
+    assert response.status_code == 200, response.text
+    assert response.json()["success"] is True
+
+    record = _record(employee)
+    assert record.clock_in is not None and record.clock_out is not None
+
+
+def test_clock_out_requires_clock_in(client, employee, jpeg):
+    response = client.post("/api/attendance/clock-out/image", params={"employee_id": employee},
+                           content=jpeg, headers={"Content-Type": "image/jpeg"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "請先打上班卡"
+
+
+def test_punch_for_other_employee_is_forbidden(client, employee):
+    response = client.post("/api/attendance/clock-out",
+                           json={"employee_id": employee + 1000, "image": "x"})
+    assert response.status_code == 403
+
+
+def test_oversized_uploads_are_rejected_before_reading(client, employee, jpeg, monkeypatch):
+    from app.config import settings
+    from app.uploads import MULTIPART_OVERHEAD
+
+    monkeypatch.setattr(settings, "MAX_IMAGE_SIZE", 1024)
+    body = b"\xff\xd8" + b"\x00" * 4096
+
+    response = client.post("/api/attendance/clock-in/image", params={"employee_id": employee},
+                           content=body, headers={"Content-Type": "image/jpeg"})
+    assert response.status_code == 413
+
+    response = client.post("/api/attendance/clock-in/image", data={"employee_id": str(employee)},
+                           files={"image": ("frame.jpg", body + b"\x00" * MULTIPART_OVERHEAD, "image/jpeg")})
+    assert response.status_code == 413
+
+    # 沒有 Content-Length (分塊傳輸) 的 multipart 上傳無法在解析前檢查大小
+    def chunks():
+        yield b"--x\r\nContent-Disposition: form-data; name=\"image\"; filename=\"a.jpg\"\r\n\r\n"
+        yield body
+        yield b"\r\n--x--\r\n"
+
+    response = client.post("/api/attendance/clock-in/image", params={"employee_id": employee}, content=chunks(),
+                           headers={"Content-Type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 411
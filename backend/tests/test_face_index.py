@@ -0,0 +1,113 @@
+import numpy as np
+
+from models.face_index import ExactFaceIndex, IVFFlatFaceIndex
+
+
+def _clustered(count, dim=32, clusters=16, seed=0):
+    """產生成群分布的向量 (模擬不同人臉編碼分布在多個區域)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32) * 4.0
+    labels = rng.integers(0, clusters, count)
+    return (centers[labels] + rng.standard_normal((count, dim)).astype(np.float32)).astype(np.float32)
+
+
+def test_exact_remove_fills_hole_with_last_row():
+    vectors = np.eye(4, dtype=np.float32)
+    index = ExactFaceIndex()
+    index.build(["a", "b", "c", "d"], vectors)
+
+    assert index.remove("b")
+    assert not index.remove("b")
+    assert len(index) == 3 and "b" not in index
+
+    # 最後一列 (d) 移到 b 的位置，向量與搜索結果仍對應正確的員工
+    ids, matrix = index.arrays()
+    assert ids == ["a", "d", "c"]
+    np.testing.assert_array_equal(index.vector("d"), vectors[3])
+    assert index.search(vectors[3])[0][0] == "d"
+    assert index.search(vectors[2])[0][0] == "c"
+
+    # 刪除最後一列不需移動
+    assert index.remove("c")
+    assert index.arrays()[0] == ["a", "d"]
+
+
+def test_exact_add_replaces_and_search_batch_matches_search():
+    vectors = _clustered(100)
+    index = ExactFaceIndex()
+    for i, vector in enumerate(vectors):
+        index.add(str(i), vector)
+    index.add("5", vectors[7])
+    assert len(index) == 100
+    np.testing.assert_array_equal(index.vector("5"), vectors[7])
+
+    probes = vectors[:10] + 0.01
+    batch = index.search_batch(probes, k=3)
+    for probe, result in zip(probes, batch):
+        single = index.search(probe, k=3)
+        assert [emp_id for emp_id, _ in result] == [emp_id for emp_id, _ in single]
+        # 距離由範數展開計算，接近 0 時有 float32 抵消誤差
+        np.testing.assert_allclose([d for _, d in result], [d for _, d in single], rtol=1e-4, atol=1e-2)
+
+
+def test_exact_shrinks_after_mass_removal():
+    vectors = _clustered(300)
+    index = ExactFaceIndex()
+    for i, vector in enumerate(vectors):
+        index.add(str(i), vector)
+    capacity = index._matrix.shape[0]
+    for i in range(290):
+        index.remove(str(i))
+    assert index._matrix.shape[0] < capacity
+    assert sorted(index.arrays()[0]) == sorted(str(i) for i in range(290, 300))
+    assert index.search(vectors[295])[0][0] == "295"
+
+
+def test_ivf_recall_against_exact():
+    vectors = _clustered(3000)
+    ids = [str(i) for i in range(len(vectors))]
+    exact = ExactFaceIndex()
+    exact.build(ids, vectors)
+    ivf = IVFFlatFaceIndex(nprobe=8, train_min=1024)
+    ivf.build(ids, vectors)
+    assert ivf.trained
+
+    probes = vectors[np.random.default_rng(1).choice(len(vectors), 200, replace=False)]
+    probes = probes + np.random.default_rng(2).standard_normal(probes.shape).astype(np.float32) * 0.3
+    hits = sum(ivf.search(probe)[0][0] == exact.search(probe)[0][0] for probe in probes)
+    assert hits / len(probes) >= 0.95
+
+    # 探測全部列表時結果與精確索引相同
+    ivf.nprobe = len(ivf._lists)
+    for probe in probes[:20]:
+        approx, truth = ivf.search(probe, k=5), exact.search(probe, k=5)
+        assert [emp_id for emp_id, _ in approx] == [emp_id for emp_id, _ in truth]
+        np.testing.assert_allclose([d for _, d in approx], [d for _, d in truth], rtol=1e-4, atol=1e-2)
+
+
+def test_ivf_add_remove_and_retrain():
+    vectors = _clustered(65)
+    index = IVFFlatFaceIndex(nlist=4, nprobe=4, train_min=32, retrain_factor=2.0)
+    for i, vector in enumerate(vectors[:32]):
+        index.add(str(i), vector)
+    assert index.trained and index._trained_size == 32
+
+    # 替換向量可能換到另一個列表，舊列表中的向量須被移除
+    index.add("0", vectors[40])
+    assert len(index) == 32
+    assert sum("0" in inverted_list for inverted_list in index._lists) == 1
+    assert index.search(vectors[40])[0][0] == "0"
+
+    assert index.remove("1")
+    assert not index.remove("1")
+    assert "1" not in index and index.vector("1") is None
+    assert all(emp_id != "1" for emp_id, _ in index.search(vectors[1], k=5))
+
+    # 規模增長到訓練時的兩倍後自動重新訓練
+    for i, vector in enumerate(vectors[32:], start=32):
+        index.add(str(i), vector)
+    assert index._trained_size == len(index) == 64
+    ids, matrix = index.arrays()
+    assert sorted(ids) == sorted(str(i) for i in range(65) if i != 1)
+    for emp_id in ids:
+        np.testing.assert_array_equal(index.vector(emp_id), matrix[ids.index(emp_id)])
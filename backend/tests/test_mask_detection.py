@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from models import mask_detection
+
+
+@pytest.fixture
+def failing_model(monkeypatch):
+    calls = []
+
+    def load_layers_model(path):
+        calls.append(path)
+        raise FileNotFoundError("缺少權重分片")
+
+    monkeypatch.setattr(mask_detection, "load_layers_model", load_layers_model)
+    monkeypatch.setattr(mask_detection, "mask_model", None)
+    monkeypatch.setattr(mask_detection, "mask_classifier_backend", None)
+    monkeypatch.setattr(mask_detection, "_load_failed_at", None)
+    return calls
+
+
+def test_failed_model_load_is_retried_only_after_backoff(failing_model, monkeypatch):
+    crops = [np.zeros((40, 40, 3), dtype=np.uint8)] * 2
+
+    for _ in range(5):
+        assert mask_detection.classify_masks(crops, bgr=True) == [False, False]
+    assert mask_detection.warm_up_mask_model() is False
+    with pytest.raises(RuntimeError):
+        mask_detection.classify_masks(crops, strict=True)
+    assert len(failing_model) == 1
+
+    # 超過重試間隔後重新嘗試載入
+    monkeypatch.setattr(mask_detection, "_load_failed_at",
+                        mask_detection._load_failed_at - mask_detection.MODEL_RETRY_INTERVAL - 1)
+    assert mask_detection.detect_masks(crops) == [False, False]
+    assert len(failing_model) == 2
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import punch_debounce
+from app.punch_debounce import PunchDebouncer
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(punch_debounce, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _record(employee_id=7, clock_in=None, clock_out=None):
+    return SimpleNamespace(employee_id=employee_id, clock_in=clock_in, clock_out=clock_out)
+
+
+def test_recent_returns_last_result_within_window(clock):
+    debouncer = PunchDebouncer(window=300)
+    result = {"success": True, "type": "clock_in"}
+    debouncer.remember(7, result)
+
+    # 特徵庫中的員工ID為字符串，與整數ID視為同一員工
+    assert debouncer.recent("7") == {**result, "debounced": True}
+    assert debouncer.recent(8) is None
+    clock.now += 299
+    assert debouncer.recent(7) is not None
+    clock.now += 2
+    assert debouncer.recent(7) is None
+    assert debouncer.stats()["employees"] == 0 and debouncer.hits == 2
+
+
+def test_remember_counts_age_of_earlier_punch(clock):
+    debouncer = PunchDebouncer(window=300)
+    debouncer.remember(7, {"success": True}, punched_at=datetime.now() - timedelta(seconds=250))
+    clock.now += 49
+    assert debouncer.recent(7) is not None
+    clock.now += 2
+    assert debouncer.recent(7) is None
+
+
+def test_remember_evicts_expired_and_oldest_entries(clock):
+    debouncer = PunchDebouncer(window=300, max_entries=2)
+    debouncer.remember(1, {"success": True})
+    debouncer.remember(2, {"success": True})
+    debouncer.remember(3, {"success": True})
+    assert debouncer.recent(1) is None and debouncer.recent(3) is not None
+
+    clock.now += 301
+    debouncer.remember(4, {"success": True})
+    assert debouncer.stats()["employees"] == 1
+
+
+def test_from_record_falls_back_to_database(clock):
+    debouncer = PunchDebouncer(window=300)
+    now = datetime.now()
+
+    # 其他工作進程剛寫入的上班打卡
+    result = debouncer.from_record(_record(clock_in=now - timedelta(seconds=30)), "王小明", now)
+    assert result["debounced"] is True
+    assert result["type"] == "clock_in" and result["employee_name"] == "王小明"
+    assert result["timestamp"] == (now - timedelta(seconds=30)).isoformat()
+    # 資料庫後備命中後記住結果，下一次不必再查詢資料庫
+    assert debouncer.recent(7)["type"] == "clock_in"
+
+    # 下班打卡優先於上班打卡
+    record = _record(clock_in=now - timedelta(hours=8), clock_out=now - timedelta(seconds=10))
+    assert debouncer.from_record(record, "王小明", now)["type"] == "clock_out"
+
+
+def test_from_record_ignores_old_or_missing_punches(clock):
+    debouncer = PunchDebouncer(window=300)
+    now = datetime(2024, 5, 6, 9, 0, 0)
+
+    assert debouncer.from_record(None, "王小明", now) is None
+    assert debouncer.from_record(_record(), "王小明", now) is None
+    assert debouncer.from_record(_record(clock_in=now - timedelta(seconds=301)), "王小明", now) is None
+    assert debouncer.recent(7) is None
+
+
+def test_disabled_debouncer(clock):
+    debouncer = PunchDebouncer(window=0)
+    now = datetime.now()
+    debouncer.remember(7, {"success": True})
+    assert debouncer.recent(7) is None
+    assert debouncer.from_record(_record(clock_in=now), "王小明", now) is None
@@ -0,0 +1,160 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import punch_replay
+from app.punch_replay import PunchReplayCache, payload_key
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    # 只替換本模塊的時鐘，事件循環仍使用真實的 time.monotonic
+    monkeypatch.setattr(punch_replay, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_payload_key_separates_kiosk_and_mask():
+    assert payload_key(b"frame", "kiosk:a", False) == payload_key(b"frame", "kiosk:a", False)
+    assert payload_key("frame", "kiosk:a", False) == payload_key(b"frame", "kiosk:a", False)
+    assert payload_key(b"frame", "kiosk:a", False) != payload_key(b"frame", "kiosk:b", False)
+    assert payload_key(b"frame", "kiosk:a", False) != payload_key(b"frame", "kiosk:a", True)
+
+
+def test_successful_result_is_replayed_until_ttl(clock):
+    cache = PunchReplayCache(ttl=10, max_entries=8)
+    calls = []
+
+    async def process():
+        calls.append(1)
+        return {"success": True, "employee_id": 7}
+
+    async def scenario():
+        first = await cache.run(b"k", process)
+        assert "duplicate" not in first
+        clock.now += 9
+        assert await cache.run(b"k", process) == {**first, "duplicate": True}
+        clock.now += 2
+        assert "duplicate" not in await cache.run(b"k", process)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert cache.hits == 1 and cache.misses == 2
+
+
+def test_failures_are_not_cached(clock):
+    cache = PunchReplayCache(ttl=10, max_entries=8)
+    results = iter([{"success": False, "detail": "未識別到人臉"}, {"success": True}])
+
+    async def process():
+        return next(results)
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await cache.run(b"k", fail)
+        assert (await cache.run(b"k", process))["success"] is False
+        assert (await cache.run(b"k", process))["success"] is True
+
+    asyncio.run(scenario())
+    assert cache.stats()["entries"] == 1 and cache.stats()["inflight"] == 0
+
+
+def test_lru_eviction(clock):
+    cache = PunchReplayCache(ttl=10, max_entries=2)
+
+    async def process():
+        return {"success": True}
+
+    async def scenario():
+        for key in (b"a", b"b"):
+            await cache.run(key, process)
+        await cache.run(b"a", process)  # a 成為最近使用
+        await cache.run(b"c", process)  # 淘汰 b
+        assert (await cache.run(b"a", process)).get("duplicate")
+        assert not (await cache.run(b"b", process)).get("duplicate")
+
+    asyncio.run(scenario())
+
+
+def test_inflight_duplicates_wait_for_first_request():
+    cache = PunchReplayCache(ttl=10, max_entries=8)
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def process():
+            calls.append(1)
+            await release.wait()
+            return {"success": True, "record_id": 1}
+
+        first = asyncio.ensure_future(cache.run(b"k", process))
+        await asyncio.sleep(0)
+        duplicates = [asyncio.ensure_future(cache.run(b"k", process)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert cache.stats()["inflight"] == 1
+        release.set()
+        return await first, await asyncio.gather(*duplicates)
+
+    first, duplicates = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert "duplicate" not in first
+    assert all(result == {**first, "duplicate": True} for result in duplicates)
+
+
+def test_inflight_duplicates_retry_when_first_request_fails():
+    cache = PunchReplayCache(ttl=10, max_entries=8)
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def fail():
+            calls.append("fail")
+            await release.wait()
+            raise RuntimeError("boom")
+
+        async def process():
+            calls.append("process")
+            return {"success": True}
+
+        first = asyncio.ensure_future(cache.run(b"k", fail))
+        await asyncio.sleep(0)
+        duplicate = asyncio.ensure_future(cache.run(b"k", process))
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(RuntimeError):
+            await first
+        return await duplicate
+
+    result = asyncio.run(scenario())
+    assert calls == ["fail", "process"]
+    assert result == {"success": True}
+
+
+def test_disabled_cache_always_processes():
+    cache = PunchReplayCache(ttl=0, max_entries=8)
+    calls = []
+
+    async def process():
+        calls.append(1)
+        return {"success": True}
+
+    async def scenario():
+        for _ in range(3):
+            assert "duplicate" not in await cache.run(b"k", process)
+
+    asyncio.run(scenario())
+    assert len(calls) == 3 and cache.stats()["entries"] == 0
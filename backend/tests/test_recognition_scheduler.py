@@ -0,0 +1,108 @@
+import asyncio
+import ipaddress
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from main import app
+from app import vision
+from app.vision import RecognitionScheduler, VisionOverloaded, VisionTimeout, kiosk_id
+
+
+def _request(host, kiosk=None):
+    headers = [(b"x-kiosk-id", kiosk.encode())] if kiosk else []
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers, "client": (host, 5000)})
+
+
+def test_admission_queue_limit_and_retry_after():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 5
+        scheduler = RecognitionScheduler(slots=1, max_queue=2)
+
+        started_at = await scheduler.acquire("a", deadline)
+        waiting = [asyncio.ensure_future(scheduler.acquire("a", deadline)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert scheduler.depth == 2
+
+        # 隊列已滿時立即拒絕，並給出至少1秒的重試建議
+        with pytest.raises(VisionOverloaded) as overloaded:
+            await scheduler.acquire("b", deadline)
+        assert 1 <= overloaded.value.retry_after <= 60
+        assert scheduler.rejected == 1
+
+        # 釋放名額後依序移交給排隊中的請求
+        scheduler.release(started_at)
+        second = await waiting[0]
+        assert not waiting[1].done() and scheduler.depth == 1
+        scheduler.release(second)
+        scheduler.release(await waiting[1])
+        stats = scheduler.stats()
+        assert stats["in_flight"] == 0 and stats["queue_depth"] == 0 and stats["admitted"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_queued_kiosks_are_served_round_robin():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 5
+        scheduler = RecognitionScheduler(slots=1, max_queue=10)
+        order = []
+
+        async def punch(kiosk):
+            started_at = await scheduler.acquire(kiosk, deadline)
+            order.append(kiosk)
+            await asyncio.sleep(0)
+            scheduler.release(started_at)
+
+        first = await scheduler.acquire("a", deadline)
+        tasks = [asyncio.ensure_future(punch(kiosk)) for kiosk in ("a", "a", "a", "b", "c")]
+        await asyncio.sleep(0)
+        scheduler.release(first)
+        await asyncio.gather(*tasks)
+        # 打卡機 a 連續排了三個請求，b 與 c 不必等 a 全部處理完
+        assert order == ["a", "b", "c", "a", "a"]
+
+    asyncio.run(scenario())
+
+
+def test_expired_waiter_leaves_the_queue():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        scheduler = RecognitionScheduler(slots=1, max_queue=2)
+        started_at = await scheduler.acquire("a", loop.time() + 5)
+
+        with pytest.raises(VisionTimeout):
+            await scheduler.acquire("b", loop.time() + 0.01)
+        assert scheduler.depth == 0 and scheduler.expired == 1
+
+        # 逾時的請求不會佔用名額，釋放後下一個請求立即取得
+        scheduler.release(started_at)
+        scheduler.release(await scheduler.acquire("c", loop.time() + 5))
+        assert scheduler.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_overloaded_route_returns_503_with_retry_after(monkeypatch):
+    monkeypatch.setattr(vision, "recognition_scheduler", RecognitionScheduler(slots=0, max_queue=0))
+    client = TestClient(app)
+
+    response = client.post("/api/attendance/direct-clock", json={"image": "eA==", "with_mask": False})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_kiosk_header_is_trusted_only_from_allowed_networks(monkeypatch):
+    monkeypatch.setattr(vision, "kiosk_trusted_networks", (ipaddress.ip_network("10.0.0.0/24"),))
+
+    assert kiosk_id(_request("10.0.0.5", "lobby")) == "kiosk:lobby"
+    assert kiosk_id(_request("10.0.0.5")) == "10.0.0.5"
+    # 其他來源輪換標頭不會取得新的隊列
+    assert kiosk_id(_request("192.168.1.9", "lobby")) == "192.168.1.9"
+    assert kiosk_id(_request("192.168.1.9", "other")) == "192.168.1.9"
+
+    monkeypatch.setattr(vision, "kiosk_trusted_networks", ())
+    assert kiosk_id(_request("10.0.0.5", "lobby")) == "10.0.0.5"
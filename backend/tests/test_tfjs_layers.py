@@ -0,0 +1,246 @@
+import json
+
+import numpy as np
+import pytest
+
+from models.tfjs_layers import LayersModelError, build_layers_model, load_layers_model
+
+
+# 參考實現：逐個輸出位置直接計算，不依賴推論引擎的 im2col、分塊與融合
+
+def _ref_pad(x, kernel, stride, dilation, padding, value=0.0):
+    if padding == "valid":
+        return x
+    pads = []
+    for size, k, s, d in zip(x.shape[1:3], kernel, stride, dilation):
+        out = -(-size // s)
+        total = max((out - 1) * s + (k - 1) * d + 1 - size, 0)
+        pads.append((total // 2, total - total // 2))
+    return np.pad(x, ((0, 0), pads[0], pads[1], (0, 0)), constant_values=value)
+
+
+def _ref_patches(x, kernel, stride, dilation):
+    eff_h, eff_w = (kernel[0] - 1) * dilation[0] + 1, (kernel[1] - 1) * dilation[1] + 1
+    out_h = (x.shape[1] - eff_h) // stride[0] + 1
+    out_w = (x.shape[2] - eff_w) // stride[1] + 1
+    for i in range(out_h):
+        for j in range(out_w):
+            top, left = i * stride[0], j * stride[1]
+            yield i, j, x[:, top:top + eff_h:dilation[0], left:left + eff_w:dilation[1], :]
+
+
+def _ref_conv(x, kernel, bias=None, stride=(1, 1), padding="valid", dilation=(1, 1)):
+    x = _ref_pad(x, kernel.shape[:2], stride, dilation, padding)
+    patches = list(_ref_patches(x, kernel.shape[:2], stride, dilation))
+    out = np.zeros((x.shape[0], patches[-1][0] + 1, patches[-1][1] + 1, kernel.shape[3]), dtype=np.float64)
+    for i, j, patch in patches:
+        out[:, i, j] = np.einsum("nhwc,hwck->nk", patch, kernel)
+    return out if bias is None else out + bias
+
+
+def _ref_depthwise(x, kernel, bias=None, stride=(1, 1), padding="valid", dilation=(1, 1)):
+    x = _ref_pad(x, kernel.shape[:2], stride, dilation, padding)
+    patches = list(_ref_patches(x, kernel.shape[:2], stride, dilation))
+    channels = kernel.shape[2] * kernel.shape[3]
+    out = np.zeros((x.shape[0], patches[-1][0] + 1, patches[-1][1] + 1, channels), dtype=np.float64)
+    for i, j, patch in patches:
+        out[:, i, j] = np.einsum("nhwc,hwcm->ncm", patch, kernel).reshape(x.shape[0], channels)
+    return out if bias is None else out + bias
+
+
+def _ref_batch_norm(x, w, epsilon=1e-3):
+    return w["gamma"] * (x - w["moving_mean"]) / np.sqrt(w["moving_variance"] + epsilon) + w["beta"]
+
+
+def _ref_max_pool_same(x, pool):
+    x = _ref_pad(x, (pool, pool), (pool, pool), (1, 1), "same", value=-np.inf)
+    patches = list(_ref_patches(x, (pool, pool), (pool, pool), (1, 1)))
+    out = np.zeros((x.shape[0], patches[-1][0] + 1, patches[-1][1] + 1, x.shape[3]))
+    for i, j, patch in patches:
+        out[:, i, j] = patch.max(axis=(1, 2))
+    return out
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+# 測試模型的拓撲與權重
+
+def _layer(class_name, name, inbound=None, **config):
+    nodes = [] if inbound is None else [[[source, 0, 0, {}] for source in inbound]]
+    return {"class_name": class_name, "name": name, "config": {"name": name, **config}, "inbound_nodes": nodes}
+
+
+def _bn_weights(rng, channels):
+    return {
+        "gamma": rng.uniform(0.5, 1.5, channels).astype(np.float32),
+        "beta": rng.normal(0, 0.1, channels).astype(np.float32),
+        "moving_mean": rng.normal(0, 0.1, channels).astype(np.float32),
+        "moving_variance": rng.uniform(0.5, 1.5, channels).astype(np.float32),
+    }
+
+
+def _branching_model(rng):
+    """含填充、BN 折疊、ReLU 融合、sigmoid 深度卷積、分支相加、池化與 softmax 的函數式模型"""
+    layers = [
+        _layer("InputLayer", "input", batch_input_shape=[None, 15, 17, 3]),
+        _layer("ZeroPadding2D", "pad", ["input"], padding=[[1, 0], [0, 1]]),
+        _layer("Conv2D", "conv1", ["pad"], filters=4, kernel_size=[3, 3], strides=[2, 2],
+               padding="valid", activation="linear", use_bias=False),
+        _layer("BatchNormalization", "bn1", ["conv1"], epsilon=1e-3),
+        _layer("ReLU", "relu1", ["bn1"], max_value=6.0),
+        _layer("DepthwiseConv2D", "dw", ["relu1"], kernel_size=[3, 3], strides=[1, 1], padding="same",
+               depth_multiplier=2, activation="sigmoid", use_bias=True),
+        _layer("Conv2D", "conv2", ["dw"], filters=5, kernel_size=[1, 1], padding="valid", activation="relu"),
+        _layer("Conv2D", "branch", ["dw"], filters=5, kernel_size=[3, 3], padding="same",
+               dilation_rate=[2, 2], activation="tanh"),
+        _layer("Add", "add", ["conv2", "branch"]),
+        _layer("MaxPooling2D", "pool", ["add"], pool_size=[2, 2], padding="same"),
+        _layer("GlobalAveragePooling2D", "gap", ["pool"]),
+        _layer("Dropout", "drop", ["gap"], rate=0.5),
+        _layer("Dense", "dense", ["drop"], units=2, activation="softmax"),
+    ]
+    topology = {"class_name": "Model", "config": {
+        "layers": layers, "input_layers": [["input", 0, 0]], "output_layers": [["dense", 0, 0]]}}
+    w = {
+        "conv1/kernel": rng.normal(0, 0.5, (3, 3, 3, 4)).astype(np.float32),
+        "bn1": _bn_weights(rng, 4),
+        "dw/depthwise_kernel": rng.normal(0, 0.5, (3, 3, 4, 2)).astype(np.float32),
+        "dw/bias": rng.normal(0, 0.1, 8).astype(np.float32),
+        "conv2/kernel": rng.normal(0, 0.5, (1, 1, 8, 5)).astype(np.float32),
+        "conv2/bias": rng.normal(0, 0.1, 5).astype(np.float32),
+        "branch/kernel": rng.normal(0, 0.3, (3, 3, 8, 5)).astype(np.float32),
+        "branch/bias": rng.normal(0, 0.1, 5).astype(np.float32),
+        "dense/kernel": rng.normal(0, 0.5, (5, 2)).astype(np.float32),
+        "dense/bias": rng.normal(0, 0.1, 2).astype(np.float32),
+    }
+
+    def reference(x):
+        x = np.pad(x.astype(np.float64), ((0, 0), (1, 0), (0, 1), (0, 0)))
+        x = _ref_conv(x, w["conv1/kernel"], stride=(2, 2))
+        x = np.clip(_ref_batch_norm(x, w["bn1"]), 0.0, 6.0)
+        x = _sigmoid(_ref_depthwise(x, w["dw/depthwise_kernel"], w["dw/bias"], padding="same"))
+        main = np.maximum(_ref_conv(x, w["conv2/kernel"], w["conv2/bias"]), 0.0)
+        branch = np.tanh(_ref_conv(x, w["branch/kernel"], w["branch/bias"], padding="same", dilation=(2, 2)))
+        x = _ref_max_pool_same(main + branch, 2).mean(axis=(1, 2))
+        return _softmax(x @ w["dense/kernel"] + w["dense/bias"])
+
+    return topology, _flatten_weights(w), reference
+
+
+def _sequential_model(rng):
+    """Sequential 模型：步進深度卷積後接 BN (折疊進深度卷積) 與 ReLU (融合為就地激活)"""
+    layers = [
+        {"class_name": "Conv2D", "config": {"name": "conv", "batch_input_shape": [None, 12, 10, 2], "filters": 3,
+                                            "kernel_size": [3, 3], "padding": "same", "activation": "linear"}},
+        {"class_name": "DepthwiseConv2D", "config": {"name": "dw", "kernel_size": [3, 3], "strides": [2, 2],
+                                                     "padding": "same", "depth_multiplier": 1,
+                                                     "activation": "linear", "use_bias": False}},
+        {"class_name": "BatchNormalization", "config": {"name": "bn", "epsilon": 1e-3}},
+        {"class_name": "ReLU", "config": {"name": "relu"}},
+        {"class_name": "Flatten", "config": {"name": "flatten"}},
+        {"class_name": "Dense", "config": {"name": "dense", "units": 3, "activation": "linear"}},
+    ]
+    topology = {"model_config": {"class_name": "Sequential", "config": {"name": "seq", "layers": layers}}}
+    w = {
+        "conv/kernel": rng.normal(0, 0.5, (3, 3, 2, 3)).astype(np.float32),
+        "conv/bias": rng.normal(0, 0.1, 3).astype(np.float32),
+        "dw/depthwise_kernel": rng.normal(0, 0.5, (3, 3, 3, 1)).astype(np.float32),
+        "bn": _bn_weights(rng, 3),
+        "dense/kernel": rng.normal(0, 0.2, (6 * 5 * 3, 3)).astype(np.float32),
+        "dense/bias": rng.normal(0, 0.1, 3).astype(np.float32),
+    }
+
+    def reference(x):
+        x = _ref_conv(x.astype(np.float64), w["conv/kernel"], w["conv/bias"], padding="same")
+        x = _ref_depthwise(x, w["dw/depthwise_kernel"], stride=(2, 2), padding="same")
+        x = np.maximum(_ref_batch_norm(x, w["bn"]), 0.0)
+        return x.reshape(len(x), -1) @ w["dense/kernel"] + w["dense/bias"]
+
+    return topology, _flatten_weights(w), reference
+
+
+def _flatten_weights(w):
+    weights = {}
+    for name, value in w.items():
+        if isinstance(value, dict):
+            weights.update({f"{name}/{key}": array for key, array in value.items()})
+        else:
+            weights[name] = value
+    return weights
+
+
+@pytest.mark.parametrize("make_model", [_branching_model, _sequential_model])
+def test_forward_pass_matches_reference(make_model):
+    rng = np.random.default_rng(0)
+    topology, weights, reference = make_model(rng)
+    model = build_layers_model(topology, weights)
+
+    batch = rng.uniform(0, 1, (3,) + tuple(model.input_shape[1:])).astype(np.float32)
+    np.testing.assert_allclose(model.predict(batch), reference(batch), rtol=1e-4, atol=1e-5)
+
+
+def test_predict_splits_large_batches():
+    rng = np.random.default_rng(1)
+    topology, weights, reference = _branching_model(rng)
+    model = build_layers_model(topology, weights)
+
+    batch = rng.uniform(0, 1, (model.max_batch * 2 + 1, 15, 17, 3)).astype(np.float32)
+    np.testing.assert_allclose(model.predict(batch), reference(batch), rtol=1e-4, atol=1e-5)
+    with pytest.raises(ValueError):
+        model.predict(batch[:, :10])
+
+
+def test_load_quantized_model_from_disk(tmp_path):
+    rng = np.random.default_rng(2)
+    topology, weights, _ = _sequential_model(rng)
+
+    # 以 uint8 量化 dense/kernel、以 float16 保存 conv/kernel，其餘為 float32，權重跨兩個分片
+    manifest, chunks = [], []
+    for name, value in weights.items():
+        spec = {"name": name, "shape": list(value.shape), "dtype": "float32"}
+        if name == "dense/kernel":
+            low, scale = float(value.min()), float(value.max() - value.min()) / 255
+            quantized = np.round((value - low) / scale).astype(np.uint8)
+            weights[name] = quantized.astype(np.float32) * scale + low
+            spec["quantization"] = {"dtype": "uint8", "scale": scale, "min": low}
+            chunks.append(quantized.tobytes())
+        elif name == "conv/kernel":
+            weights[name] = value.astype(np.float16).astype(np.float32)
+            spec["quantization"] = {"dtype": "float16"}
+            chunks.append(value.astype(np.float16).tobytes())
+        else:
+            chunks.append(value.tobytes())
+        manifest.append(spec)
+    data = b"".join(chunks)
+    half = len(data) // 2
+    (tmp_path / "group1-shard1of2.bin").write_bytes(data[:half])
+    (tmp_path / "group1-shard2of2.bin").write_bytes(data[half:])
+    model_json = {"format": "layers-model", "modelTopology": topology, "weightsManifest": [
+        {"paths": ["group1-shard1of2.bin", "group1-shard2of2.bin"], "weights": manifest}]}
+    (tmp_path / "model.json").write_text(json.dumps(model_json))
+
+    model = load_layers_model(str(tmp_path / "model.json"))
+    batch = rng.uniform(0, 1, (2, 12, 10, 2)).astype(np.float32)
+    np.testing.assert_allclose(model.predict(batch), build_layers_model(topology, weights).predict(batch),
+                               rtol=1e-5, atol=1e-6)
+
+    # 缺少分片時載入失敗 (口罩模型隨應用發佈時分片不完整即屬此情況)
+    (tmp_path / "group1-shard2of2.bin").unlink()
+    with pytest.raises(FileNotFoundError):
+        load_layers_model(str(tmp_path / "model.json"))
+
+
+def test_unsupported_layer_is_rejected():
+    topology = {"class_name": "Model", "config": {
+        "layers": [_layer("InputLayer", "input", batch_input_shape=[None, 4, 4, 1]),
+                   _layer("LSTM", "lstm", ["input"], units=2)],
+        "input_layers": [["input", 0, 0]], "output_layers": [["lstm", 0, 0]]}}
+    with pytest.raises(LayersModelError):
+        build_layers_model(topology, {})
@@ -2,6 +2,8 @@ import sqlite3
 import os
 import logging
 
+from app.config import settings
+
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("update_db")
@@ -9,8 +11,8 @@ logger = logging.getLogger("update_db")
 def update_db_structure():
     """更新數據庫結構，添加缺少的欄位"""
     try:
-        # 確保我們在正確的目錄中
-        db_path = 'attendance.db'
+        # 使用應用實際使用的 SQLite 資料庫 (新增欄位另見 scripts/update_db.py)
+        db_path = settings.sqlite_db_path
         if not os.path.exists(db_path):
             logger.error(f"數據庫文件 {db_path} 不存在")
             return False